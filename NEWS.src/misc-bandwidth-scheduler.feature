@@ -0,0 +1 @@
+BandwidthScheduler provides upload and download budgets, with optional per host limits, that every transfer of the clients sharing it draws from.
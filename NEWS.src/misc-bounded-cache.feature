@@ -0,0 +1 @@
+The instance cache may now be bounded by number of entries and approximate memory use with maxCacheEntries and maxCacheBytes, using LRU or LFU eviction (cachePolicy). Modified instances are never evicted and cache statistics are available from cache.stats().
@@ -0,0 +1 @@
+The instance cache now honors the Cache-Control and Expires headers of GET responses, including no-store, no-cache and stale-while-revalidate, and accepts a default cacheTTL for responses without them.
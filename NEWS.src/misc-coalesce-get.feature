@@ -0,0 +1 @@
+Concurrent GET requests for the same resource are now coalesced into a single request whose result is shared by all callers.
@@ -0,0 +1 @@
+PUT and POST documents of at least compressThreshold bytes are sent gzip compressed, falling back to uncompressed bodies if the server answers 415.
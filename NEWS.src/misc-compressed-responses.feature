@@ -0,0 +1 @@
+Clients send Accept-Encoding: gzip, deflate by default, configurable with acceptEncoding, and decompress responses as they are read.
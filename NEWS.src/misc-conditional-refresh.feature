@@ -0,0 +1 @@
+Resources now remember their ETag and Last-Modified validators and refresh() makes a conditional request, reusing the existing object tree when the server answers 304 Not Modified.
@@ -0,0 +1 @@
+Dispatcher workers now share a single per host connection pool. maxConnections limits the connections to each host (defaulting to maxClients), workers wait in turn for a free connection instead of requeueing requests, minIdleConnections keeps idle connections open, and pool statistics are available from connectionStats.
@@ -0,0 +1 @@
+HTTPClient.download writes the body of a resource straight into a file, or open file descriptor, through a reusable buffer and atomically replaces the destination path once complete.
@@ -0,0 +1 @@
+Futures may be watched through robj.lib.futures.CompletionQueue, which exposes a pollable file descriptor for event loop integration. Resources and collections can be resolved without blocking through submit_getattr and submit_iter.
@@ -0,0 +1 @@
+Added submit_GET, submit_POST, submit_PUT and submit_DELETE to the glue and http clients. They return futures, which may be collected with robj.as_completed and robj.wait.
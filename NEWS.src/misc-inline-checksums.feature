@@ -0,0 +1 @@
+Checksums of response bodies, uploads and downloads can be computed while they are transferred, and response bodies checked against Content-MD5 and Digest headers.
@@ -0,0 +1 @@
+do_GET(uri, iterparse=True) returns a collection that is parsed while the response is read, yielding each member as soon as it arrives.
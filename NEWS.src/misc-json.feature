@@ -0,0 +1 @@
+The preferJSON option asks servers for JSON documents, which are parsed into the same objects as XML ones, and sends documents back as JSON once the server has sent one.
@@ -0,0 +1 @@
+Response documents are only parsed once their contents are needed, attributes of the top level element such as id are read without parsing.
@@ -0,0 +1 @@
+Documents retrieved with the submit methods are parsed on the worker that retrieved them, large documents can be parsed in a pool of processes with the parseProcesses option.
@@ -0,0 +1 @@
+Documents are parsed with cElementTree or lxml when available, falling back to xobj, selected with the parser option.
@@ -0,0 +1 @@
+HTTPClient.download accepts parts to fetch large files as concurrent byte ranges, written into one preallocated file, resuming interrupted downloads from the ranges already completed. The test server can serve byte ranges.
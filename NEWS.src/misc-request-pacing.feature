@@ -0,0 +1 @@
+The dispatcher no longer sleeps for a tenth of a second after every request. Requests may instead be paced per host by passing requestRate and requestBurst to rObj.
@@ -0,0 +1 @@
+Requests now signal completion to waiting threads with an event rather than polling every tenth of a second.
@@ -0,0 +1 @@
+HTTPClient and rObj accept a responseCache database path; GET responses are stored there with their validators and expiration time so that later processes can rebuild instances without downloading them again.
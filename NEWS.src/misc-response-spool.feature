@@ -0,0 +1 @@
+Response bodies are now kept in memory up to a configurable spoolSize and only written to a temporary file, in spoolDir, when they are larger.
@@ -0,0 +1 @@
+HTTPData accepts resumable=True to upload in segments sent with a Content-Range header, resuming from the last offset the server acknowledged when a segment fails.
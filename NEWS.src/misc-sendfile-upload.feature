@@ -0,0 +1 @@
+Uploads of regular files over plain HTTP are sent with sendfile where available, and otherwise through a large reusable buffer instead of 8KiB reads.
@@ -0,0 +1 @@
+HTTPClient.do_GET accepts stream=True to get a file like object that reads the response body directly from the connection, which is returned to the pool once the body has been read.
@@ -28,17 +28,36 @@ Example usage:
 >>> api = robj.connect('http://www.rpath.org/api/')
 >>> products = api.products
 >>> print products[0].name
+
+Requests can also be made without blocking, fanning out across the worker
+threads when maxClients is greater than one:
+
+>>> from robj.glue import HTTPClient
+>>> client = HTTPClient('http://www.rpath.org/api/', maxClients=10)
+>>> products = client.do_GET('/').products
+>>> futures = [ client.submit_GET(x.id) for x in products ]
+>>> for future in robj.as_completed(futures):
+...     print future.result().name
 """
 
 from robj.lib.httputil import HTTPData  # pyflakes=ignore
+from robj.lib.futures import wait  # pyflakes=ignore
+from robj.lib.futures import as_completed  # pyflakes=ignore
+from robj.lib.ratelimit import BandwidthScheduler  # pyflakes=ignore
 from robj.glue import HTTPClient as _HTTPClient
 from robj.lib.log import setupLogging as _setupLogging
 
-__all__ = ['rObj', 'connect', 'open', 'HTTPData', ]
+__all__ = ['rObj', 'connect', 'open', 'HTTPData', 'as_completed', 'wait',
+    'BandwidthScheduler', ]
 
 
 def rObj(uri, headers=None, maxClients=None, maxConnections=None,
-        logging=False, maxRedirects=None):
+        logging=False, maxRedirects=None, requestRate=None, requestBurst=None,
+        minIdleConnections=None, maxCacheEntries=None, maxCacheBytes=None,
+        cachePolicy=None, cacheTTL=None, responseCache=None, spoolSize=None,
+        spoolDir=None, bandwidth=None, digests=None, verifyDigests=False,
+        acceptEncoding=None, compressThreshold=None, parser=None,
+        parseInBackground=True, parseProcesses=None, preferJSON=False):
     """
     @param uri: URI for connectiong to the root of the desired web service. This
                 may contain user information and must be http or https.
@@ -49,14 +68,94 @@ def rObj(uri, headers=None, maxClients=None, maxConnections=None,
                        handle requets. Works are created as needed, rather than
                        being preallocated. (default: 10)
     @type maxClients: int
-    @param maxConnections: The maximum number of connections each client thread
-                           should cache. Client threads only cache one
-                           connection per host. This should only matter if you
-                           are talking to multiple hosts. (default: 2)
+    @param maxConnections: The maximum number of connections to each host,
+                           shared by all workers. Workers wait for a free
+                           connection once this is reached.
+                           (default: maxClients)
     @type maxConnections: int
+    @param minIdleConnections: The number of idle connections to each host to
+                               keep open when cleaning up idle connections.
+                               (default: 0)
+    @type minIdleConnections: int
     @param maxRedirects: The maximum number of redirects that will be followed
                          before an exception is raised. (default: 10)
     @type maxRedirects: int
+    @param requestRate: The maximum number of requests per second to send to
+                        any one host. Requests are not paced if this is not
+                        set. (default: None)
+    @type requestRate: float
+    @param requestBurst: The number of requests to a host that may be sent back
+                         to back before pacing applies. (default: 1)
+    @type requestBurst: int
+    @param maxCacheEntries: The maximum number of instances to keep in the
+                            instance cache. (default: no limit)
+    @type maxCacheEntries: int
+    @param maxCacheBytes: The maximum approximate number of bytes of memory
+                          used by instances in the instance cache.
+                          (default: no limit)
+    @type maxCacheBytes: int
+    @param cachePolicy: The instance cache eviction policy, 'lru' or 'lfu'.
+                        (default: 'lru')
+    @type cachePolicy: str
+    @param cacheTTL: The number of seconds a cached instance is used without
+                     checking with the server if the response that it was
+                     created from did not include Cache-Control or Expires
+                     headers. (default: never expires)
+    @type cacheTTL: int
+    @param responseCache: Path to a database in which to keep GET responses
+                          so that they can be shared with later processes.
+                          (default: None)
+    @type responseCache: str
+    @param spoolSize: Size in bytes up to which response bodies are kept in
+                      memory rather than written to a temporary file.
+                      (default: 256KiB)
+    @type spoolSize: int
+    @param spoolDir: Directory to write larger response bodies to.
+                     (default: the system temporary directory)
+    @type spoolDir: str
+    @param bandwidth: Bandwidth budget that all uploads and downloads draw
+                      from. The same instance may be shared by several
+                      clients. (default: unlimited)
+    @type bandwidth: robj.lib.ratelimit.BandwidthScheduler
+    @param digests: Names of hashlib algorithms, such as md5 or sha256, to
+                    compute checksums of response bodies with while they are
+                    read. (default: None)
+    @type digests: list
+    @param verifyDigests: Check response bodies against any Content-MD5 and
+                          Digest headers sent by the server, raising
+                          HTTPChecksumError if they don't match.
+                          (default: False)
+    @type verifyDigests: bool
+    @param acceptEncoding: Value of the Accept-Encoding header. gzip and
+                           deflate coded responses are decompressed as they
+                           are read, set this to identity to ask for
+                           uncompressed responses. (default: gzip, deflate)
+    @type acceptEncoding: str
+    @param compressThreshold: Size in bytes from which PUT and POST documents
+                              are sent gzip compressed. Compression is turned
+                              off for the rest of the session if the server
+                              answers 415. (default: never compress)
+    @type compressThreshold: int
+    @param parser: XML parser backend, 'celementtree', 'lxml' or 'xobj'.
+                   Documents are parsed into the same objects whichever is
+                   used. (default: the fastest one available)
+    @type parser: str
+    @param parseInBackground: Parse the documents retrieved by the submit
+                              methods, and by requests made from tasks run
+                              with submit, on the worker that retrieved them
+                              rather than in the caller's thread when they
+                              are first used. (default: True)
+    @type parseInBackground: bool
+    @param parseProcesses: Number of processes to parse documents of
+                           4MiB or more in, sidestepping the GIL. Not
+                           available with the xobj parser.
+                           (default: parse in process)
+    @type parseProcesses: int
+    @param preferJSON: Ask for JSON rather than XML. Documents the server
+                       sends as JSON are mapped to the same objects as XML
+                       ones and, once it has sent one, PUT and POST
+                       documents are sent as JSON as well. (default: False)
+    @type preferJSON: bool
     @param logging: Set up a logger.
     @type logging: boolean
     """
@@ -68,7 +167,16 @@ def rObj(uri, headers=None, maxClients=None, maxConnections=None,
 
     # Instantiate the http client.
     client = _HTTPClient(uri, headers=headers, maxClients=maxClients,
-        maxConnections=maxConnections, maxRedirects=maxRedirects)
+        maxConnections=maxConnections, maxRedirects=maxRedirects,
+        requestRate=requestRate, requestBurst=requestBurst,
+        minIdleConnections=minIdleConnections,
+        maxCacheEntries=maxCacheEntries, maxCacheBytes=maxCacheBytes,
+        cachePolicy=cachePolicy, cacheTTL=cacheTTL,
+        responseCache=responseCache, spoolSize=spoolSize, spoolDir=spoolDir,
+        bandwidth=bandwidth, digests=digests, verifyDigests=verifyDigests,
+        acceptEncoding=acceptEncoding, compressThreshold=compressThreshold,
+        parser=parser, parseInBackground=parseInBackground,
+        parseProcesses=parseProcesses, preferJSON=preferJSON)
 
     # Get the root rObj
     if client.querystring:
@@ -19,7 +19,14 @@
 Module for describing RESTful collections.
 """
 
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+from robj.lib import xutil
 from robj.proxy import rObjProxy
+from robj.errors import ExternalUriError
 
 class Pages(dict):
     def insert(self, page):
@@ -220,6 +227,17 @@ class PagedCollection(object):
                 yield i
                 seen.add(i.id)
 
+    def submit_iter(self):
+        """
+        Resolve every member of the collection, fetching pages as needed, on
+        the client pool without blocking the caller.
+        @return: One future per member, in collection order.
+        @rtype: list of robj.lib.futures.Future
+        """
+
+        client = self._pages.first.node._client
+        return [ client.submit(self.__getitem__, i) for i in range(len(self)) ]
+
     def append(self, item, post=True, tag=None):
         node = self._node.append(item, post=post, tag=tag)
         self._new_items.append(node)
@@ -227,6 +245,16 @@ class PagedCollection(object):
 
     @staticmethod
     def isPaged(node):
+        # Paging information is carried in attributes or child elements of
+        # the top level element, so most documents can be ruled out without
+        # parsing them.
+        root = getattr(node, '_rootNode', None)
+        if (isinstance(root, xutil.UnparsedDocument) and
+            'full_collection' not in root.attributes):
+            tags = root.childTags()
+            if tags is not None and 'full_collection' not in tags:
+                return False
+
         attrs = set(node.elements + node.attributes)
         required_attrs = set([
             'count',
@@ -260,3 +288,108 @@ class PagedCollection(object):
         if a.full_collection == b.full_collection:
             return True
         return False
+
+
+class StreamingCollection(object):
+    """
+    Collection that is parsed while the response body is read. Iterating it
+    yields each member as soon as its element has been parsed, after which
+    the element is thrown away, so that memory use stays flat no matter how
+    large the collection is. It can only be iterated once.
+    @param client: Instance of a glue client.
+    @type client: robj.glue.HTTPClient
+    @param uri: URI of the collection.
+    @type uri: str
+    @param content: Response body to parse. Its spool method is called before
+                    members that are only references are retrieved.
+    @type content: robj.http.request.ResponseStream
+    @param childTag: Tag of the members. (default: the top level tag without
+                     its trailing s, or else the tag of the first child)
+    @type childTag: str
+    """
+
+    __slots__ = ('_client', '_uri', '_content', '_childTag', '_consumed',
+        'tag', 'attributes', )
+
+    def __init__(self, client, uri, content, childTag=None):
+        self._client = client
+        self._uri = uri
+        self._content = content
+        self._childTag = childTag
+        self._consumed = False
+
+        # Top level tag and attributes, available once iteration has started.
+        self.tag = None
+        self.attributes = {}
+
+    @property
+    def id(self):
+        return self._uri
+
+    def __repr__(self):
+        return '<robj.StreamingCollection(%s)>' % self._uri
+
+    __str__ = __repr__
+
+    def __iter__(self):
+        if self._consumed:
+            raise ValueError('streaming collections can only be iterated once')
+        self._consumed = True
+
+        try:
+            for item in self._iterchildren():
+                yield item
+        finally:
+            self._content.close()
+
+    def _iterchildren(self):
+        root = None
+        depth = 0
+        for event, elem in ElementTree.iterparse(self._content,
+            events=('start', 'end')):
+
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    root = elem
+                    self.tag = elem.tag
+                    self.attributes = dict(elem.attrib)
+                    if self._childTag is None and self.tag.endswith('s'):
+                        self._childTag = self.tag[:-1]
+                continue
+
+            depth -= 1
+            if depth != 1:
+                continue
+
+            if self._childTag is None:
+                self._childTag = elem.tag
+            if elem.tag == self._childTag:
+                node = self._client._parser.fromElement(elem)
+                yield self._getObj(node)
+
+            # Drop the member now that it has been handed out.
+            root.remove(elem)
+
+    def _getObj(self, node):
+        client = self._client
+
+        # Members with content are cached like any other instance, the same
+        # way rObjProxy treats the members of a collection.
+        if hasattr(node, 'id') and node._xobj.elements:
+            return client.cache(client, node.id, node)
+
+        if hasattr(node, 'id') or hasattr(node, 'href'):
+            nodeId = hasattr(node, 'id') and node.id or node.href
+
+            # The stream holds on to a connection, retrieving the member
+            # could otherwise wait for it forever.
+            self._content.spool()
+            try:
+                return client.do_GET(nodeId)
+            except ExternalUriError:
+                return nodeId
+
+        if node._xobj.elements:
+            return rObjProxy(self._uri, client, node)
+        return node
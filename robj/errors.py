@@ -73,6 +73,18 @@ class HTTPResponseTimeout(HTTPError):
     _template = 'Timeout reached waiting for response'
 
 
+class HTTPPoolTimeoutError(HTTPError):
+    """
+    Raised when no connection to a host became available in time, which
+    usually means that every connection is held by a request that is waiting
+    on the one being made.
+    """
+
+    _params = ['host', 'timeout', ]
+    _template = ('Timed out after %(timeout)s seconds waiting for a connection '
+        'to %(host)s')
+
+
 class HTTPResponseError(HTTPError):
     """
     Generic response error.
@@ -168,6 +180,26 @@ class HTTPGatewayTimeoutError(HTTPResponseError):
     """
 
 
+class HTTPChecksumError(HTTPError):
+    """
+    Raised when the checksum of a response body doesn't match the one sent by
+    the server in a Content-MD5 or Digest header.
+    """
+
+    _params = ['algorithm', 'expected', 'actual', ]
+    _template = ('Checksum mismatch (%(algorithm)s): expected %(expected)s, '
+        'got %(actual)s')
+
+
+class HTTPRangeError(HTTPResponseError):
+    """
+    Raised when a byte range of a resource could not be retrieved.
+    """
+
+    _template = ('Error retrieving a range of %(uri)s: %(reason)s '
+        '[%(status)s]')
+
+
 class HTTPRedirectError(HTTPError):
     """
     Generic redirect error.
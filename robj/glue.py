@@ -19,18 +19,37 @@
 Module for binding the HTTP client layer to xobj.
 """
 
+import os
+import sys
+import time
 import types
+import socket
+import Queue
+import httplib
+import hashlib
+import tempfile
+from StringIO import StringIO
+from threading import Lock
 from threading import RLock
+from threading import Thread
 
 from xobj import xobj
 
 from robj import errors
 from robj.lib import util
 from robj.lib import httputil
+from robj.lib import xutil
+from robj.lib import parsers
+from robj.lib import cachepolicy
+from robj.lib.futures import Future
+from robj.lib.responsecache import ResponseCache
 from robj.proxy import rObjProxy
 from robj.collections import PagedCollection
+from robj.collections import StreamingCollection
 from robj.http import HTTPClient as _HTTPClient
+from robj.http.request import Response
 
+from robj.errors import HTTPRangeError
 from robj.errors import HTTPDeleteError
 from robj.errors import ExternalUriError
 from robj.errors import SerializationError
@@ -51,14 +70,101 @@ class HTTPClient(object):
                        handle requets. Works are created as needed, rather than
                        being preallocated. (default: 1)
     @type maxClients: int
-    @param maxConnections: The maximum number of connections each client thread
-                           should cache. Client threads only cache one
-                           connection per host. This should only matter if you
-                           are talking to multiple hosts. (default: 2)
+    @param maxConnections: The maximum number of connections to each host,
+                           shared by all workers. Workers wait for a free
+                           connection once this is reached.
+                           (default: maxClients)
     @type maxConnections: int
+    @param minIdleConnections: The number of idle connections to each host to
+                               keep open when cleaning up idle connections.
+                               (default: 0)
+    @type minIdleConnections: int
     @param maxRedirects: The maximum number of redirects that will be followed
                          before an exception is raised. (default: 10)
     @type maxRedirects: int
+    @param requestRate: The maximum number of requests per second to send to
+                        any one host. Requests are not paced if this is not
+                        set. (default: None)
+    @type requestRate: float
+    @param requestBurst: The number of requests to a host that may be sent back
+                         to back before pacing applies. (default: 1)
+    @type requestBurst: int
+    @param maxCacheEntries: The maximum number of instances to keep in the
+                            instance cache. (default: no limit)
+    @type maxCacheEntries: int
+    @param maxCacheBytes: The maximum approximate number of bytes of memory
+                          used by instances in the instance cache.
+                          (default: no limit)
+    @type maxCacheBytes: int
+    @param cachePolicy: The instance cache eviction policy, 'lru' or 'lfu'.
+                        (default: 'lru')
+    @type cachePolicy: str
+    @param cacheTTL: The number of seconds a cached instance is used without
+                     checking with the server if the response that it was
+                     created from did not include Cache-Control or Expires
+                     headers. (default: never expires)
+    @type cacheTTL: int
+    @param responseCache: Path to a database, or a ResponseCache instance, in
+                          which to keep GET responses between processes. New
+                          clients rebuild instances from it rather than
+                          retrieving them again. It may be shared by clients
+                          of different servers or users, responses are kept
+                          apart by base URI, format and credentials.
+                          (default: None)
+    @type responseCache: str
+    @param spoolSize: Size in bytes up to which response bodies are kept in
+                      memory rather than written to a temporary file. Larger
+                      documents are parsed straight from the file.
+                      (default: 256KiB)
+    @type spoolSize: int
+    @param spoolDir: Directory to write larger response bodies to.
+                     (default: the system temporary directory)
+    @type spoolDir: str
+    @param bandwidth: Bandwidth budget that all uploads and downloads draw
+                      from. The same instance may be shared by several
+                      clients. (default: unlimited)
+    @type bandwidth: robj.lib.ratelimit.BandwidthScheduler
+    @param digests: Names of hashlib algorithms, such as md5 or sha256, to
+                    compute checksums of response bodies with while they are
+                    read. (default: None)
+    @type digests: list
+    @param verifyDigests: Check response bodies against any Content-MD5 and
+                          Digest headers sent by the server, raising
+                          HTTPChecksumError if they don't match.
+                          (default: False)
+    @type verifyDigests: bool
+    @param acceptEncoding: Value of the Accept-Encoding header. gzip and
+                           deflate coded responses are decompressed as they
+                           are read, set this to identity to ask for
+                           uncompressed responses. (default: gzip, deflate)
+    @type acceptEncoding: str
+    @param compressThreshold: Size in bytes from which PUT and POST documents
+                              are sent gzip compressed. Compression is turned
+                              off for the rest of the session if the server
+                              answers 415. (default: never compress)
+    @type compressThreshold: int
+    @param parser: XML parser backend, 'celementtree', 'lxml' or 'xobj'.
+                   Documents are parsed into the same objects whichever is
+                   used. (default: the fastest one available)
+    @type parser: str
+    @param parseInBackground: Parse the documents retrieved by the submit
+                              methods, and by requests made from tasks run
+                              with submit, on the worker that retrieved them
+                              rather than in the caller's thread when they
+                              are first used. (default: True)
+    @type parseInBackground: bool
+    @param parseProcesses: Number of processes to parse documents of
+                           PARSE_PROCESS_SIZE bytes or more in, sidestepping
+                           the GIL. Not available with the xobj parser.
+                           The processes are forked when the client is
+                           created, so create it before starting threads.
+                           (default: parse in process)
+    @type parseProcesses: int
+    @param preferJSON: Ask for JSON rather than XML. Documents the server
+                       sends as JSON are mapped to the same objects as XML
+                       ones and, once it has sent one, PUT and POST
+                       documents are sent as JSON as well. (default: False)
+    @type preferJSON: bool
     """
 
     error_exceptions = {
@@ -81,8 +187,17 @@ class HTTPClient(object):
         504: errors.HTTPGatewayTimeoutError,
     }
 
+    XML_ACCEPT = 'text/xml, text/application'
+    JSON_TYPE = 'application/json'
+
     def __init__(self, baseUri, headers=None, maxClients=None,
-        maxConnections=None, maxRedirects=None):
+        maxConnections=None, maxRedirects=None, requestRate=None,
+        requestBurst=None, minIdleConnections=None, maxCacheEntries=None,
+        maxCacheBytes=None, cachePolicy=None, cacheTTL=None,
+        responseCache=None, spoolSize=None, spoolDir=None, bandwidth=None,
+        digests=None, verifyDigests=False, acceptEncoding=None,
+        compressThreshold=None, parser=None, parseInBackground=True,
+        parseProcesses=None, preferJSON=False):
 
         if maxRedirects is None:
             maxRedirects = 10
@@ -90,13 +205,58 @@ class HTTPClient(object):
 
         if not isinstance(headers, (dict, httputil.HTTPHeaders)):
             headers = httputil.HTTPHeaders()
-        headers['Accept'] = 'text/xml, text/application'
+        if preferJSON:
+            headers['Accept'] = 'application/json, %s' % self.XML_ACCEPT
+        else:
+            headers['Accept'] = self.XML_ACCEPT
 
         self._client = _HTTPClient(baseUri, headers=headers,
-            maxClients=maxClients, maxConnections=maxConnections)
+            maxClients=maxClients, maxConnections=maxConnections,
+            requestRate=requestRate, requestBurst=requestBurst,
+            minIdleConnections=minIdleConnections, spoolSize=spoolSize,
+            spoolDir=spoolDir, bandwidth=bandwidth, digests=digests,
+            verifyDigests=verifyDigests, acceptEncoding=acceptEncoding)
 
-        self.cache = InstanceCache()
+        self._spoolSize = spoolSize or Response.SPOOL_SIZE
+        self._spoolDir = spoolDir
+
+        self.cache = InstanceCache(maxEntries=maxCacheEntries,
+            maxBytes=maxCacheBytes, policy=cachePolicy)
         self._redirects = {}
+        self._cacheTTL = cacheTTL
+
+        if isinstance(responseCache, basestring):
+            responseCache = ResponseCache(responseCache)
+        self._responseCache = responseCache
+
+        # GET requests that are currently being processed, by URI, as a future
+        # for the result and whether the request is made on a worker.
+        self._inflight = {}
+        self._inflight_lock = Lock()
+
+        # URIs of stale instances that are being revalidated in the background,
+        # and the queue of those still waiting for the revalidation thread.
+        self._revalidating = set()
+        self._revalidateQueue = Queue.Queue()
+        self._revalidateThread = None
+
+        # Documents of at least this many bytes are sent gzip compressed,
+        # until the server turns one down.
+        self._compressThreshold = compressThreshold
+        self._compressRequests = compressThreshold is not None
+
+        self._parser = parsers.getParser(parser)
+        self._parseInBackground = parseInBackground
+
+        self._parsePool = None
+        if parseProcesses:
+            self._parsePool = parsers.ProcessParser(self._parser,
+                parseProcesses)
+
+        # Documents are sent as JSON once the server has sent one.
+        self._preferJSON = preferJSON
+        self._json = False
+        self._jsonParser = parsers.JSONParser()
 
     @property
     def querystring(self):
@@ -128,13 +288,16 @@ class HTTPClient(object):
         else:
             raise ExternalUriError(uri=uri, base=self._client.baseURI)
 
-    def _serialize_document(self, doc):
+    def _serialize_document(self, doc, asJSON=False):
         """
-        Serialize a object tree into xml.
+        Serialize a object tree into xml, or JSON if asJSON is set.
         """
 
         # Serialize document to xml.
         if isinstance(doc, xobj.Document):
+            if asJSON:
+                tag = doc._xobj.elements[0]
+                return xutil.toJSON(getattr(doc, tag), tag)
             xml = doc.toxml()
         else:
             meta = getattr(doc, '_xobj', None)
@@ -152,6 +315,13 @@ class HTTPClient(object):
                 raise SerializationError(instance=doc,
                     msg='Can not determine tag')
 
+            if asJSON:
+                # Serialize the tree itself rather than going through the
+                # proxy, which would retrieve any resources it refers to.
+                if isinstance(doc, rObjProxy):
+                    doc = doc._root
+                return xutil.toJSON(doc, meta.tag)
+
             xml = xobj.toxml(doc, meta.tag)
 
         return xml
@@ -174,7 +344,7 @@ class HTTPClient(object):
         return response
 
     def _handle_redirect(self, uri, request, response, parent=None,
-        redirectCount=0):
+        redirectCount=0, stream=False):
         """
         Handle all redirect conditions. This may include long running jobs
         implemented through a see other (303).
@@ -183,7 +353,7 @@ class HTTPClient(object):
         def handle_request(location, method=None, cache=True):
             return self._handle_request(method, location,
                 xdoc=request.content, parent=parent, cache=cache,
-                redirectCount=redirectCount+1)
+                redirectCount=redirectCount+1, stream=stream)
 
         # Raise an exception for any redirect types that are not currently
         # handled by this method.
@@ -218,7 +388,9 @@ class HTTPClient(object):
         # 304: Not Modified - resource has not changed since the last request,
         # returned cached instance of location.
         elif response.status == 304:
-            location = self._normalize_uri(location)
+            # A 304 that isn't a redirect has no location, the instance to
+            # use is the one that was asked for.
+            location = self._normalize_uri(location or uri)
             if location in self.cache:
                 return self.cache[location]
             else:
@@ -239,7 +411,8 @@ class HTTPClient(object):
                 reason=response.reason, response=response)
 
     def _handle_request(self, method, uri, xdoc=None, parent=None, cache=True,
-        redirectCount=0):
+        redirectCount=0, revalidate=True, stream=False, iterparse=False,
+        childTag=None):
         """
         Process all types of requests.
         """
@@ -250,31 +423,365 @@ class HTTPClient(object):
         # Check if this is a permanent redirect
         uri = self._redirects.get(uri, uri)
 
+        # Collections parsed as they arrive are built from a streamed response.
+        if iterparse:
+            content = self._handle_request(method, uri, xdoc=xdoc,
+                parent=parent, redirectCount=redirectCount, stream=True)
+            return StreamingCollection(self, uri, content, childTag=childTag)
+
+        # Streamed responses are handed straight to the caller, so they can
+        # neither come from nor go to the cache.
+        if stream:
+            return self._do_request(method, uri, xdoc=xdoc, parent=parent,
+                cache=False, redirectCount=redirectCount, revalidate=False,
+                stream=True)
+
         # Check the cache before moving on if this is a GET.
-        if method == 'GET' and uri in self.cache and cache:
-            return self.cache[uri]
+        if method == 'GET' and cache:
+            obj = self.cache.lookup(uri)
+            if obj is None and self._responseCache is not None:
+                obj = self._load_response(uri)
+            if obj is not None:
+                state = self._freshness(obj)
+                if state == self.FRESH:
+                    return obj
+
+                # Use the stale instance while a fresh copy is retrieved.
+                elif state == self.STALE_WHILE_REVALIDATE:
+                    self._revalidate(uri)
+                    return obj
+
+                # Otherwise fall through to a conditional GET.
+
+        # Share the result of an identical GET that is already being processed
+        # by another thread. Requests made while following a redirect are never
+        # shared so that two threads can't end up waiting on each other.
+        if method == 'GET' and cache and not redirectCount:
+            return self._coalesce(uri, self._do_request, method, uri,
+                xdoc=xdoc, parent=parent, cache=cache, revalidate=revalidate)
+
+        return self._do_request(method, uri, xdoc=xdoc, parent=parent,
+            cache=cache, redirectCount=redirectCount, revalidate=revalidate)
+
+    def _coalesce(self, uri, func, *args, **kwargs):
+        """
+        Call func, unless a call for the same URI is already in progress, in
+        which case wait for and return its result instead.
+        """
+
+        # Calls made on a worker have their requests handled by that worker,
+        # anything else queues its requests for the pool.
+        onWorker = self._client.inWorker()
+
+        self._inflight_lock.acquire()
+        try:
+            entry = self._inflight.get(uri)
+            leader = entry is None
+            if leader:
+                future = Future()
+                self._inflight[uri] = (future, onWorker)
+            else:
+                future, leaderOnWorker = entry
+        finally:
+            self._inflight_lock.release()
+
+        if not leader:
+            # A worker must not wait for a request that may still be queued,
+            # it could be the one that request is waiting for.
+            if onWorker and not leaderOnWorker:
+                return func(*args, **kwargs)
+
+            result = future.result()
+
+            # Only instances can be shared, anything else, such as the content
+            # of a file download, can only be consumed once.
+            if isinstance(result, (rObjProxy, PagedCollection)):
+                return result
+            return func(*args, **kwargs)
+
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            exc_info = sys.exc_info()
+            self._inflight_done(uri)
+            future.set_exception(exc_info)
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        self._inflight_done(uri)
+        future.set_result(result)
+        return result
+
+    def _inflight_done(self, uri):
+        self._inflight_lock.acquire()
+        try:
+            self._inflight.pop(uri, None)
+        finally:
+            self._inflight_lock.release()
+
+    FRESH = 'fresh'
+    STALE_WHILE_REVALIDATE = 'stale-while-revalidate'
+    STALE = 'stale'
+
+    def _freshness(self, obj):
+        """
+        Check if a cached instance can be used without asking the server.
+        """
+
+        expires = getattr(obj, '_expires', None)
+
+        # Instances with local changes are never replaced by a GET.
+        if expires is None or obj._dirty:
+            return self.FRESH
+
+        expires, staleWhileRevalidate = expires
+        now = time.time()
+        if now < expires:
+            return self.FRESH
+        elif now < expires + staleWhileRevalidate:
+            return self.STALE_WHILE_REVALIDATE
+        return self.STALE
+
+    def _revalidate(self, uri):
+        """
+        Revalidate the cached instance of uri in the background, unless that
+        is already queued or in progress. Revalidations are run one at a time
+        by a thread of their own rather than on the client pool, which may
+        have no workers to spare, or none at all when maxClients is 1.
+        """
+
+        future = Future()
+
+        self._inflight_lock.acquire()
+        try:
+            if uri in self._revalidating or uri in self._inflight:
+                return
+            self._revalidating.add(uri)
+            self._revalidateQueue.put((uri, future))
+
+            if self._revalidateThread is None:
+                self._revalidateThread = Thread(target=self._revalidate_run,
+                    name='revalidate')
+                self._revalidateThread.daemon = True
+                self._revalidateThread.start()
+        finally:
+            self._inflight_lock.release()
+
+        return future
+
+    def _revalidate_run(self):
+        """
+        Revalidate queued URIs forever.
+        """
+
+        while True:
+            uri, future = self._revalidateQueue.get()
+            try:
+                try:
+                    result = self._coalesce(uri, self._do_request, 'GET', uri)
+                except Exception:
+                    future.set_exception(sys.exc_info())
+                else:
+                    future.set_result(result)
+            finally:
+                self._inflight_lock.acquire()
+                self._revalidating.discard(uri)
+                self._inflight_lock.release()
+
+    def _conditional_headers(self, obj):
+        """
+        Get the headers needed to make a GET request conditional on the cached
+        instance obj being out of date.
+        """
+
+        validators = getattr(obj, '_validators', None)
+        if not validators or obj._dirty:
+            return None
+
+        etag, modified = validators
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        return headers
+
+    def _response_key(self, uri):
+        """
+        Get the key of uri in the persistent response cache, which may be
+        shared with clients of other servers, API roots, formats or users.
+        """
+
+        identity = self._client.authorization
+        if identity:
+            identity = hashlib.sha1(identity).hexdigest()
+
+        return ' '.join((self._client.baseURI,
+            self._preferJSON and 'json' or 'xml', identity or '-', uri))
+
+    def _load_response(self, uri):
+        """
+        Rebuild the instance for uri from the persistent response cache.
+        """
+
+        entry = self._responseCache.get(self._response_key(uri))
+        if entry is None:
+            return None
+
+        obj = self.cache(self, uri, self._parse_document(entry.body,
+            lazy=True))
+
+        target = self.cache.get(uri, obj)
+        if isinstance(target, rObjProxy) and not target._dirty:
+            if entry.etag or entry.modified:
+                target._validators = (entry.etag, entry.modified)
+
+            # Responses that don't expire are still checked with the server
+            # once, since they may have been stored long ago.
+            target._expires = (entry.expires or 0, entry.staleWhileRevalidate)
+
+        return obj
+
+    def _save_cache_headers(self, uri, obj, response, freshness, body=None):
+        """
+        Store the cache validators and expiration time from a GET response on
+        the instance that represents it, and in the persistent response cache
+        if there is one.
+        """
+
+        target = self.cache.get(uri, obj)
+        if not isinstance(target, rObjProxy) or target._dirty:
+            return
+
+        lifetime, staleWhileRevalidate = freshness
+        if lifetime is None:
+            target._expires = None
+        else:
+            target._expires = (time.time() + lifetime, staleWhileRevalidate)
+
+        etag = response.getheader('etag', None)
+        modified = response.getheader('last-modified', None)
+        if etag or modified:
+            target._validators = (etag, modified)
+        else:
+            target._validators = None
+
+        if self._responseCache is None or uri not in self.cache:
+            return
+
+        key = self._response_key(uri)
+        expires = target._expires and target._expires[0] or None
+        if body is not None:
+            self._responseCache.put(key, body, etag=etag, modified=modified,
+                expires=expires, staleWhileRevalidate=staleWhileRevalidate)
+        else:
+            self._responseCache.touch(key, expires=expires,
+                staleWhileRevalidate=staleWhileRevalidate)
+
+    # Size in bytes from which documents are parsed in the process pool, when
+    # there is one. Smaller documents take longer to pass to another process
+    # than to parse.
+    PARSE_PROCESS_SIZE = 4 * 1024 * 1024
+
+    def _parse_document(self, content, lazy=False):
+        """
+        Parse an XML or JSON document, either a string or a seekable file
+        object, and return its top level object. If lazy is set, and the top
+        level element of an XML document can be read on its own, return an
+        xutil.UnparsedDocument that rObjProxy parses once its contents are
+        needed instead. Files larger than spoolSize are copied to a file in
+        spoolDir for the unparsed document to read once it is needed, rather
+        than read into memory.
+        """
+
+        if util.isJSON(content):
+            return self._jsonParser.parse(content)
+
+        if isinstance(content, basestring):
+            size = len(content)
+        else:
+            content.seek(0, 2)
+            size = content.tell()
+            content.seek(0)
+
+        if lazy:
+            if not isinstance(content, basestring) and size <= self._spoolSize:
+                content = content.read()
+            root = xutil.UnparsedDocument.scan(content, self._parse_document,
+                spoolDir=self._spoolDir)
+            if root is not None:
+                return root
+
+        # The process pool is handed the document as a string either way.
+        if self._parsePool is not None and size >= self.PARSE_PROCESS_SIZE:
+            if not isinstance(content, basestring):
+                content = content.read()
+            return self._parsePool.parse(content)
+
+        return self._parser.parse(content)
+
+    def _do_request(self, method, uri, xdoc=None, parent=None, cache=True,
+        redirectCount=0, revalidate=True, stream=False):
+        """
+        Send a request for an already normalized URI and process the response.
+        """
 
         xml = None
         rawdoc = False
+        contentType = None
         if method in ('POST', 'PUT', ):
             # Make sure there is a document for PUT and POST requests.
             if xdoc is None:
                 raise TypeError, 'method requires document instance'
 
-            xml = self._serialize_document(xdoc)
+            asJSON = self._json
+            xml = self._serialize_document(xdoc, asJSON=asJSON)
             if xml == xdoc:
                 rawdoc = True
+            elif asJSON:
+                contentType = self.JSON_TYPE
             args = (uri, xml)
         else:
             args = (uri, )
 
+        compressed = (xml is not None and not rawdoc and
+            self._compressRequests and len(xml) >= self._compressThreshold)
+        if compressed:
+            args = (uri, httputil.HTTPData(data=StringIO(xml),
+                contentType=contentType or util.getContentType(xml),
+                bufferSize=httputil.HTTPData.CHUNK_SIZE, compress=True))
+
         # Allow custom http data to override method.
         if xml and httputil.isHTTPData(xml) and xml.method:
             method = xml.method
 
+        # Only have the server send the resource if it has changed since the
+        # cached instance was retrieved.
+        # Hold on to the cached instance, since it may be evicted before the
+        # server answers that it is still current.
+        headers = None
+        validated = None
+        if method == 'GET' and revalidate:
+            validated = self.cache.get(uri)
+            headers = self._conditional_headers(validated)
+            if headers is None:
+                validated = None
+
+        # Streamed responses are read as XML, by StreamingCollection for
+        # instance, so don't ask for anything else.
+        elif stream and self._preferJSON:
+            headers = {'Accept': self.XML_ACCEPT}
+
+        elif contentType is not None:
+            headers = {'Content-Type': contentType}
+
         # Call client method
         func = getattr(self._client, 'do_%s' % method)
-        request = func(*args)
+        if stream:
+            request = func(*args, headers=headers, stream=True)
+        elif httputil.isHTTPData(xml) and xml.resumable and xml.size:
+            request = self._upload_segments(func, uri, xml)
+        else:
+            request = func(*args, headers=headers)
 
         # Wait for request to complete.
         request.wait()
@@ -282,6 +789,22 @@ class HTTPClient(object):
         # Get the response
         response = request.response
 
+        # Servers that don't take compressed bodies answer 415, send the
+        # document again as is and stop compressing for this host.
+        if compressed and response.status == 415:
+            self._compressRequests = False
+            response.content.close()
+            request = func(uri, xml, headers=headers)
+            request.wait()
+            response = request.response
+
+        # Hand back the body of successful streamed requests without reading
+        # it, anything else is read in full to be handled as usual.
+        if stream:
+            if 200 <= response.status < 300:
+                return response.content
+            response.spool()
+
         # Special case DELETE method.
         if method == 'DELETE':
             # Raise an exception if the resource could not be deleted.
@@ -290,9 +813,21 @@ class HTTPClient(object):
                     reason=response.reason, response=response)
 
             self.cache.clear(uri)
+            if self._responseCache is not None:
+                self._responseCache.delete(self._response_key(uri))
 
             return response
 
+        # 304: Not Modified in reply to a conditional request, the cached
+        # instance is still current so there is nothing to parse.
+        if response.status == 304 and validated is not None:
+            response.content.close()
+            if cache and uri not in self.cache:
+                self.cache[uri] = validated
+            self._save_cache_headers(uri, validated, response,
+                httputil.getFreshness(response, self._cacheTTL) or (0, 0))
+            return validated
+
         # Handle other error codes.
         if response.status >= 400:
             return self._handle_error(uri, request, response)
@@ -300,42 +835,173 @@ class HTTPClient(object):
         # Handle redirects.
         elif response.status >= 300:
             return self._handle_redirect(uri, request, response, parent=parent,
-                redirectCount=redirectCount)
+                redirectCount=redirectCount, stream=stream)
 
         # If the raw document was sent to the server, this is probably a file
         # upload and the response should not contain an xml document.
         if rawdoc:
             return response
 
-        # Make sure the response looks like valid xml, otherwise assume that
-        # this is a file download an return the content of the response.
+        # Make sure the response looks like valid xml, or JSON if that was
+        # asked for, otherwise assume that this is a file download an return
+        # the content of the response.
         content = response.content
-        if not util.isXML(content):
+        if (self._preferJSON and httputil.isJSONResponse(response) and
+            util.isJSON(content)):
+            self._json = True
+        elif not util.isXML(content):
             return content
 
+        # Keep a copy of the document for the persistent response cache.
+        body = None
+        if method == 'GET' and self._responseCache is not None:
+            body = content.read()
+            content.seek(0)
+
         # Parse XML document.
-        doc = xobj.parsef(content)
+        root = self._parse_document(content, lazy=True)
         content.close()
 
-        # Pull the top level object out of the document.
-        assert isinstance(doc, xobj.Document)
-        assert len(doc._xobj.elements) == 1
-        root = getattr(doc, doc._xobj.elements[0])
-
         # If the top level object has an 'id' attribute, use that as its URI.
         # This is here to handle appending to collections, where the resource
         # you get back is the new instance, not the collection itself.
-        if method != 'GET' and 'id' in root._xobj.attributes:
-            uri = self._normalize_uri(root.id)
+        rootId = xutil.getAttribute(root, 'id')
+        if method != 'GET' and rootId is not None:
+            uri = self._normalize_uri(rootId)
+
+        # Responses marked no-store must not be kept in the cache.
+        freshness = None
+        if method == 'GET':
+            freshness = httputil.getFreshness(response, self._cacheTTL)
+            if freshness is None:
+                self.cache.clear(uri)
+                cache = False
+
+        # Any stored response is out of date once the resource is modified.
+        if ((method != 'GET' or freshness is None) and
+            self._responseCache is not None):
+            self._responseCache.delete(self._response_key(uri))
 
         # Cache response and return rObjProxy instance.
-        return self.cache(self, uri, root, parent=parent, cache=cache)
+        obj = self.cache(self, uri, root, parent=parent, cache=cache)
+
+        if freshness is not None:
+            self._save_cache_headers(uri, obj, response, freshness, body=body)
+
+        return obj
+
+    # Number of times a segment of a resumable upload is retried without any
+    # progress being made.
+    UPLOAD_RETRIES = 10
+
+    def _upload_segments(self, func, uri, data):
+        """
+        Send a resumable upload as a series of Content-Range segments, picking
+        up from the last offset acknowledged by the server after a failure.
+        @return: The request that completed the upload.
+        """
+
+        # Start over if this data has already been uploaded once.
+        if data.offset >= data.size:
+            data.offset = 0
+
+        failures = 0
+        while True:
+            size = min(data.segmentSize, data.size - data.offset)
+            exc_info = None
+            try:
+                request = func(uri, data.segment(data.offset, size))
+                request.wait()
+                response = request.response
+            except (socket.error, httplib.HTTPException):
+                exc_info = sys.exc_info()
+                response = None
+
+            if response is None or response.status >= 500:
+                failures += 1
+                if failures > self.UPLOAD_RETRIES:
+                    if exc_info is not None:
+                        raise exc_info[0], exc_info[1], exc_info[2]
+                    return request
+                data.offset = self._upload_offset(func, uri, data)
+                continue
+
+            # Anything other than an acknowledgement of an incomplete upload
+            # is handled like the response to a regular request.
+            if not (response.status == 308 or 200 <= response.status < 300):
+                return request
+
+            end = data.offset + size
+            if end < data.size:
+                offset = self._acknowledged(response, end)
+            elif response.status == 308:
+                # Everything has been sent but the server is still missing
+                # some of it, find out where to pick up from.
+                offset = self._upload_offset(func, uri, data)
+            else:
+                offset = self._acknowledged(response, data.size)
+
+            if offset >= data.size:
+                data.offset = data.size
+                return request
+
+            response.content.close()
+            if offset > data.offset:
+                failures = 0
+            else:
+                failures += 1
+                if failures > self.UPLOAD_RETRIES:
+                    return request
+            data.offset = offset
+
+    def _upload_offset(self, func, uri, data):
+        """
+        Ask the server how much of a resumable upload it has received.
+        """
+
+        try:
+            request = func(uri, '', headers={
+                'Content-Range': 'bytes */%s' % data.size,
+                'Content-Length': '0',
+            })
+            request.wait()
+        except (socket.error, httplib.HTTPException):
+            return data.offset
+
+        request.response.content.close()
+        return self._acknowledged(request.response, data.offset)
+
+    def _acknowledged(self, response, default):
+        """
+        Get the number of bytes of an upload acknowledged by a Range header in
+        response.
+        """
+
+        value = response.getheader('range', None)
+        if not value or not value.startswith('bytes='):
+            return default
+        try:
+            return int(value[len('bytes='):].split('-', 1)[1]) + 1
+        except (IndexError, ValueError):
+            return default
 
     def do_GET(self, *args, **kwargs):
         """
         Process GET requests.
         @param uri: Full or partial URI (relative to the base URI).
         @type uri: str
+        @param stream: Return a file like object that reads the response body
+                       directly from the connection, rather than an rObj.
+                       Close it, or read it to the end, to release the
+                       connection. (default: False)
+        @type stream: bool
+        @param iterparse: Return a collection that is parsed while the
+                          response is read, yielding each member as soon as it
+                          arrives, rather than an rObj. (default: False)
+        @type iterparse: bool
+        @param childTag: Tag of the members of an iterparse collection.
+                         (default: guessed from the top level tag)
+        @type childTag: str
         @return rObj representing response.
         @rtype robj.obj.rObjProxy
         """
@@ -381,16 +1047,506 @@ class HTTPClient(object):
 
         return self._handle_request('DELETE', *args, **kwargs)
 
+    # Smallest byte range worth a request of its own.
+    RANGE_SIZE_MIN = 65536
+
+    def download(self, uri, dest, bufferSize=None, parts=None, digest=None):
+        """
+        Write the body of the resource at uri straight into a file.
+        @param uri: Full or partial URI (relative to the base URI).
+        @type uri: str
+        @param dest: Path to write to, or an open file or file descriptor. A
+                     path is only replaced once the download has completed.
+        @type dest: str
+        @param bufferSize: Size of the buffer used to copy the body.
+                           (default: 1MiB)
+        @type bufferSize: int
+        @param parts: Number of byte ranges to split the download of a path
+                      into, which are retrieved concurrently by the client
+                      pool if the server supports range requests. Completed
+                      ranges are kept in dest.part so that an interrupted
+                      download can be resumed. (default: 1)
+        @type parts: int
+        @param digest: Object with an update method, such as a hashlib digest
+                       or util.MultiDigest, to feed the body to as it is
+                       written.
+        @type digest: hashlib digest
+        @return: Number of bytes written.
+        @rtype: int
+        """
+
+        kwargs = {}
+        if bufferSize:
+            kwargs['bufSize'] = bufferSize
+
+        if parts > 1 and isinstance(dest, basestring):
+            return self._download_ranges(uri, dest, parts, digest=digest,
+                **kwargs)
+
+        return self._write_file(self.do_GET(uri, stream=True), dest,
+            digest=digest, **kwargs)
+
+    def _write_file(self, stream, dest, **kwargs):
+        """
+        Copy everything from stream into dest.
+        """
+
+        try:
+            if not isinstance(dest, basestring):
+                if hasattr(dest, 'fileno'):
+                    dest.flush()
+                    dest = dest.fileno()
+                util.preallocate(dest, stream.length)
+                return util.copyinto(stream, dest, **kwargs)
+
+            # Download into a temporary file next to the destination and move
+            # it into place once complete. mkstemp creates the file readable
+            # only by its owner, give it the mode a new file would get.
+            dirname, basename = os.path.split(os.path.abspath(dest))
+            fd, tmpname = tempfile.mkstemp(dir=dirname,
+                prefix='.%s.' % basename)
+            try:
+                try:
+                    os.fchmod(fd, 0666 & ~util.getUmask())
+                    util.preallocate(fd, stream.length)
+                    size = util.copyinto(stream, fd, **kwargs)
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+                os.rename(tmpname, dest)
+            except Exception:
+                os.unlink(tmpname)
+                raise
+            return size
+        finally:
+            stream.close()
+
+    def _download_ranges(self, uri, dest, parts, digest=None, **kwargs):
+        """
+        Download uri to the path dest in parts byte ranges.
+        """
+
+        uri = self._normalize_uri(uri)
+        uri = self._redirects.get(uri, uri)
+
+        # Ask for the first byte to find out if the server supports ranges
+        # and how large the resource is.
+        # Compressed ranges couldn't be put together.
+        request = self._client.do_GET(uri, headers={'Range': 'bytes=0-0',
+            'Accept-Encoding': 'identity'}, stream=True)
+        request.wait()
+        response = request.response
+
+        contentRange = None
+        if response.status == 206:
+            contentRange = httputil.parseContentRange(
+                response.getheader('content-range', None))
+
+        if contentRange is None:
+            # The server sent the whole resource, so just write it out.
+            if response.status == 200:
+                return self._write_file(response.content, dest,
+                    digest=digest, **kwargs)
+
+            # Let the regular request handling deal with anything else.
+            response.content.close()
+            return self._write_file(self.do_GET(uri, stream=True), dest,
+                digest=digest, **kwargs)
+
+        response.content.read()
+        total = contentRange[2]
+
+        # Ranges are only combined across requests if the resource has a
+        # validator to check that it hasn't changed. Weak ETags can't be used
+        # for that.
+        validator = httputil.getRangeValidator(response)
+
+        partial = dest + '.part'
+        state = partial + '.ranges'
+        done = self._read_ranges(partial, state, total, validator)
+        if done is None:
+            done = []
+            fd = os.open(partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0666)
+            try:
+                util.preallocate(fd, total)
+                os.ftruncate(fd, total)
+            finally:
+                os.close(fd)
+            fh = open(state, 'w')
+            fh.write('%s\n%s\n' % (total, validator or ''))
+            fh.close()
+
+        # Split whatever is missing into ranges of about total / parts.
+        size = max(-(-total // parts), self.RANGE_SIZE_MIN)
+        ranges = []
+        pos = 0
+        for start, end in sorted(done) + [ (total, total), ]:
+            while pos < start:
+                ranges.append((pos, min(pos + size, start) - 1))
+                pos = ranges[-1][1] + 1
+            pos = max(pos, end + 1)
+
+        lock = Lock()
+        fs = [ self.submit(self._download_range, uri, partial, state, lock,
+            start, end, total, validator, **kwargs) for start, end in ranges ]
+
+        # Wait for every range before reporting the first failure, so that
+        # nothing is still writing if the download is retried.
+        for future in fs:
+            future.exception()
+        for future in fs:
+            future.result()
+
+        # Ranges arrive out of order, so the digest has to be computed from
+        # the assembled file.
+        if digest:
+            fh = open(partial, 'rb')
+            try:
+                for block in iter(lambda: fh.read(1024 * 1024), ''):
+                    digest.update(block)
+            finally:
+                fh.close()
+
+        os.rename(partial, dest)
+        os.unlink(state)
+        return total
+
+    def _read_ranges(self, partial, state, total, validator):
+        """
+        Read the ranges that have already been downloaded to partial.
+        @return: List of (start, end) tuples, or None if the download can't be
+                 resumed.
+        """
+
+        if not validator or not os.path.exists(partial):
+            return None
+        try:
+            lines = open(state).read().splitlines()
+        except IOError:
+            return None
+        if lines[:2] != [ str(total), validator, ]:
+            return None
+
+        done = []
+        for line in lines[2:]:
+            try:
+                start, end = [ int(x) for x in line.split() ]
+            except ValueError:
+                continue
+            done.append((start, end))
+        return done
+
+    def _download_range(self, uri, partial, state, lock, start, end, total,
+        validator, **kwargs):
+        """
+        Download bytes start through end of uri into the same position of the
+        file partial, and record the range in state once written. The server
+        has to send exactly that range of a resource of total bytes.
+        """
+
+        headers = {'Range': 'bytes=%s-%s' % (start, end),
+            'Accept-Encoding': 'identity'}
+        if validator:
+            headers['If-Range'] = validator
+
+        request = self._client.do_GET(uri, headers=headers, stream=True)
+        request.wait()
+        response = request.response
+
+        if response.status != 206:
+            response.spool()
+            if response.status >= 400:
+                self._handle_error(uri, request, response)
+            raise HTTPRangeError(uri=uri, status=response.status,
+                reason='range not honored', response=response)
+
+        # Don't write anything that doesn't belong at this position.
+        contentRange = httputil.parseContentRange(
+            response.getheader('content-range', None))
+        if contentRange != (start, end, total):
+            response.content.close()
+            raise HTTPRangeError(uri=uri, status=response.status,
+                reason='unexpected content range %s' %
+                response.getheader('content-range', None), response=response)
+
+        fd = os.open(partial, os.O_WRONLY)
+        try:
+            os.lseek(fd, start, os.SEEK_SET)
+            size = util.copyinto(response.content, fd, **kwargs)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+            response.content.close()
+
+        if size != end - start + 1:
+            raise HTTPRangeError(uri=uri, status=response.status,
+                reason='incomplete range', response=response)
+
+        lock.acquire()
+        try:
+            fh = open(state, 'a')
+            fh.write('%s %s\n' % (start, end))
+            fh.close()
+        finally:
+            lock.release()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func on the client pool. Any requests that func makes are handled
+        by the worker running it.
+        @return future that resolves to the return value of func.
+        @rtype robj.lib.futures.Future
+        """
+
+        return self._client.submit(self._run_task, func, args, kwargs)
+
+    def _run_task(self, func, args, kwargs):
+        """
+        Run func for submit.
+        """
+
+        result = func(*args, **kwargs)
+
+        # Parse the document here rather than in the caller's thread when it is
+        # first used, so that parsing one response overlaps with retrieving
+        # the next.
+        if self._parseInBackground and isinstance(result, rObjProxy):
+            result._load()
+
+        return result
+
+    def _submit_request(self, method, *args, **kwargs):
+        """
+        Process a request on the client pool.
+        """
+
+        return self.submit(self._handle_request, method, *args, **kwargs)
+
+    def submit_GET(self, *args, **kwargs):
+        """
+        Process GET requests without waiting for the response. Takes the same
+        arguments as do_GET.
+        @return future that resolves to the rObj representing the response.
+        @rtype robj.lib.futures.Future
+        """
+
+        return self._submit_request('GET', *args, **kwargs)
+
+    def submit_POST(self, *args, **kwargs):
+        """
+        Process POST requests without waiting for the response. Takes the same
+        arguments as do_POST.
+        @return future that resolves to the rObj representing the response.
+        @rtype robj.lib.futures.Future
+        """
+
+        return self._submit_request('POST', *args, **kwargs)
+
+    def submit_PUT(self, *args, **kwargs):
+        """
+        Process PUT requests without waiting for the response. Takes the same
+        arguments as do_PUT.
+        @return future that resolves to the rObj representing the response.
+        @rtype robj.lib.futures.Future
+        """
+
+        return self._submit_request('PUT', *args, **kwargs)
+
+    def submit_DELETE(self, *args, **kwargs):
+        """
+        Process DELETE requests without waiting for the response. Takes the
+        same arguments as do_DELETE.
+        @return future that resolves to the response object.
+        @rtype robj.lib.futures.Future
+        """
+
+        return self._submit_request('DELETE', *args, **kwargs)
+
 
 class InstanceCache(dict):
     """
     Cache of all URIs and associated objects.
+    @param maxEntries: The maximum number of instances to cache. (default: no
+                       limit)
+    @type maxEntries: int
+    @param maxBytes: The maximum approximate number of bytes of memory used by
+                     the cached object trees. (default: no limit)
+    @type maxBytes: int
+    @param policy: The eviction policy to use once a limit is reached, either
+                   'lru' or 'lfu'. (default: 'lru')
+    @type policy: str
     """
 
-    def __init__(self):
+    def __init__(self, maxEntries=None, maxBytes=None, policy=None):
         dict.__init__(self)
         self._write_lock = RLock()
 
+        self._maxEntries = maxEntries
+        self._maxBytes = maxBytes
+
+        # Only keep track of usage if the cache is bounded.
+        self._policy = None
+        if maxEntries or maxBytes:
+            self._policy = cachepolicy.getPolicy(policy or 'lru')
+
+        self._sizes = {}
+        self._bytes = 0
+
+        # Pages of a paged collection are evicted along with the collection.
+        # Map page URIs to collection URIs and collection URIs to page URIs.
+        self._groups = {}
+        self._members = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, uri):
+        obj = dict.__getitem__(self, uri)
+        if self._policy is not None:
+            self._write_lock.acquire()
+            try:
+                self._policy.touch(uri)
+            finally:
+                self._write_lock.release()
+        return obj
+
+    def __setitem__(self, uri, obj):
+        self._write_lock.acquire()
+        try:
+            self._store(uri, obj)
+            self._evict()
+        finally:
+            self._write_lock.release()
+
+    def __delitem__(self, uri):
+        if uri not in self:
+            raise KeyError(uri)
+        self.clear(uri)
+
+    def _sizeof(self, obj):
+        if not self._maxBytes:
+            return 0
+        return xutil.sizeof(getattr(obj, '_rootNode', None))
+
+    def _store(self, uri, obj):
+        self._bytes -= self._sizes.pop(uri, 0)
+        dict.__setitem__(self, uri, obj)
+
+        size = self._sizeof(obj)
+        self._sizes[uri] = size
+        self._bytes += size
+
+        if self._policy is not None:
+            self._policy.touch(uri)
+
+    def resize(self, uri, obj):
+        """
+        Count the size of the cached instance obj of uri again, once its
+        document has been parsed, and evict instances if that puts the cache
+        over its limit.
+        """
+
+        if not self._maxBytes:
+            return
+
+        self._write_lock.acquire()
+        try:
+            if dict.get(self, uri) is obj:
+                self._store(uri, obj)
+                self._evict()
+        finally:
+            self._write_lock.release()
+
+    def _remove(self, uri):
+        dict.pop(self, uri, None)
+        self._bytes -= self._sizes.pop(uri, 0)
+
+        if self._policy is not None:
+            self._policy.remove(uri)
+
+        curi = self._groups.pop(uri, None)
+        if curi in self._members:
+            self._members[curi].discard(uri)
+
+    def _group(self, uri, curi):
+        """
+        Record that the page at uri belongs to the collection at curi.
+        """
+
+        self._groups[uri] = curi
+        self._members.setdefault(curi, set()).add(uri)
+
+    def _overLimit(self):
+        if self._maxEntries and len(self) > self._maxEntries:
+            return True
+        if self._maxBytes and self._bytes > self._maxBytes:
+            return True
+        return False
+
+    def _evict(self):
+        """
+        Evict instances until the cache is back within its limits. Instances
+        with local modifications are never evicted.
+        """
+
+        if self._policy is None:
+            return
+
+        pinned = []
+        while self._overLimit():
+            uri = self._policy.pop()
+            if uri is None:
+                break
+
+            curi = self._groups.get(uri, uri)
+            members = set([ curi, uri ])
+            members.update(self._members.get(curi, ()))
+
+            if [ x for x in members
+                 if getattr(dict.get(self, x), '_dirty', False) ]:
+                pinned.append(uri)
+                continue
+
+            for x in members:
+                if x in self:
+                    self.evictions += 1
+                self._remove(x)
+            self._members.pop(curi, None)
+
+        for uri in pinned:
+            self._policy.touch(uri)
+
+    def lookup(self, uri):
+        """
+        Get the cached instance for uri, counting the cache hit or miss.
+        @return: The cached instance or None if uri is not cached.
+        """
+
+        self._write_lock.acquire()
+        try:
+            if uri in self:
+                self.hits += 1
+                return self[uri]
+            self.misses += 1
+            return None
+        finally:
+            self._write_lock.release()
+
+    def stats(self):
+        """
+        Get cache statistics.
+        @rtype: dict
+        """
+
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            entries=len(self),
+            bytes=self._bytes,
+        )
+
     def clear(self, uri=None):
         """
         Clear the cache of rObj instances. This will result in orphaned
@@ -399,9 +1555,15 @@ class InstanceCache(dict):
 
         self._write_lock.acquire()
         if uri:
-            self.pop(uri, None)
+            self._remove(uri)
         else:
             dict.clear(self)
+            self._sizes.clear()
+            self._bytes = 0
+            self._groups.clear()
+            self._members.clear()
+            if self._policy is not None:
+                self._policy = self._policy.__class__()
         self._write_lock.release()
 
     def cache(self, client, uri, root, parent=None, cache=True):
@@ -412,17 +1574,29 @@ class InstanceCache(dict):
         # Make sure that all cached URIs are normalized.
         uri = client._normalize_uri(uri)
 
+        # Recognizing a paged collection may parse the document, which
+        # raises if it is malformed.
         self._write_lock.acquire()
+        try:
+            return self._cache(client, uri, root, parent=parent, cache=cache)
+        finally:
+            self._write_lock.release()
+
+    __call__ = cache
 
+    def _cache(self, client, uri, root, parent=None, cache=True):
         if uri in self:
             robj = self[uri]
             if not robj._dirty:
                 robj._root = root
                 robj._reset()
+
+                # Account for the size of the new object tree.
+                self._store(uri, robj)
         else:
             robj = rObjProxy(uri, client, root, parent=parent)
             if cache:
-                self[uri] = robj
+                self._store(uri, robj)
 
         if PagedCollection.isPaged(robj):
             curi = client._normalize_uri(robj.full_collection)
@@ -436,12 +1610,16 @@ class InstanceCache(dict):
                 not isinstance(self.get(curi), PagedCollection)):
                 robj = PagedCollection(robj)
                 if cache:
-                    self[curi] = robj
+                    self._store(curi, robj)
+                    self._group(uri, curi)
 
             elif not PagedCollection.isSiblingNode(robj, parent):
                 robj = self[curi]
 
-        self._write_lock.release()
+            elif cache:
+                self._group(uri, curi)
+
+        self._evict()
+
         return robj
 
-    __call__ = cache
@@ -41,18 +41,70 @@ class Client(object):
                        handle requets. Works are created as needed, rather than
                        being preallocated. (default: 1)
     @type maxClients: int
-    @param maxConnections: The maximum number of connections each client thread
-                           should cache. Client threads only cache one
-                           connection per host. This should only matter if you
-                           are talking to multiple hosts. (default: 2)
+    @param maxConnections: The maximum number of connections to each host,
+                           shared by all workers. Workers wait for a free
+                           connection once this is reached.
+                           (default: maxClients)
     @type maxConnections: int
+    @param minIdleConnections: The number of idle connections to each host to
+                               keep open when cleaning up idle connections.
+                               (default: 0)
+    @type minIdleConnections: int
+    @param requestRate: The maximum number of requests per second to send to
+                        any one host. Requests are not paced if this is not
+                        set. (default: None)
+    @type requestRate: float
+    @param requestBurst: The number of requests to a host that may be sent back
+                         to back before pacing applies. (default: 1)
+    @type requestBurst: int
+    @param spoolSize: Size in bytes up to which response bodies are kept in
+                      memory rather than written to a temporary file.
+                      (default: 256KiB)
+    @type spoolSize: int
+    @param spoolDir: Directory to write larger response bodies to.
+                     (default: the system temporary directory)
+    @type spoolDir: str
+    @param bandwidth: Bandwidth budget that all uploads and downloads draw
+                      from. The same instance may be shared by several
+                      clients. (default: unlimited)
+    @type bandwidth: robj.lib.ratelimit.BandwidthScheduler
+    @param digests: Names of hashlib algorithms, such as md5 or sha256, to
+                    compute checksums of response bodies with while they are
+                    read. (default: None)
+    @type digests: list
+    @param verifyDigests: Check response bodies against any Content-MD5 and
+                          Digest headers sent by the server, raising
+                          HTTPChecksumError if they don't match.
+                          (default: False)
+    @type verifyDigests: bool
+    @param acceptEncoding: Value of the Accept-Encoding header. gzip and
+                           deflate coded responses are decompressed as they
+                           are read, set this to identity to ask for
+                           uncompressed responses. (default: gzip, deflate)
+    @type acceptEncoding: str
     """
 
+    ACCEPT_ENCODING = 'gzip, deflate'
+
     def __init__(self, baseUri, headers=None, maxClients=None,
-        maxConnections=None):
+        maxConnections=None, requestRate=None, requestBurst=None,
+        minIdleConnections=None, spoolSize=None, spoolDir=None,
+        bandwidth=None, digests=None, verifyDigests=False,
+        acceptEncoding=None):
 
         self._headers = headers or HTTPHeaders()
 
+        if acceptEncoding is None:
+            acceptEncoding = self.ACCEPT_ENCODING
+        if 'Accept-Encoding' not in self._headers:
+            self._headers['Accept-Encoding'] = acceptEncoding
+
+        self._spoolSize = spoolSize
+        self._spoolDir = spoolDir
+
+        self._digests = digests
+        self._verifyDigests = verifyDigests
+
         self._user = None
         self._passwd = None
 
@@ -70,7 +122,9 @@ class Client(object):
             raise ValueError(self._scheme)
 
         self._dispatcher = RequestDispatcher(maxClients=maxClients,
-            maxConnections=maxConnections)
+            maxConnections=maxConnections, requestRate=requestRate,
+            requestBurst=requestBurst, minIdleConnections=minIdleConnections,
+            bandwidth=bandwidth)
 
         self._queryFragment = urlparse.urlunsplit(('', '', '', query, frag))
 
@@ -78,6 +132,17 @@ class Client(object):
     def baseURI(self):
         return self._baseUri
 
+    @property
+    def authorization(self):
+        """
+        The Authorization header sent with every request, if any.
+        """
+
+        value = self._getHeaders().get('Authorization', ())
+        if isinstance(value, (list, tuple)):
+            value = ', '.join(value) or None
+        return value
+
     @property
     def queryFragment(self):
         return self._queryFragment
@@ -103,14 +168,16 @@ class Client(object):
             hdrs['Authorization'] = 'Basic %s' % userpass
         return hdrs
 
-    def _request(self, method, uri, content=None):
+    def _request(self, method, uri, content=None, headers=None, stream=False):
         uri = uri.lstrip('/')
         path = '/'.join((self._path, uri))
 
-        headers = self._getHeaders({
+        hdrs = {
             'Content-Type': util.getContentType(content),
             'Host': self._getHost().encode('idna'),
-        })
+        }
+        hdrs.update(headers or {})
+        headers = self._getHeaders(hdrs)
 
         # If the content object defines a iterheaders method, as
         # httputil.HTTPData does, allow the content headers to override any
@@ -121,20 +188,57 @@ class Client(object):
                 headers.replace(key, val)
 
         req = Request(method, path, self._scheme, self._hostport,
-            content=content, headers=headers)
+            content=content, headers=headers, spoolSize=self._spoolSize,
+            spoolDir=self._spoolDir, stream=stream, digests=self._digests,
+            verify=self._verifyDigests)
 
         self._dispatcher.request(req)
 
         return req
 
-    def do_GET(self, uri):
-        return self._request('GET', uri)
+    def do_GET(self, uri, headers=None, stream=False):
+        return self._request('GET', uri, headers=headers, stream=stream)
+
+    def do_POST(self, uri, content, headers=None):
+        return self._request('POST', uri, content=content, headers=headers)
+
+    def do_PUT(self, uri, content, headers=None):
+        return self._request('PUT', uri, content=content, headers=headers)
+
+    def do_DELETE(self, uri, headers=None):
+        return self._request('DELETE', uri, headers=headers)
+
+    def connectionStats(self):
+        """
+        Get connection pool statistics.
+        @return: Mapping of (scheme, hostport) to a dictionary of counters.
+        @rtype: dict
+        """
+
+        return self._dispatcher.pool.stats()
+
+    def inWorker(self):
+        """
+        Check if the calling thread is one of the client pool workers.
+        """
+
+        return self._dispatcher.inWorker()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func on the client pool, returning a future for its result.
+        """
+
+        return self._dispatcher.submit(func, *args, **kwargs)
+
+    def submit_GET(self, uri, headers=None):
+        return self.do_GET(uri, headers=headers).future
 
-    def do_POST(self, uri, content):
-        return self._request('POST', uri, content=content)
+    def submit_POST(self, uri, content, headers=None):
+        return self.do_POST(uri, content, headers=headers).future
 
-    def do_PUT(self, uri, content):
-        return self._request('PUT', uri, content=content)
+    def submit_PUT(self, uri, content, headers=None):
+        return self.do_PUT(uri, content, headers=headers).future
 
-    def do_DELETE(self, uri):
-        return self._request('DELETE', uri)
+    def submit_DELETE(self, uri, headers=None):
+        return self.do_DELETE(uri, headers=headers).future
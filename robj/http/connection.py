@@ -23,6 +23,7 @@ import logging
 import time
 
 from robj.lib import fixedhttplib as httplib
+from robj.lib.ratelimit import BandwidthScheduler
 
 clog = logging.getLogger('robj.http.traffic')
 log = logging.getLogger('robj.http.connection')
@@ -34,6 +35,8 @@ class Connection(object):
     @type scheme: str
     @param hostport: Host and possibly port part of URI. (ex. localhost:8000)
     @type hostport str
+    @param bandwidth: Optional bandwidth budget to pace transfers with.
+    @type bandwidth: robj.lib.ratelimit.BandwidthScheduler
     """
 
     _HTTPConnection = httplib.HTTPConnection
@@ -41,10 +44,18 @@ class Connection(object):
 
     _timeout = 15
 
-    def __init__(self, scheme, hostport):
+    def __init__(self, scheme, hostport, bandwidth=None):
         self._scheme = scheme
         self._hostport = hostport
 
+        self._uploadThrottle = None
+        self._downloadThrottle = None
+        if bandwidth is not None:
+            self._uploadThrottle = bandwidth.throttler(
+                BandwidthScheduler.UPLOAD, self.key)
+            self._downloadThrottle = bandwidth.throttler(
+                BandwidthScheduler.DOWNLOAD, self.key)
+
         self._conn = None
         self._last_used = 0
 
@@ -71,6 +82,7 @@ class Connection(object):
             cls = self._HTTPSConnection
 
         self._conn = cls(self._hostport)
+        self._conn.throttle = self._uploadThrottle
         self._conn.connect()
         #self._conn.set_debuglevel(1)
 
@@ -100,6 +112,7 @@ class Connection(object):
         self.check()
         self._connection.request(method, path, body=content, headers=headers)
         response = self._connection.getresponse()
+        response.throttle = self._downloadThrottle
         self._last_used = time.time()
         return response
 
@@ -19,48 +19,115 @@
 Classes for manging pool of http clients.
 """
 
-import time
+import sys
 import logging
 import httplib
 import Queue
+from threading import Lock
 from threading import Thread
+from threading import currentThread
 
-from robj.http.connection import Connection
+from robj.lib.futures import Future
+from robj.lib.ratelimit import TokenBucket
+from robj.http.pool import ConnectionPool
 
 log = logging.getLogger('robj.http.dispatcher')
 
+class RequestPacer(object):
+    """
+    Per host request pacing policy. Each host gets its own token bucket.
+    @param rate: The number of requests per second allowed to each host.
+    @type rate: float
+    @param burst: The number of requests that may be made back to back before
+                  pacing kicks in. (default: 1)
+    @type burst: int
+    """
+
+    _bucketClass = TokenBucket
+
+    def __init__(self, rate, burst=None):
+        if burst is None:
+            burst = 1
+
+        self._rate = rate
+        self._burst = burst
+
+        self._buckets = {}
+        self._lock = Lock()
+
+    def _getBucket(self, key):
+        self._lock.acquire()
+        try:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._bucketClass(self._rate, burst=self._burst)
+                self._buckets[key] = bucket
+            return bucket
+        finally:
+            self._lock.release()
+
+    def wait(self, req):
+        """
+        Block until the given request may be sent to its host.
+        """
+
+        self._getBucket(req.key).consume()
+
+
+class Task(object):
+    """
+    Unit of work, other than an HTTP request, to be run by a worker.
+    @param future: Future to post the outcome of the work to.
+    @type future: robj.lib.futures.Future
+    @param func: Callable to run.
+    @type func: callable
+    """
+
+    __slots__ = ('future', 'func', 'args', 'kwargs', )
+
+    def __init__(self, future, func, args=None, kwargs=None):
+        self.future = future
+        self.func = func
+        self.args = args or ()
+        self.kwargs = kwargs or {}
+
+    def run(self):
+        try:
+            result = self.func(*self.args, **self.kwargs)
+        except Exception:
+            self.future.set_exception(sys.exc_info())
+        else:
+            self.future.set_result(result)
+
+
 class RequestWorker(Thread):
     """
     Threaded HTTP client class.
+    @param inq: Queue of requests and tasks to process.
+    @type inq: Queue.Queue
+    @param pool: Connection pool shared by all workers.
+    @type pool: robj.http.pool.ConnectionPool
+    @param pacer: Optional per host request pacing policy.
+    @type pacer: RequestPacer
     """
 
-    _connectionClass = Connection
-
-    def __init__(self, inq, maxConnections, *args, **kwargs):
+    def __init__(self, inq, pool, pacer=None, *args, **kwargs):
         Thread.__init__(self, *args, **kwargs)
         self._inq = inq
-        self._maxConnections = maxConnections
+        self._pool = pool
+        self._pacer = pacer
 
         self.daemon = True
 
-        self._cache = {}
         self._busy = False
 
     @property
     def busy(self):
         return self._busy
 
-    def _getConn(self, req):
-        conn = self._cache.get(req.key, None)
-        if conn is None and len(self._cache) < self._maxConnections:
-            conn = self._connectionClass(*req.key)
-            self._cache[req.key] = conn
-        return conn
-
     def _cleanup(self):
         """Close idle keepalive sessions."""
-        for conn in self._cache.values():
-            conn.check()
+        self._pool.cleanup()
 
     def run(self):
         """
@@ -75,9 +142,17 @@ class RequestWorker(Thread):
                 self._cleanup()
                 continue
             self._busy = True
-            req = self.handleRequest(req)
-            if req is not None:
-                self._inq.put(req)
+            try:
+                if isinstance(req, Task):
+                    req.run()
+                else:
+                    req = self.handleRequest(req)
+                    if req is not None:
+                        self._inq.put(req)
+            except Exception, e:
+                # The failure has already been posted to the request's future,
+                # keep the worker alive for the next request.
+                log.error('%s: request failed: %s' % (self.getName(), e))
             self._busy = False
 
     def handleRequest(self, req):
@@ -87,14 +162,22 @@ class RequestWorker(Thread):
 
         log.debug('%s: processing request' % self.getName())
 
-        # Get a connection for the request.
-        conn = self._getConn(req)
+        # Wait for our turn if requests to this host are being paced.
+        if self._pacer is not None:
+            self._pacer.wait(req)
+
+        # Get a connection for the request, blocking until one is available if
+        # the connection limit for this host has been hit.
+        try:
+            conn = self._pool.checkout(req.key)
+        except Exception:
+            req.future.set_exception(sys.exc_info())
+            raise
 
-        # If the connection limit has been hit and we don't have a
-        # connection for the request, put it back on the request queue.
-        if conn is None:
-            log.error('%s: no connection found for request' % self.getName())
-            return req
+        # Streamed responses keep the connection until the caller is done
+        # reading the body.
+        if req.stream:
+            req.release = self._releaser(conn)
 
         # Handle the request.
         try:
@@ -103,17 +186,43 @@ class RequestWorker(Thread):
             except httplib.BadStatusLine:
                 if req.retry:
                     log.warn('%s: retrying' % self.getName())
+                    conn.close()
+                    self._pool.checkin(conn)
                     return req
                 else:
                     raise
         except Exception, e:  # pyflakes=ignore
-            # Remove the connection object from the local cache since it is
-            # now in an error state and thus unusable.
-            self._cache.pop(req.key)
+            # Remove the connection object from the pool since it is now in an
+            # error state and thus unusable.
+            self._pool.discard(conn)
+
+            # Let anyone waiting on this request know that it failed.
+            req.future.set_exception(sys.exc_info())
             raise
 
-        # Wait a tenth of a second before handling the next request.
-        time.sleep(0.1)
+        if not req.stream:
+            self._pool.checkin(conn)
+
+    def _releaser(self, conn):
+        """
+        Get a callable that returns conn to the pool, or discards it if it
+        can't be reused.
+        """
+
+        def release(reuse):
+            if reuse:
+                self._pool.checkin(conn)
+            else:
+                self._pool.discard(conn)
+        return release
+
+    def handleInline(self, req):
+        """
+        Process a request in the calling thread, retrying as needed.
+        """
+
+        while req is not None:
+            req = self.handleRequest(req)
 
 
 class RequestDispatcher(object):
@@ -123,23 +232,47 @@ class RequestDispatcher(object):
                        handle requets. Works are created as needed, rather than
                        being preallocated. (default: 1)
     @type maxClients: int
-    @param maxConnections: The maximum number of connections each client thread
-                           should cache. Client threads only cache one
-                           connection per host. This should only matter if you
-                           are talking to multiple hosts. (default: 2)
+    @param maxConnections: The maximum number of connections to each host,
+                           shared by all workers. Workers wait for a free
+                           connection once this is reached.
+                           (default: maxClients)
     @type maxConnections: int
+    @param minIdleConnections: The number of idle connections to each host to
+                               keep open when cleaning up idle connections.
+                               (default: 0)
+    @type minIdleConnections: int
+    @param requestRate: The maximum number of requests per second to send to
+                        any one host. Requests are not paced if this is not
+                        set. (default: None)
+    @type requestRate: float
+    @param requestBurst: The number of requests to a host that may be sent back
+                         to back before pacing applies. (default: 1)
+    @type requestBurst: int
+    @param bandwidth: Bandwidth budget that all uploads and downloads draw
+                      from. The same instance may be shared by several
+                      clients. (default: unlimited)
+    @type bandwidth: robj.lib.ratelimit.BandwidthScheduler
     """
 
     _workerClass = RequestWorker
+    _pacerClass = RequestPacer
+    _poolClass = ConnectionPool
 
-    def __init__(self, maxClients=None, maxConnections=None):
+    def __init__(self, maxClients=None, maxConnections=None, requestRate=None,
+        requestBurst=None, minIdleConnections=None, bandwidth=None):
         if maxClients is None:
             maxClients = 1
         if maxConnections is None:
-            maxConnections = 2
+            maxConnections = maxClients
 
         self._maxClients = maxClients
-        self._maxConnections = maxConnections
+
+        self.pool = self._poolClass(maxConnections,
+            minIdle=minIdleConnections, bandwidth=bandwidth)
+
+        self._pacer = None
+        if requestRate:
+            self._pacer = self._pacerClass(requestRate, burst=requestBurst)
 
         self._reqs = Queue.Queue()
         self._workers = []
@@ -154,32 +287,71 @@ class RequestDispatcher(object):
         if len(self._workers) >= self._maxClients:
             return
 
-        # Check for availble workers before allocating a new instance.
-        for worker in self._workers:
-            if not worker.busy:
-                break
-
-        # If no available workers were found, allocate a new instance.
-        else:
+        # Only allocate a new instance if there are more queued requests than
+        # available workers.
+        idle = len([ x for x in self._workers if not x.busy ])
+        if self._reqs.qsize() > idle:
             name = 'client-%s' % len(self._workers)
-            worker = self._workerClass(self._reqs, self._maxConnections,
-                name=name)
+            worker = self._workerClass(self._reqs, self.pool,
+                pacer=self._pacer, name=name)
             self._workers.append(worker)
             worker.start()
 
-    def request(self, req):
+    def _getWorker(self):
         """
-        Submit a request to the client pool.
+        Get the worker to use for running a request in the calling thread.
         """
 
-        self._reqs.put(req)
+        # Requests issued from a task that is already running on one of our
+        # workers are handled by that worker, waiting on another worker could
+        # otherwise deadlock the pool.
+        thread = currentThread()
+        if thread in self._workers:
+            return thread
 
         # Don't use threading if there is only one client allowed.
         if self._maxClients > 1:
+            return None
+
+        if not self._workers:
+            self._workers.append(self._workerClass(self._reqs, self.pool,
+                pacer=self._pacer, name='client'))
+        return self._workers[0]
+
+    def inWorker(self):
+        """
+        Check if the calling thread is one of the pool workers.
+        """
+
+        return currentThread() in self._workers
+
+    def request(self, req):
+        """
+        Submit a request to the client pool.
+        """
+
+        worker = self._getWorker()
+        if worker is not None:
+            worker.handleInline(req)
+        else:
+            self._reqs.put(req)
             self._createWorker()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run func on the client pool.
+        @return: Future that resolves to the return value of func.
+        @rtype: robj.lib.futures.Future
+        """
+
+        future = Future()
+        task = Task(future, func, args, kwargs)
+
+        worker = self._getWorker()
+        if worker is not None:
+            task.run()
         else:
-            if not self._workers:
-                self._workers.append(self._workerClass(self._reqs,
-                    self._maxConnections, name='client'))
-            while self._workers[0].handleRequest(req):
-                self._workers[0].handleRequest(req)
+            self._reqs.put(task)
+            self._createWorker()
+
+        return future
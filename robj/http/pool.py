@@ -0,0 +1,258 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+"""
+Pool of HTTP connections shared by all of the workers of a dispatcher.
+"""
+
+import thread
+import logging
+from collections import deque
+from threading import Lock
+from threading import Event
+
+from robj.errors import HTTPPoolTimeoutError
+from robj.http.connection import Connection
+
+log = logging.getLogger('robj.http.pool')
+
+
+class _Waiter(object):
+    """
+    Worker waiting for a connection to be handed to it.
+    """
+
+    __slots__ = ('event', 'conn', )
+
+    def __init__(self):
+        self.event = Event()
+        self.conn = None
+
+
+class _Host(object):
+    """
+    Connections and statistics for a single (scheme, hostport) pair.
+    """
+
+    __slots__ = ('idle', 'waiters', 'owners', 'total', 'created', 'reused',
+        'waits', 'discarded', )
+
+    def __init__(self):
+        self.idle = []
+        self.waiters = deque()
+        self.total = 0
+
+        # Thread that checked out each connection in use, by connection id,
+        # since connections to the same host compare equal.
+        self.owners = {}
+
+        self.created = 0
+        self.reused = 0
+        self.waits = 0
+        self.discarded = 0
+
+    def stats(self):
+        return dict(
+            active=self.total - len(self.idle),
+            idle=len(self.idle),
+            waiting=len(self.waiters),
+            created=self.created,
+            reused=self.reused,
+            waits=self.waits,
+            discarded=self.discarded,
+        )
+
+
+class ConnectionPool(object):
+    """
+    Per host pool of keepalive connections. Workers that find the pool for a
+    host exhausted block until a connection is returned, first come, first
+    served. A thread that already holds a connection to a host, such as one
+    reading a streamed response, gets another one even if the host is at its
+    limit, since waiting could never end.
+    @param maxConnections: The maximum number of connections to each host.
+    @type maxConnections: int
+    @param timeout: Number of seconds to wait for a connection before raising
+                    HTTPPoolTimeoutError. (default: WAIT_TIMEOUT)
+    @type timeout: float
+    @param minIdle: The number of idle connections to each host that are kept
+                    open when idle connections are cleaned up. (default: 0)
+    @type minIdle: int
+    @param bandwidth: Optional bandwidth budget shared by all connections.
+    @type bandwidth: robj.lib.ratelimit.BandwidthScheduler
+    """
+
+    _connectionClass = Connection
+
+    WAIT_TIMEOUT = 300
+
+    def __init__(self, maxConnections, minIdle=None, bandwidth=None,
+        timeout=None):
+        if maxConnections < 1:
+            raise ValueError('maxConnections must be at least 1')
+
+        if timeout is None:
+            timeout = self.WAIT_TIMEOUT
+
+        self._maxConnections = maxConnections
+        self._timeout = timeout
+        self._minIdle = minIdle or 0
+        self._bandwidth = bandwidth
+
+        self._hosts = {}
+        self._lock = Lock()
+
+    def _getHost(self, key):
+        host = self._hosts.get(key)
+        if host is None:
+            host = self._hosts[key] = _Host()
+        return host
+
+    def _create(self, key, host):
+        host.total += 1
+        host.created += 1
+        return self._connectionClass(*key, bandwidth=self._bandwidth)
+
+    def checkout(self, key):
+        """
+        Get a connection for the given (scheme, hostport) key, waiting for one
+        to be returned if the host is at its connection limit.
+        @rtype: robj.http.connection.Connection
+        """
+
+        owner = thread.get_ident()
+
+        self._lock.acquire()
+        try:
+            host = self._getHost(key)
+
+            # Reuse the most recently returned connection since it is the most
+            # likely to still be open.
+            if host.idle:
+                host.reused += 1
+                conn = host.idle.pop()
+                host.owners[id(conn)] = owner
+                return conn
+
+            if (host.total < self._maxConnections or
+                owner in host.owners.itervalues()):
+                conn = self._create(key, host)
+                host.owners[id(conn)] = owner
+                return conn
+
+            waiter = _Waiter()
+            host.waiters.append(waiter)
+            host.waits += 1
+        finally:
+            self._lock.release()
+
+        log.debug('waiting for a connection to %s://%s' % key)
+        waiter.event.wait(self._timeout)
+
+        self._lock.acquire()
+        try:
+            # The connection may have been handed over just as the wait timed
+            # out.
+            conn = waiter.conn
+            if conn is None:
+                host.waiters.remove(waiter)
+                raise HTTPPoolTimeoutError(host='%s://%s' % key,
+                    timeout=self._timeout)
+            host.owners[id(conn)] = owner
+            return conn
+        finally:
+            self._lock.release()
+
+    def _handoff(self, host, conn):
+        waiter = host.waiters.popleft()
+        waiter.conn = conn
+        waiter.event.set()
+
+    def checkin(self, conn):
+        """
+        Return a connection to the pool once a request has completed.
+        """
+
+        self._lock.acquire()
+        try:
+            host = self._getHost(conn.key)
+            host.owners.pop(id(conn), None)
+            if host.waiters:
+                host.reused += 1
+                self._handoff(host, conn)
+
+            # Don't keep connections made beyond the limit around.
+            elif host.total > self._maxConnections:
+                conn.close()
+                host.total -= 1
+
+            else:
+                host.idle.append(conn)
+        finally:
+            self._lock.release()
+
+    def discard(self, conn):
+        """
+        Close a connection that is in an error state and remove it from the
+        pool.
+        """
+
+        conn.close()
+
+        self._lock.acquire()
+        try:
+            host = self._getHost(conn.key)
+            host.owners.pop(id(conn), None)
+            host.total -= 1
+            host.discarded += 1
+
+            # Give the freed up slot to the next worker in line.
+            if host.waiters and host.total < self._maxConnections:
+                self._handoff(host, self._create(conn.key, host))
+        finally:
+            self._lock.release()
+
+    def cleanup(self):
+        """
+        Close idle keepalive sessions, except for the minimum number of idle
+        connections to keep for each host.
+        """
+
+        self._lock.acquire()
+        try:
+            for host in self._hosts.itervalues():
+                if len(host.idle) <= self._minIdle:
+                    continue
+                # Idle connections are ordered oldest first.
+                for conn in host.idle[:len(host.idle) - self._minIdle]:
+                    conn.check()
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """
+        Get connection statistics for each host.
+        @return: Mapping of (scheme, hostport) to a dictionary of counters.
+        @rtype: dict
+        """
+
+        self._lock.acquire()
+        try:
+            return dict((x, y.stats()) for x, y in self._hosts.iteritems())
+        finally:
+            self._lock.release()
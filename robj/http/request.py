@@ -19,11 +19,13 @@
 HTTP Request.
 """
 
-import time
+import base64
 import logging
 
 from robj.lib import util
-from robj.errors import HTTPResponseTimeout
+from robj.lib import httputil
+from robj.lib.futures import Future
+from robj.errors import HTTPChecksumError
 
 clog = logging.getLogger('robj.http.traffic')
 
@@ -48,39 +50,294 @@ class FLO(object):
     def seek(self, dist, start=0):
         self.f.seek(dist, start)
 
+    def tell(self):
+        return self.f.tell()
+
     def close(self):
         self.f.close()
 
 
+class Checksums(object):
+    """
+    Checksums of a response body, computed while it is read.
+    @param response: Response the body belongs to.
+    @type response: Response
+    @param digests: Names of the hashlib algorithms to compute.
+    @type digests: list
+    @param verify: Check the body against any checksums sent by the server.
+    @type verify: bool
+    @param encoded: The body is decoded as it is read.
+    @type encoded: bool
+    """
+
+    def __init__(self, response, digests=None, verify=False, encoded=False):
+        names = set(x.lower() for x in digests or ())
+
+        self.expected = {}
+        if verify:
+            self.expected = httputil.getExpectedDigests(response,
+                partial=response.status == 206)
+
+        # Checksums sent by the server cover the body as it was sent, which
+        # for compressed bodies isn't what the caller gets.
+        self.raw = None
+        if self.expected and encoded:
+            self.raw = util.MultiDigest(self.expected)
+        else:
+            names.update(self.expected)
+
+        self.digest = None
+        if names:
+            self.digest = util.MultiDigest(names)
+
+    def update(self, data):
+        self.digest.update(data)
+
+    def finish(self):
+        """
+        Check the body against the expected checksums.
+        @return: Mapping of algorithm name to hex digest.
+        @rtype: dict
+        """
+
+        checked = self.raw or self.digest
+        for name, expected in self.expected.iteritems():
+            actual = checked.digest(name)
+            if actual != expected:
+                raise HTTPChecksumError(algorithm=name,
+                    expected=base64.b16encode(expected).lower(),
+                    actual=base64.b16encode(actual).lower())
+
+        if self.digest is None:
+            return None
+        return self.digest.hexdigests()
+
+
 class Response(object):
     """
     Simple HTTP Response wrapper class.
+    @param spoolSize: Size in bytes up to which the response body is kept in
+                      memory, larger bodies are written to a temporary file.
+                      (default: SPOOL_SIZE)
+    @type spoolSize: int
+    @param spoolDir: Directory to write large response bodies to.
+                     (default: the system temporary directory)
+    @type spoolDir: str
+    @param digests: Names of hashlib algorithms to compute checksums of the
+                    body with, available from checksums.
+    @type digests: list
+    @param verify: Check the body against Content-MD5 and Digest headers,
+                   raising HTTPChecksumError if it doesn't match.
+    @type verify: bool
     """
 
-    def __init__(self, resp):
+    SPOOL_SIZE = 262144
+
+    class __NotFound(object): pass
+
+    def __init__(self, resp, spoolSize=None, spoolDir=None, digests=None,
+        verify=False):
+
+        if spoolSize is None:
+            spoolSize = self.SPOOL_SIZE
+
         self.status = resp.status
         self.reason = resp.reason
         self.length = resp.length
-        self.content = FLO(util.mktemp())
+        self.content = FLO(util.mkspool(spoolSize, dir=spoolDir))
         self.headers = resp.getheaders()
 
-        util.copyfileobj(resp, self.content)
+        resp, checksums = self._decode(resp, digests, verify)
+        util.copyfileobj(resp, self.content, digest=checksums.digest)
         self.content.seek(0)
+        self.checksums = checksums.finish()
+
+    def _decode(self, resp, digests, verify):
+        """
+        Wrap resp to decompress the body if it is gzip or deflate coded.
+        @return: Object to read the body from and the checksums to compute.
+        @rtype: tuple
+        """
 
-    def getheader(self, name):
+        encoding = httputil.getContentEncoding(self)
+        checksums = Checksums(self, digests=digests, verify=verify,
+            encoded=bool(encoding))
+
+        if encoding:
+            resp = httputil.ContentDecoder(resp, encoding,
+                digest=checksums.raw)
+            self.length = None
+        return resp, checksums
+
+    def getheader(self, name, default=__NotFound):
         for header, value in self.headers:
             if name.lower() == header.lower():
                 return value
+        if default is not self.__NotFound:
+            return default
         raise AttributeError, 'header not found: %s' % name
 
 
+class ResponseStream(object):
+    """
+    File like object that reads a response body straight from the connection.
+    The connection is given back to the pool once the body has been read, or
+    dropped if the stream is closed early.
+    @param resp: Response to read from.
+    @type resp: httplib.HTTPResponse or httputil.ContentDecoder
+    @param release: Callable taking a boolean that is True if the connection
+                    may be reused.
+    @type release: callable
+    @param checksums: Checksums to compute while reading.
+    @type checksums: Checksums
+    @param spoolSize: Size in bytes up to which the rest of the body is kept
+                      in memory when spooled. (default: Response.SPOOL_SIZE)
+    @type spoolSize: int
+    @param spoolDir: Directory to spool larger bodies to.
+    @type spoolDir: str
+    """
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, resp, release=None, checksums=None, spoolSize=None,
+        spoolDir=None):
+
+        self._resp = resp
+        self._release = release
+        self._checksums = checksums
+        self._spoolSize = spoolSize
+        self._spoolDir = spoolDir
+        self._spool = None
+        self.closed = False
+
+        # Hex digests of the body once it has been read, if any were asked for.
+        self.checksums = None
+
+        # Length of the body, if the server sent one.
+        self.length = resp.length
+
+    def _done(self, reuse):
+        self.closed = True
+        if self._release is not None:
+            release, self._release = self._release, None
+            release(reuse)
+
+    def read(self, size=-1):
+        if self._spool is not None:
+            return self._spool.read(size)
+
+        if self.closed:
+            return ''
+
+        if size is None or size < 0:
+            data = self._resp.read()
+        else:
+            data = self._resp.read(size)
+
+        if data and self._checksums and self._checksums.digest:
+            self._checksums.update(data)
+
+        # httplib closes the response once the whole body has been read.
+        if not data or self._resp.isclosed():
+            self._done(True)
+            if self._checksums:
+                self.checksums = self._checksums.finish()
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        size = len(data)
+        b[:size] = data
+        return size
+
+    def __iter__(self):
+        while True:
+            data = self.read(self.CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+    def spool(self):
+        """
+        Read the rest of the body into a spool and keep reading from there,
+        so that the connection is given back to the pool right away.
+        """
+
+        if self._spool is not None or self.closed:
+            return
+
+        spool = util.mkspool(self._spoolSize or Response.SPOOL_SIZE,
+            dir=self._spoolDir)
+        util.copyfileobj(self, spool)
+        spool.seek(0)
+        self._spool = spool
+
+    def close(self):
+        if self._spool is not None:
+            self._spool.close()
+
+        if not self.closed:
+            self._resp.close()
+            self._done(False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class StreamingResponse(Response):
+    """
+    HTTP Response wrapper that doesn't read the body up front, content is a
+    ResponseStream.
+    """
+
+    def __init__(self, resp, release=None, spoolSize=None, spoolDir=None,
+        digests=None, verify=False):
+
+        self.status = resp.status
+        self.reason = resp.reason
+        self.length = resp.length
+        self.headers = resp.getheaders()
+
+        resp, checksums = self._decode(resp, digests, verify)
+        self.content = self._stream = ResponseStream(resp, release,
+            checksums=checksums, spoolSize=spoolSize, spoolDir=spoolDir)
+
+        self._spoolSize = spoolSize
+        self._spoolDir = spoolDir
+
+    @property
+    def checksums(self):
+        return self._stream.checksums
+
+    def spool(self):
+        """
+        Read the rest of the body into a spool, after which this behaves like
+        a regular response.
+        """
+
+        if not isinstance(self.content, ResponseStream):
+            return
+
+        if self._spoolSize is None:
+            self._spoolSize = self.SPOOL_SIZE
+
+        content = FLO(util.mkspool(self._spoolSize, dir=self._spoolDir))
+        util.copyfileobj(self.content, content)
+        content.seek(0)
+        self.content = content
+
+
 class Request(object):
     """
     Simple HTTP Request class.
     """
 
     def __init__(self, method, path, scheme, hostport, content=None,
-        headers=None):
+        headers=None, spoolSize=None, spoolDir=None, stream=False,
+        digests=None, verify=False):
 
         self.method = method
         self.path = path
@@ -92,8 +349,22 @@ class Request(object):
 
         self._retry = 10
 
+        self._spoolSize = spoolSize
+        self._spoolDir = spoolDir
+
+        self._digests = digests
+        self._verify = verify
+
+        # Streamed responses hand the connection back through release once
+        # their body has been read, see ResponseStream.
+        self.stream = stream
+        self.release = None
+
         self._response = None
 
+        # Resolves to the response once it has been received.
+        self.future = Future()
+
     def __hash__(self):
         return hash(self.key)
 
@@ -120,14 +391,23 @@ class Request(object):
         return self._response
     def _set_response(self, resp):
         if self._response is None:
-            self._response = Response(resp)
+            if self.stream:
+                self._response = StreamingResponse(resp, self.release,
+                    spoolSize=self._spoolSize, spoolDir=self._spoolDir,
+                    digests=self._digests, verify=self._verify)
+            else:
+                self._response = Response(resp, spoolSize=self._spoolSize,
+                    spoolDir=self._spoolDir, digests=self._digests,
+                    verify=self._verify)
+            # Wake up anyone waiting on this request.
+            self.future.set_result(self._response)
     response = property(_get_response, _set_response)
 
     def wait(self, timeout=None):
-        spent = 0
-        delta = 0.1
-        while not self.completed:
-            time.sleep(delta)
-            spent += delta
-            if timeout and timeout <= spent:
-                raise HTTPResponseTimeout
+        """
+        Block until the response has been received.
+        @param timeout: Optional number of seconds to wait before giving up.
+        @type timeout: float
+        """
+
+        self.future.result(timeout=timeout or None)
@@ -0,0 +1,134 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+"""
+Eviction policies for bounded instance caches.
+"""
+
+import heapq
+import itertools
+
+__all__ = ('LRUPolicy', 'LFUPolicy', 'getPolicy', )
+
+
+class _HeapPolicy(object):
+    """
+    Base class for policies that rank keys with a priority heap. Heap entries
+    are invalidated lazily, a key's current rank is kept in _ranks and stale
+    heap entries are skipped when popping.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._ranks = {}
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._ranks)
+
+    def _rank(self, key):
+        raise NotImplementedError
+
+    def touch(self, key):
+        """
+        Record an access to key, adding it to the policy if needed.
+        """
+
+        rank = self._rank(key)
+        self._ranks[key] = rank
+        heapq.heappush(self._heap, (rank, key))
+
+        # Don't let stale entries accumulate without bound.
+        if len(self._heap) > 4 * len(self._ranks) + 64:
+            self._heap = [ (y, x) for x, y in self._ranks.iteritems() ]
+            heapq.heapify(self._heap)
+
+    def remove(self, key):
+        """
+        Forget about key.
+        """
+
+        self._ranks.pop(key, None)
+
+    def pop(self):
+        """
+        Remove and return the key that should be evicted next, or None if the
+        policy is not tracking any keys.
+        """
+
+        while self._heap:
+            rank, key = heapq.heappop(self._heap)
+            if self._ranks.get(key) == rank:
+                del self._ranks[key]
+                return key
+        return None
+
+
+class LRUPolicy(_HeapPolicy):
+    """
+    Evict the least recently used key first.
+    """
+
+    def _rank(self, key):
+        return self._counter.next()
+
+
+class LFUPolicy(_HeapPolicy):
+    """
+    Evict the least frequently used key first, breaking ties by evicting the
+    least recently used key.
+    """
+
+    def __init__(self):
+        _HeapPolicy.__init__(self)
+        self._counts = {}
+
+    def _rank(self, key):
+        count = self._counts.get(key, 0) + 1
+        self._counts[key] = count
+        return (count, self._counter.next())
+
+    def remove(self, key):
+        _HeapPolicy.remove(self, key)
+        self._counts.pop(key, None)
+
+    def pop(self):
+        key = _HeapPolicy.pop(self)
+        self._counts.pop(key, None)
+        return key
+
+
+policies = {
+    'lru': LRUPolicy,
+    'lfu': LFUPolicy,
+}
+
+
+def getPolicy(policy):
+    """
+    Get an eviction policy instance.
+    @param policy: Name of a policy ('lru' or 'lfu') or a policy class.
+    @type policy: str or class
+    """
+
+    if isinstance(policy, basestring):
+        try:
+            policy = policies[policy.lower()]
+        except KeyError:
+            raise ValueError('unknown cache policy: %s' % policy)
+    return policy()
@@ -4,11 +4,51 @@
 # Foundation license agreement, which can be found at www.python.org.
 #
 
+import os
+import stat
+import time
+import errno
+import select
 import socket
 import httplib
 from array import array
 
-__all__ = ('HTTPConnection', 'HTTPSConnection', )
+from robj.lib import util
+
+__all__ = ('HTTPConnection', 'HTTPSConnection', 'HTTPResponse', )
+
+
+def _getSendfile():
+    """
+    Find a sendfile(out_fd, in_fd, offset, count) function, either from the os
+    module or, since python 2 doesn't provide one, sendfile(2) from the C
+    library on Linux.
+    """
+
+    if hasattr(os, 'sendfile'):
+        return os.sendfile
+
+    libc = util.getLibc()
+    func = getattr(libc, 'sendfile64', None)
+    if func is None:
+        return None
+
+    import ctypes
+    func.argtypes = [ ctypes.c_int, ctypes.c_int,
+        ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t, ]
+    func.restype = ctypes.c_ssize_t
+
+    def sendfile(outfd, infd, offset, count):
+        offset = ctypes.c_int64(offset)
+        sent = func(outfd, infd, ctypes.byref(offset), count)
+        if sent < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        return sent
+
+    return sendfile
+
+_sendfile = _getSendfile()
 
 
 class _Py26Send(object):
@@ -16,6 +56,21 @@ class _Py26Send(object):
     The _send_request and send methods were backported from python 2.6
     """
 
+    # Called with the number of bytes about to be sent to pace uploads.
+    throttle = None
+
+    BLOCK_SIZE = 65536
+
+    # Hand regular files to the kernel with sendfile, where the platform
+    # supports it, rather than copying them through user space.
+    useSendfile = _sendfile is not None
+
+    # Number of bytes passed to each sendfile call.
+    SENDFILE_SIZE = 8 * 1024 * 1024
+
+    # Size of the buffer files are read into when sendfile can't be used.
+    READINTO_SIZE = 1024 * 1024
+
     def _send_request(self, method, url, body, headers):
         # honour explicitly requested Host: and Accept-Encoding headers
         header_names = dict.fromkeys([k.lower() for k in headers])
@@ -69,28 +124,182 @@ class _Py26Send(object):
             print "send:", repr(str)
         try:
             blocksize=8192
-            if hasattr(str, 'read') and not isinstance(str, array):
+            if isRegularFile(str):
+                pos = str.tell()
+                self.sendfile(str, pos, os.fstat(str.fileno()).st_size - pos)
+            elif hasattr(str, 'read') and not isinstance(str, array):
                 if self.debuglevel > 0: print "sendIng a read()able"
                 data=str.read(blocksize)
                 while data:
-                    self.sock.sendall(data)
+                    self._sendall(data)
                     data=str.read(blocksize)
             elif hasattr(str, 'writeTo'):
                 str.writeTo(self)
             else:
-                self.sock.sendall(str)
+                self._sendall(str)
         except socket.error, v:
             if v.args[0] == 32:      # Broken pipe
                 self.close()
             raise
 
 
+    def sendfile(self, fobj, offset, count, callback=None, total=0,
+        digest=None):
+        """
+        Send count bytes of the regular file fobj, starting at offset, and
+        leave the file positioned after them.
+        @param callback: Called with the number of bytes sent so far, plus
+                         total, and the rate as each block is sent.
+        @type callback: callable
+        @param digest: Object with an update method that is fed the data.
+                       Files are read through user space when this is set.
+        @return: Number of bytes sent.
+        @rtype: int
+        """
+
+        if self.sock is None:
+            if self.auto_open:
+                self.connect()
+            else:
+                raise httplib.NotConnected()
+
+        try:
+            if self.useSendfile and digest is None:
+                sent = self._sendfileKernel(fobj, offset, count, callback,
+                    total)
+            else:
+                sent = self._sendfileBuffered(fobj, offset, count, callback,
+                    total, digest)
+        except (socket.error, OSError), v:
+            if v.args[0] == errno.EPIPE:
+                self.close()
+            raise
+
+        fobj.seek(offset + sent)
+        return sent
+
+    def _sendfileKernel(self, fobj, offset, count, callback, total):
+        # Anything still buffered by the file object has to be on disk before
+        # the kernel reads it.
+        fobj.flush()
+
+        fd = fobj.fileno()
+        sock = self.sock.fileno()
+        timeout = self.sock.gettimeout()
+
+        start = time.time()
+        sent = 0
+        while sent < count:
+            size = min(count - sent, self.SENDFILE_SIZE)
+            if self.throttle is not None:
+                size = min(size, self.BLOCK_SIZE)
+                self.throttle(size)
+
+            try:
+                written = _sendfile(sock, fd, offset + sent, size)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                # Sockets with a timeout are non blocking underneath.
+                if e.errno != errno.EAGAIN:
+                    raise
+                if not select.select([], [ sock, ], [], timeout)[1]:
+                    raise socket.timeout('timed out')
+                continue
+
+            if not written:
+                raise IOError(errno.EIO, 'file is shorter than expected')
+
+            sent += written
+            if callback:
+                callback(total + sent, sent / max(time.time() - start, 1e-6))
+
+        return sent
+
+    def _sendfileBuffered(self, fobj, offset, count, callback, total, digest):
+        buf = bytearray(min(count, self.READINTO_SIZE) or 1)
+        view = memoryview(buf)
+
+        fobj.seek(offset)
+
+        start = time.time()
+        sent = 0
+        while sent < count:
+            size = fobj.readinto(view[:min(count - sent, len(buf))])
+            if not size:
+                raise IOError(errno.EIO, 'file is shorter than expected')
+
+            if digest:
+                digest.update(view[:size])
+            self._sendall(view[:size])
+
+            sent += size
+            if callback:
+                callback(total + sent, sent / max(time.time() - start, 1e-6))
+
+        return sent
+
+    def _sendall(self, data):
+        if self.throttle is None:
+            self.sock.sendall(data)
+            return
+
+        for i in range(0, len(data), self.BLOCK_SIZE):
+            block = data[i:i + self.BLOCK_SIZE]
+            self.throttle(len(block))
+            self.sock.sendall(block)
+
+
+def isRegularFile(fobj):
+    """
+    Check if fobj is an open regular file that can be sent with sendfile.
+    """
+
+    if not hasattr(fobj, 'fileno') or not hasattr(fobj, 'readinto'):
+        return False
+    try:
+        return stat.S_ISREG(os.fstat(fobj.fileno()).st_mode)
+    except (AttributeError, IOError, OSError, ValueError):
+        return False
+
+
+class HTTPResponse(httplib.HTTPResponse):
+    """
+    HTTPResponse that paces reading the body through throttle, if set.
+    """
+
+    throttle = None
+
+    BLOCK_SIZE = 65536
+
+    def read(self, amt=None):
+        if self.throttle is None:
+            return httplib.HTTPResponse.read(self, amt)
+
+        chunks = []
+        while amt is None or amt > 0:
+            size = self.BLOCK_SIZE
+            if amt is not None:
+                size = min(amt, size)
+                amt -= size
+
+            data = httplib.HTTPResponse.read(self, size)
+            if not data:
+                break
+            self.throttle(len(data))
+            chunks.append(data)
+
+        return ''.join(chunks)
+
+
 class HTTPConnection(_Py26Send, httplib.HTTPConnection):
     """
     HTTPConnection implementation that handles chunked encoding and sending
     file like objects.
     """
 
+    response_class = HTTPResponse
+
     def __init__(self, *args, **kwargs):
         _Py26Send.__init__(self)
         httplib.HTTPConnection.__init__(self, *args, **kwargs)
@@ -102,6 +311,11 @@ class HTTPSConnection(_Py26Send, httplib.HTTPSConnection):
     file like objects.
     """
 
+    response_class = HTTPResponse
+
+    # Data has to pass through user space to be encrypted.
+    useSendfile = False
+
     def __init__(self, *args, **kwargs):
         _Py26Send.__init__(self)
         httplib.HTTPSConnection.__init__(self, *args, **kwargs)
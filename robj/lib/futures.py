@@ -0,0 +1,354 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+"""
+Minimal futures implementation for tracking work handed off to the dispatcher.
+"""
+
+import os
+import sys
+import errno
+import fcntl
+import logging
+from threading import Lock
+from threading import Condition
+
+from robj.lib.ratelimit import now
+from robj.errors import HTTPResponseTimeout
+
+__all__ = ('Future', 'CompletionQueue', 'as_completed', 'wait',
+    'FIRST_COMPLETED', 'FIRST_EXCEPTION', 'ALL_COMPLETED', )
+
+log = logging.getLogger('robj.lib.futures')
+
+FIRST_COMPLETED = 'FIRST_COMPLETED'
+FIRST_EXCEPTION = 'FIRST_EXCEPTION'
+ALL_COMPLETED = 'ALL_COMPLETED'
+
+
+class Future(object):
+    """
+    Placeholder for the result of work that may not have completed yet.
+
+    Waiting with a timeout polls on python 2, where threading.Condition
+    sleeps in steps of up to 50ms until it is notified, so it costs some
+    CPU and can return up to 50ms after the work completes. Waiting
+    without a timeout blocks until notified.
+    """
+
+    def __init__(self):
+        self._cond = Condition()
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def __repr__(self):
+        if not self._done:
+            state = 'pending'
+        elif self._exc_info:
+            state = 'raised %s' % self._exc_info[0].__name__
+        else:
+            state = 'returned %s' % type(self._result).__name__
+        return '<robj.Future(%s)>' % state
+
+    def done(self):
+        """
+        Check if the result or exception has been set.
+        """
+
+        return self._done
+
+    def _wait(self, timeout=None):
+        """
+        Block until the future is done or the timeout expires.
+        @return: True if the future is done.
+        @rtype: boolean
+        """
+
+        self._cond.acquire()
+        try:
+            if timeout is None:
+                while not self._done:
+                    self._cond.wait()
+            else:
+                # Condition.wait polls when given a timeout on python 2.
+                end = now() + timeout
+                while not self._done:
+                    remaining = end - now()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            return self._done
+        finally:
+            self._cond.release()
+
+    def result(self, timeout=None):
+        """
+        Return the result, raising the exception if the work failed.
+        @param timeout: Optional number of seconds to wait before giving up,
+                        which polls on python 2.
+        @type timeout: float
+        """
+
+        if not self._wait(timeout):
+            raise HTTPResponseTimeout
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Return the exception raised by the work, or None if it succeeded.
+        @param timeout: Optional number of seconds to wait before giving up,
+                        which polls on python 2.
+        @type timeout: float
+        """
+
+        if not self._wait(timeout):
+            raise HTTPResponseTimeout
+        if self._exc_info:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, fn):
+        """
+        Call fn with this future once it is done. If the future is already
+        done, fn is called immediately.
+        """
+
+        self._cond.acquire()
+        try:
+            if not self._done:
+                self._callbacks.append(fn)
+                return
+        finally:
+            self._cond.release()
+        self._call(fn)
+
+    def _remove_done_callback(self, fn):
+        self._cond.acquire()
+        try:
+            if fn in self._callbacks:
+                self._callbacks.remove(fn)
+        finally:
+            self._cond.release()
+
+    def _call(self, fn):
+        try:
+            fn(self)
+        except Exception:
+            log.exception('exception raised in future callback')
+
+    def _finish(self, result, exc_info):
+        self._cond.acquire()
+        try:
+            if self._done:
+                return
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            callbacks, self._callbacks = self._callbacks, []
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+        for fn in callbacks:
+            self._call(fn)
+
+    def set_result(self, result):
+        """
+        Mark the future as done with the given result.
+        """
+
+        self._finish(result, None)
+
+    def set_exception(self, exc_info=None):
+        """
+        Mark the future as failed.
+        @param exc_info: Exception information as returned by sys.exc_info().
+                         (default: the exception currently being handled)
+        @type exc_info: tuple
+        """
+
+        if exc_info is None:
+            exc_info = sys.exc_info()
+        self._finish(None, exc_info)
+
+
+class _Waiter(object):
+    """
+    Collect futures as they complete.
+    """
+
+    def __init__(self):
+        self.cond = Condition()
+        self.finished = []
+
+    def __call__(self, future):
+        self.cond.acquire()
+        try:
+            self.finished.append(future)
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+
+class CompletionQueue(object):
+    """
+    Collect completed futures behind a pollable file descriptor. This allows an
+    event loop (select, poll, twisted, tornado, etc.) to wait on any number of
+    outstanding requests without blocking: register fileno() for reading and
+    call get() whenever it becomes readable.
+    """
+
+    def __init__(self):
+        self._rfd, self._wfd = os.pipe()
+        for fd in (self._rfd, self._wfd):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+        self._lock = Lock()
+        self._completed = []
+
+    def fileno(self):
+        return self._rfd
+
+    def add(self, future):
+        """
+        Watch the given future, posting it to the queue once it completes.
+        @return: The future that was added.
+        @rtype: Future
+        """
+
+        future.add_done_callback(self._post)
+        return future
+
+    def _post(self, future):
+        self._lock.acquire()
+        try:
+            self._completed.append(future)
+        finally:
+            self._lock.release()
+
+        try:
+            os.write(self._wfd, '.')
+        except OSError, e:
+            # A full pipe will already wake up the reader.
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def get(self):
+        """
+        Return the futures that have completed since the last call.
+        @rtype: list of Future
+        """
+
+        # Drain the pipe before collecting so that a future completing in
+        # between causes another wake up rather than being missed.
+        try:
+            while os.read(self._rfd, 4096):
+                pass
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+        self._lock.acquire()
+        try:
+            completed, self._completed = self._completed, []
+        finally:
+            self._lock.release()
+        return completed
+
+    def close(self):
+        os.close(self._rfd)
+        os.close(self._wfd)
+
+
+def as_completed(futures, timeout=None):
+    """
+    Iterate over the given futures, yielding each one as it completes.
+    @param futures: Futures to wait on.
+    @type futures: iterable of Future
+    @param timeout: Optional number of seconds to wait for all of the futures
+                    before raising HTTPResponseTimeout, which polls on
+                    python 2.
+    @type timeout: float
+    """
+
+    pending = set(futures)
+    end = timeout is not None and now() + timeout or None
+
+    waiter = _Waiter()
+    for future in pending:
+        future.add_done_callback(waiter)
+
+    try:
+        while pending:
+            waiter.cond.acquire()
+            try:
+                while not waiter.finished:
+                    if end is None:
+                        waiter.cond.wait()
+                        continue
+                    remaining = end - now()
+                    if remaining <= 0:
+                        raise HTTPResponseTimeout
+                    waiter.cond.wait(remaining)
+                finished, waiter.finished = waiter.finished, []
+            finally:
+                waiter.cond.release()
+
+            for future in finished:
+                pending.discard(future)
+                yield future
+    finally:
+        for future in pending:
+            future._remove_done_callback(waiter)
+
+
+def wait(futures, timeout=None, return_when=ALL_COMPLETED):
+    """
+    Wait for the given futures to complete.
+    @param futures: Futures to wait on.
+    @type futures: iterable of Future
+    @param timeout: Optional number of seconds to wait, which polls on
+                    python 2.
+    @type timeout: float
+    @param return_when: One of FIRST_COMPLETED, FIRST_EXCEPTION or
+                        ALL_COMPLETED. (default: ALL_COMPLETED)
+    @type return_when: str
+    @return: Two sets, the futures that are done and those that are not.
+    @rtype: tuple
+    """
+
+    futures = set(futures)
+    done = set()
+
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            done.add(future)
+            if return_when == FIRST_COMPLETED:
+                break
+            if (return_when == FIRST_EXCEPTION and
+                future.exception() is not None):
+                break
+    except HTTPResponseTimeout:
+        pass
+
+    return done, futures - done
@@ -19,35 +19,63 @@
 Module for httplib customizations.
 """
 
+import os
+import time
+import zlib
+import base64
+import binascii
+from StringIO import StringIO
+from email.utils import parsedate_tz
+from email.utils import mktime_tz
+
 from robj.lib import util
+from robj.lib import fixedhttplib
 from robj.lib import xutil
 
 class HTTPData(object):
     __slots__ = ('data', 'method', 'size', 'headers', 'contentType', 'callback',
-        'chunked', 'bufferSize', 'rateLimit', 'tag')
+        'chunked', 'bufferSize', 'rateLimit', 'tag', 'resumable',
+        'segmentSize', 'offset', 'digest', 'hashed', 'compress')
 
     CHUNK_SIZE = 262144
     BUFFER_SIZE = 8192
+    SEGMENT_SIZE = 32 * CHUNK_SIZE
 
     def __init__(self, data=None, method=None, size=None, headers=None,
         contentType=None, callback=None, chunked=None, bufferSize=None,
-        rateLimit=None, tag=None):
+        rateLimit=None, tag=None, resumable=False, segmentSize=None,
+        digest=None, compress=False):
 
         if headers is None:
             headers = HTTPHeaders()
 
+        if compress and resumable:
+            raise ValueError('resumable uploads can not be compressed')
+
         if data is not None:
             if isinstance(data, dict):
                 obj = xutil.XObjify(data, tag)
                 data = xutil.xobj.toxml(obj, tag)
 
             if hasattr(data, 'read'):
+                # Resumable uploads are sent in segments of a known size.
+                if resumable:
+                    chunked = False
+                    if size is None and hasattr(data, 'fileno'):
+                        size = os.fstat(data.fileno()).st_size
                 if chunked:
                     headers['Transfer-Encoding'] = 'Chunked'
             else:
                 data = data.encode('utf-8')
                 size = len(data)
 
+            # Compressed bodies are sent chunked since their size isn't known
+            # until they have been sent.
+            if compress:
+                chunked = True
+                headers['Content-Encoding'] = 'gzip'
+                headers['Transfer-Encoding'] = 'Chunked'
+
         if contentType is None:
             contentType = util.getContentType(data)
 
@@ -61,6 +89,23 @@ class HTTPData(object):
         self.bufferSize = bufferSize or self.BUFFER_SIZE
         self.rateLimit = rateLimit
 
+        if resumable and size is None:
+            raise ValueError('resumable uploads require a size')
+
+        # Number of bytes of a resumable upload the server has acknowledged.
+        self.resumable = resumable
+        self.segmentSize = segmentSize or self.SEGMENT_SIZE
+        self.offset = 0
+
+        # Object with an update method, such as a hashlib digest or
+        # util.MultiDigest, that is fed the body as it is sent, and the number
+        # of bytes it has been fed.
+        self.digest = digest
+        self.hashed = 0
+
+        # Gzip compress the body as it is sent.
+        self.compress = compress
+
     def iterheaders(self):
         if isinstance(self.headers, HTTPHeaders):
             for k, v in self.headers.iteritems():
@@ -68,7 +113,7 @@ class HTTPData(object):
         else:
             for k, v in sorted(self.headers.iteritems()):
                 yield k, str(v)
-        if self.size is not None:
+        if self.size is not None and not self.compress:
             yield 'Content-Length', str(self.size)
         if self.contentType is not None:
             yield 'Content-Type', self.contentType
@@ -77,25 +122,130 @@ class HTTPData(object):
         if self.data is None:
             return
 
+        digest = None
+        if self.digest is not None:
+            digest = _DigestFrom(self, 0)
+
+        if self.compress:
+            data = self.data
+            if not hasattr(data, 'read'):
+                data = StringIO(data)
+
+            output = GzipSender(ChunkedSender(connection))
+            util.copyfileobj(data, output, bufSize=self.bufferSize,
+                callback=self.callback, rateLimit=self.rateLimit,
+                digest=digest)
+            output.close()
+            return
+
         if not hasattr(self.data, 'read'):
             connection.send(self.data)
+            if digest:
+                digest.update(self.data)
             return
 
         if self.chunked:
             # Use chunked coding
             output = ChunkedSender(connection)
             util.copyfileobj(self.data, output, bufSize=self.bufferSize,
-                    callback=self.callback, rateLimit=self.rateLimit)
+                    callback=self.callback, rateLimit=self.rateLimit,
+                    digest=digest)
             output.close()
+        elif self.size is not None and self._sendfile(connection):
+            # Regular files are sent by the connection in large spans.
+            connection.sendfile(self.data, self.data.tell(), self.size,
+                callback=self.callback, digest=digest)
         elif self.size is not None:
             # Use identity coding
             util.copyfileobj(self.data, connection, bufSize=self.bufferSize,
                 callback=self.callback, rateLimit=self.rateLimit,
-                sizeLimit=self.size)
+                sizeLimit=self.size, digest=digest)
         else:
             raise RuntimeError("Request must use chunked transfer coding "
                     "if size is not known.")
 
+    def _sendfile(self, connection):
+        """
+        Check if the body can be handed to connection.sendfile, which doesn't
+        support rate limiting.
+        """
+
+        return (hasattr(connection, 'sendfile') and not self.rateLimit and
+            fixedhttplib.isRegularFile(self.data))
+
+    def segment(self, start, size):
+        """
+        Get the part of a resumable upload starting at byte start.
+        @rtype: HTTPDataSegment
+        """
+
+        return HTTPDataSegment(self, start, size)
+
+
+class HTTPDataSegment(object):
+    """
+    Part of a resumable HTTPData upload, sent with a Content-Range header.
+    """
+
+    def __init__(self, parent, start, size):
+        self.parent = parent
+        self.start = start
+        self.size = size
+
+    @property
+    def contentRange(self):
+        return 'bytes %s-%s/%s' % (self.start, self.start + self.size - 1,
+            self.parent.size)
+
+    def iterheaders(self):
+        for key, value in self.parent.iterheaders():
+            if key.lower() not in ('content-length', 'transfer-encoding'):
+                yield key, value
+        yield 'Content-Length', str(self.size)
+        yield 'Content-Range', self.contentRange
+
+    def writeTo(self, connection):
+        parent = self.parent
+
+        data = parent.data
+        if not hasattr(data, 'read'):
+            data = StringIO(data)
+
+        digest = None
+        if parent.digest is not None:
+            digest = _DigestFrom(parent, self.start)
+
+        # Always start from the segment offset so that retries resend the
+        # same bytes.
+        if parent._sendfile(connection):
+            connection.sendfile(data, self.start, self.size,
+                callback=parent.callback, total=self.start, digest=digest)
+            return
+
+        data.seek(self.start)
+        util.copyfileobj(data, connection, bufSize=parent.bufferSize,
+            callback=parent.callback, rateLimit=parent.rateLimit,
+            sizeLimit=self.size, total=self.start, digest=digest)
+
+
+class _DigestFrom(object):
+    """
+    Feed the part of an HTTPData body sent from offset pos onwards to its
+    digest, skipping anything an earlier attempt already fed it.
+    """
+
+    def __init__(self, data, pos):
+        self.data = data
+        self.pos = pos
+
+    def update(self, buf):
+        data = self.data
+        skip = max(data.hashed - self.pos, 0)
+        if skip < len(buf):
+            data.digest.update(buf[skip:])
+            data.hashed = self.pos + len(buf)
+        self.pos += len(buf)
+
 
 class ChunkedSender(object):
     """
@@ -114,6 +264,109 @@ class ChunkedSender(object):
         self.target.send("0\r\n%s\r\n" % (trailer,))
 
 
+class GzipSender(object):
+    """
+    Gzip compress everything sent through a socket-like object, which is
+    closed along with this one.
+    """
+
+    def __init__(self, target, level=6):
+        self.target = target
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+            16 + zlib.MAX_WBITS)
+
+    def send(self, data):
+        data = self._compressor.compress(data)
+        if data:
+            self.target.send(data)
+
+    def close(self):
+        data = self._compressor.flush()
+        if data:
+            self.target.send(data)
+        self.target.close()
+
+
+class ContentDecoder(object):
+    """
+    File like object that decodes a gzip or deflate coded response body as it
+    is read from the response.
+    @param fobj: Object to read the coded body from.
+    @type fobj: httplib.HTTPResponse
+    @param encoding: Content coding of the body, as returned by
+                     getContentEncoding.
+    @type encoding: str
+    @param digest: Optional object with an update method that is fed the
+                   coded body.
+    """
+
+    BLOCK_SIZE = 65536
+
+    def __init__(self, fobj, encoding, digest=None):
+        self._fobj = fobj
+        self._digest = digest
+        self._deflate = encoding == 'deflate'
+
+        if self._deflate:
+            self._decoder = zlib.decompressobj()
+        else:
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._started = False
+        self._done = False
+
+        # Output of the last decompressed block and how much of it has been
+        # returned.
+        self._pending = ''
+        self._pos = 0
+
+        # The decoded length isn't known up front.
+        self.length = None
+
+    def _decompress(self, data):
+        try:
+            try:
+                return self._decoder.decompress(data)
+            except zlib.error:
+                # Some servers send deflate without the zlib wrapper.
+                if not self._deflate or self._started:
+                    raise
+                self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+                return self._decoder.decompress(data)
+        finally:
+            self._started = True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return ''.join(iter(lambda: self.read(self.BLOCK_SIZE), ''))
+
+        while self._pos >= len(self._pending):
+            if self._done:
+                return ''
+
+            self._pos = 0
+            data = self._fobj.read(self.BLOCK_SIZE)
+            if data:
+                if self._digest:
+                    self._digest.update(data)
+                self._pending = self._decompress(data)
+            else:
+                self._pending = self._decoder.flush()
+                self._done = True
+
+        if not self._pos and size >= len(self._pending):
+            data = self._pending
+        else:
+            data = self._pending[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+    def isclosed(self):
+        return self._done and self._pos >= len(self._pending)
+
+    def close(self):
+        self._fobj.close()
+
+
 class HTTPHeaders(object):
     """
     Case insensitive, case preserving, multi key dictionary like store for
@@ -179,3 +432,181 @@ class HTTPHeaders(object):
 
 def isHTTPData(obj):
     return isinstance(obj, HTTPData)
+
+
+def parseCacheControl(value):
+    """
+    Parse the value of a Cache-Control header.
+    @return: Mapping of lower case directive names to their values, or None
+             for directives without a value.
+    @rtype: dict
+    """
+
+    directives = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '=' in item:
+            key, val = item.split('=', 1)
+            directives[key.strip().lower()] = val.strip().strip('"')
+        else:
+            directives[item.lower()] = None
+    return directives
+
+def parseHTTPDate(value):
+    """
+    Parse an HTTP date into seconds since the epoch.
+    @return: Seconds since the epoch or None if value is not a valid date.
+    """
+
+    parsed = value and parsedate_tz(value) or None
+    if parsed is None:
+        return None
+    try:
+        return mktime_tz(parsed)
+    except (OverflowError, ValueError):
+        return None
+
+def parseContentRange(value):
+    """
+    Parse the value of a Content-Range header.
+    @return: Tuple of the first and last byte positions and the total length,
+             or None if value is not a valid byte range.
+    @rtype: tuple
+    """
+
+    if not value or not value.startswith('bytes '):
+        return None
+    try:
+        span, total = value[len('bytes '):].split('/', 1)
+        start, end = span.split('-', 1)
+        return int(start), int(end), int(total)
+    except ValueError:
+        return None
+
+def getRangeValidator(response):
+    """
+    Get the validator of a response that can be sent in an If-Range header,
+    which has to be a strong ETag or a Last-Modified date.
+    @param response: Object providing getheader(name, default).
+    @return: The validator, or None if there isn't a usable one.
+    @rtype: str
+    """
+
+    etag = response.getheader('etag', None)
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.getheader('last-modified', None)
+
+# Digest header algorithm names and their hashlib names.
+_digestAlgorithms = {
+    'md5': 'md5',
+    'sha': 'sha1',
+    'sha-256': 'sha256',
+    'sha-512': 'sha512',
+}
+
+def getExpectedDigests(response, partial=False):
+    """
+    Get the checksums of the response body sent by the server in Content-MD5
+    and Digest headers.
+    @param response: Object providing getheader(name, default).
+    @param partial: The response only contains a range of the resource, so
+                    the Digest header, which covers all of it, doesn't apply.
+    @type partial: bool
+    @return: Mapping of hashlib algorithm name to raw digest.
+    @rtype: dict
+    """
+
+    values = []
+    contentMD5 = response.getheader('content-md5', None)
+    if contentMD5:
+        values.append(('md5', contentMD5))
+
+    digest = not partial and response.getheader('digest', None) or ''
+    for item in digest.split(','):
+        if '=' in item:
+            name, value = item.split('=', 1)
+            name = _digestAlgorithms.get(name.strip().lower())
+            if name:
+                values.append((name, value))
+
+    expected = {}
+    for name, value in values:
+        try:
+            expected[name] = base64.b64decode(value.strip())
+        except (TypeError, binascii.Error):
+            continue
+    return expected
+
+# Content codings that ContentDecoder understands.
+_contentEncodings = {
+    'gzip': 'gzip',
+    'x-gzip': 'gzip',
+    'deflate': 'deflate',
+}
+
+def getContentEncoding(response):
+    """
+    Get the content coding of a response body.
+    @param response: Object providing getheader(name, default).
+    @return: gzip, deflate, or None if the body isn't coded or the coding
+             isn't supported.
+    @rtype: str
+    """
+
+    value = response.getheader('content-encoding', None) or ''
+    return _contentEncodings.get(value.strip().lower())
+
+def isJSONResponse(response):
+    """
+    Check if the body of a response is JSON, going by its Content-Type.
+    @param response: Object providing getheader(name, default).
+    @rtype: bool
+    """
+
+    value = response.getheader('content-type', None) or ''
+    value = value.split(';', 1)[0].strip().lower()
+    return value == 'application/json' or value.endswith('+json')
+
+def _seconds(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return 0
+
+def getFreshness(response, defaultTTL=None):
+    """
+    Work out how long a response may be used before it must be revalidated
+    from its Cache-Control and Expires headers.
+    @param response: Object providing getheader(name, default).
+    @param defaultTTL: Lifetime to use if the response doesn't specify one.
+                       (default: never expires)
+    @type defaultTTL: int
+    @return: None if the response must not be stored, otherwise a tuple of the
+             lifetime in seconds, or None if the response doesn't expire, and
+             the number of seconds after that the response may still be used
+             while it is revalidated in the background.
+    @rtype: tuple
+    """
+
+    cc = parseCacheControl(response.getheader('cache-control', None))
+
+    if 'no-store' in cc:
+        return None
+
+    if 'no-cache' in cc:
+        lifetime = 0
+    elif 'max-age' in cc:
+        lifetime = _seconds(cc['max-age'])
+    elif response.getheader('expires', None) is not None:
+        # Use the server's clock if possible, invalid dates mean the response
+        # has already expired.
+        expires = parseHTTPDate(response.getheader('expires'))
+        date = parseHTTPDate(response.getheader('date', None)) or time.time()
+        lifetime = expires and max(expires - date, 0) or 0
+    else:
+        lifetime = defaultTTL
+
+    return lifetime, _seconds(cc.get('stale-while-revalidate'))
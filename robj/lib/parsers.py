@@ -0,0 +1,473 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+XML parser backends that build the object trees wrapped by rObjProxy.
+
+Every backend returns the top level object of a document with the same shape
+that xobj produces: elements and attributes are attributes of the object,
+repeated elements are lists and the _xobj metadata holds the tag and the
+names of the elements and attributes. The ElementTree based backends only
+handle the plain documents that REST services send, anything else, such as
+namespaces or mixed content, is handed to xobj.
+"""
+
+import gc
+import re
+import json
+import multiprocessing
+from threading import Lock
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+    cElementTree = None
+else:
+    cElementTree = ElementTree
+
+try:
+    from lxml import etree as lxml
+except ImportError:
+    lxml = None
+
+from xobj import xobj
+
+__all__ = ('XObjParser', 'ElementTreeParser', 'LxmlParser', 'JSONParser',
+    'ProcessParser', 'getParser', )
+
+
+class XObjElement(object):
+    """
+    Element with child elements.
+    """
+
+
+class XObjText(str):
+    """
+    Element with only text, or nothing, as content.
+    """
+
+
+class XObjUnicode(unicode):
+    """
+    Element with only non-ASCII text as content.
+    """
+
+
+class _Unsupported(Exception):
+    """
+    Raised while building a tree that xobj needs to handle.
+    """
+
+
+_identifier = re.compile('^[A-Za-z][A-Za-z0-9_]*$')
+
+
+def _build(elem, names):
+    """
+    Convert an element and its children to xobj style objects.
+    @param names: Map of tag and attribute names that have already been
+                  checked.
+    @type names: dict
+    """
+
+    tag = elem.tag
+    if tag not in names:
+        if not isinstance(tag, basestring) or not _identifier.match(tag):
+            raise _Unsupported
+        names[tag] = True
+
+    children = list(elem)
+    text = elem.text
+    if children:
+        if text and not text.isspace():
+            raise _Unsupported
+        node = XObjElement()
+    elif isinstance(text, unicode):
+        node = XObjUnicode(text)
+    else:
+        node = XObjText(text or '')
+
+    values = node.__dict__
+    meta = values['_xobj'] = xobj.XObjMetadata(elements=[], attributes={},
+        tag=tag)
+
+    for key, value in elem.attrib.items():
+        if key not in names:
+            if not _identifier.match(key):
+                raise _Unsupported
+            names[key] = True
+        meta.attributes[key] = str
+        values[key] = value
+
+    elements = meta.elements
+    for child in children:
+        if child.tail and not child.tail.isspace():
+            raise _Unsupported
+
+        value = _build(child, names)
+        name = child.tag
+        if name in meta.attributes:
+            raise _Unsupported
+
+        current = values.get(name)
+        if current is None:
+            values[name] = value
+            elements.append(name)
+        elif isinstance(current, list):
+            current.append(value)
+        else:
+            values[name] = [current, value]
+
+    return node
+
+
+def _withoutGC(func, *args):
+    """
+    Call func with the cyclic garbage collector paused. Building a large tree
+    allocates enough objects to set it off over and over, while none of them
+    can be freed.
+    """
+
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return func(*args)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _str(value):
+    """
+    Convert JSON text, which is always unicode, to a str if it is ASCII, as
+    it would be when parsing XML.
+    """
+
+    try:
+        return str(value)
+    except UnicodeEncodeError:
+        return value
+
+
+def _text(value):
+    """
+    Convert JSON text to an element with only text as content.
+    """
+
+    try:
+        return XObjText(value)
+    except UnicodeEncodeError:
+        return XObjUnicode(value)
+
+
+def _buildJSON(tag, value, names):
+    """
+    Convert a JSON value, with objects decoded as tuples of pairs, to xobj
+    style objects.
+    @param names: Map of JSON member names to tag and attribute names.
+    @type names: dict
+    """
+
+    if isinstance(value, list):
+        return [ _buildJSON(tag, x, names) for x in value ]
+
+    # Numbers, booleans and null are kept as they are.
+    if not isinstance(value, (tuple, basestring)):
+        return value
+
+    attributes = []
+    elements = []
+    text = None
+    if isinstance(value, tuple):
+        for key, item in value:
+            if key == '#text':
+                text = item
+            elif key[:1] == '@':
+                attributes.append((key, item))
+            else:
+                elements.append((key, item))
+    else:
+        text = value
+
+    if elements:
+        node = XObjElement()
+    elif text is not None:
+        node = _text(unicode(text))
+    else:
+        node = XObjText()
+
+    values = node.__dict__
+    meta = values['_xobj'] = xobj.XObjMetadata(elements=[], attributes={},
+        tag=tag)
+
+    for key, item in attributes:
+        name = names.get(key)
+        if name is None:
+            name = names[key] = _str(key[1:])
+        if isinstance(item, unicode):
+            item = _str(item)
+        meta.attributes[name] = str
+        values[name] = item
+
+    for key, item in elements:
+        name = names.get(key)
+        if name is None:
+            name = names[key] = _str(key)
+        values[name] = _buildJSON(name, item, names)
+        meta.elements.append(name)
+
+    return node
+
+
+class XObjParser(object):
+    """
+    Parse documents with xobj.
+    """
+
+    name = 'xobj'
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def parse(self, content):
+        """
+        Parse a document and return its top level object.
+        @param content: The document, either a string or a file object.
+        @type content: str or file
+        """
+
+        if isinstance(content, basestring):
+            doc = xobj.parse(content)
+        else:
+            doc = xobj.parsef(content)
+
+        # Pull the top level object out of the document.
+        assert isinstance(doc, xobj.Document)
+        assert len(doc._xobj.elements) == 1
+        return getattr(doc, doc._xobj.elements[0])
+
+    def fromElement(self, elem):
+        """
+        Convert an already parsed element, as returned by
+        xml.etree.cElementTree, to an object.
+        """
+
+        return self.parse(ElementTree.tostring(elem))
+
+
+class _TreeParser(XObjParser):
+    """
+    Base class for backends that parse into an element tree and build the
+    objects from it, falling back to xobj for documents they can't handle.
+    """
+
+    def _fromstring(self, content):
+        raise NotImplementedError
+
+    def _build(self, elem):
+        return _withoutGC(_build, elem, {})
+
+    def parse(self, content):
+        if not isinstance(content, basestring):
+            content = content.read()
+
+        try:
+            return self._build(self._fromstring(content))
+        except (_Unsupported, SyntaxError):
+            # Let xobj deal with it, or report the error the same way.
+            return XObjParser.parse(self, content)
+
+    def fromElement(self, elem):
+        try:
+            return self._build(elem)
+        except _Unsupported:
+            return XObjParser.fromElement(self, elem)
+
+
+class ElementTreeParser(_TreeParser):
+    """
+    Parse documents with the expat based cElementTree.
+    """
+
+    name = 'celementtree'
+
+    @classmethod
+    def available(cls):
+        return cElementTree is not None
+
+    def _fromstring(self, content):
+        return cElementTree.fromstring(content)
+
+
+class LxmlParser(_TreeParser):
+    """
+    Parse documents with lxml.
+    """
+
+    name = 'lxml'
+
+    @classmethod
+    def available(cls):
+        return lxml is not None
+
+    def _fromstring(self, content):
+        # Parser instances can't be shared between threads.
+        parser = lxml.XMLParser(resolve_entities=False, remove_comments=True,
+            remove_pis=True, huge_tree=True)
+        return lxml.fromstring(content, parser)
+
+
+class JSONParser(object):
+    """
+    Parse JSON documents into the same objects as the XML backends. Documents
+    are objects with a single member named after the top level element,
+    following the usual mapping of XML to JSON: members whose names start
+    with @ are attributes, #text is the text of an element that also has
+    attributes and arrays are repeated elements.
+    """
+
+    name = 'json'
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def parse(self, content):
+        """
+        Parse a document and return its top level object.
+        @param content: The document, either a string or a file object.
+        @type content: str or file
+        """
+
+        # Keep objects as tuples of pairs so that element order is preserved.
+        if isinstance(content, basestring):
+            doc = json.loads(content, object_pairs_hook=tuple)
+        else:
+            doc = json.load(content, object_pairs_hook=tuple)
+
+        if not isinstance(doc, tuple) or len(doc) != 1:
+            raise ValueError('JSON document must be an object with a single '
+                'member')
+
+        tag, value = doc[0]
+        tag = _str(tag)
+
+        return _withoutGC(_buildJSON, tag, value, {})
+
+
+# Preferred backends first. lxml creates a Python proxy for every element
+# that is visited, so cElementTree comes out ahead when the whole tree is
+# converted.
+parsers = dict((x.name, x) for x in (ElementTreeParser, LxmlParser,
+    XObjParser))
+preferred = ('celementtree', 'lxml', 'xobj', )
+
+
+def getParser(parser=None):
+    """
+    Get a parser instance.
+    @param parser: Name of a backend ('celementtree', 'lxml' or 'xobj'), a
+                   parser class or None for the fastest one available.
+    @type parser: str or class
+    """
+
+    if parser is None:
+        for name in preferred:
+            if parsers[name].available():
+                parser = parsers[name]
+                break
+
+    elif isinstance(parser, basestring):
+        try:
+            parser = parsers[parser.lower()]
+        except KeyError:
+            raise ValueError('unknown parser: %s' % parser)
+        if not parser.available():
+            raise ValueError('parser is not available: %s' % parser.name)
+
+    return parser()
+
+
+def _parseTree(name, content):
+    """
+    Parse a document in a pool process. Trees that need xobj can't be passed
+    back, None is returned for those.
+    """
+
+    parser = parsers[name]()
+    try:
+        return parser._build(parser._fromstring(content))
+    except (_Unsupported, SyntaxError):
+        return None
+
+
+class ProcessParser(object):
+    """
+    Parse documents in a pool of processes, so that parsing large documents
+    doesn't hold the GIL in the calling process. The pool is started when the
+    parser is created, since forking while other threads hold locks can leave
+    the children deadlocked; create it before starting any threads.
+    @param parser: Backend to parse with, which must be ElementTree or lxml
+                   based since xobj trees can't be passed between processes.
+    @type parser: XObjParser
+    @param processes: Number of processes in the pool.
+    @type processes: int
+    """
+
+    def __init__(self, parser, processes):
+        if not isinstance(parser, _TreeParser):
+            raise ValueError('documents parsed by %s can not be passed '
+                'between processes' % parser.name)
+
+        self._parser = parser
+
+        self._pool = multiprocessing.Pool(processes)
+        self._lock = Lock()
+
+    def parse(self, content):
+        """
+        Parse a document and return its top level object.
+        @param content: The document.
+        @type content: str
+        """
+
+        self._lock.acquire()
+        pool = self._pool
+        self._lock.release()
+
+        # Once closed, documents are parsed in process.
+        root = None
+        if pool is not None:
+            root = pool.apply(_parseTree, (self._parser.name, content))
+
+        # Anything the pool couldn't handle is parsed here.
+        if root is None:
+            root = self._parser.parse(content)
+        return root
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+            self._pool = None
+        finally:
+            self._lock.release()
@@ -0,0 +1,172 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Module for rate limiting primitives.
+"""
+
+import time
+from threading import Lock
+
+# Prefer a monotonic clock when the interpreter provides one so that wall clock
+# adjustments don't stall or release a bucket. Python 2 doesn't, so buckets
+# have to cope with the clock going backwards.
+now = getattr(time, 'monotonic', time.time)
+
+
+class TokenBucket(object):
+    """
+    Thread safe token bucket.
+    @param rate: Number of tokens added to the bucket per second.
+    @type rate: float
+    @param burst: Maximum number of tokens the bucket can hold. (default: rate,
+                  but at least 1)
+    @type burst: float
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError('rate must be positive: %s' % rate)
+
+        self.rate = float(rate)
+        if burst is None:
+            burst = max(self.rate, 1)
+        self.burst = float(burst)
+
+        self._tokens = self.burst
+        self._last = now()
+        self._lock = Lock()
+
+    def _refill(self, ts):
+        # A clock that was set back adds nothing rather than taking tokens
+        # away.
+        elapsed = max(0, ts - self._last)
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+        self._last = ts
+
+    def reserve(self, tokens=1):
+        """
+        Take tokens from the bucket, going into debt if needed.
+        @return: Number of seconds the caller must wait before the reserved
+                 tokens may be used.
+        @rtype: float
+        """
+
+        self._lock.acquire()
+        try:
+            self._refill(now())
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0
+            return -self._tokens / self.rate
+        finally:
+            self._lock.release()
+
+    def consume(self, tokens=1):
+        """
+        Take tokens from the bucket, sleeping until they are available.
+        """
+
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class BandwidthScheduler(object):
+    """
+    Bandwidth budget shared by every transfer that draws from it, across any
+    number of connections and clients. Uploads and downloads have separate
+    budgets, each with an optional limit per host on top of the overall one.
+    All rates are in bytes per second, None means unlimited.
+    @param uploadRate: Limit for all uploads.
+    @type uploadRate: float
+    @param downloadRate: Limit for all downloads.
+    @type downloadRate: float
+    @param hostUploadRate: Limit for uploads to any one host.
+    @type hostUploadRate: float
+    @param hostDownloadRate: Limit for downloads from any one host.
+    @type hostDownloadRate: float
+    """
+
+    UPLOAD = 'upload'
+    DOWNLOAD = 'download'
+
+    # Fraction of a second worth of transfer that may be sent at once. Keeping
+    # this small spreads transfers evenly over time rather than in bursts.
+    BURST = 0.1
+
+    def __init__(self, uploadRate=None, downloadRate=None,
+        hostUploadRate=None, hostDownloadRate=None):
+
+        self._rates = {
+            self.UPLOAD: (uploadRate, hostUploadRate),
+            self.DOWNLOAD: (downloadRate, hostDownloadRate),
+        }
+
+        self._buckets = {}
+        self._lock = Lock()
+
+    def _getBucket(self, name, rate):
+        self._lock.acquire()
+        try:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                bucket = self._buckets[name] = TokenBucket(rate,
+                    burst=max(rate * self.BURST, 1))
+            return bucket
+        finally:
+            self._lock.release()
+
+    def reserve(self, direction, key, size):
+        """
+        Take size bytes from the budgets for direction and host key.
+        @return: Number of seconds the caller must wait before sending.
+        @rtype: float
+        """
+
+        rate, hostRate = self._rates[direction]
+
+        delay = 0
+        if rate:
+            delay = self._getBucket((direction, ), rate).reserve(size)
+        if hostRate:
+            delay = max(delay,
+                self._getBucket((direction, key), hostRate).reserve(size))
+        return delay
+
+    def throttle(self, direction, key, size):
+        """
+        Wait until size bytes may be transferred.
+        """
+
+        delay = self.reserve(direction, key, size)
+        if delay > 0:
+            time.sleep(delay)
+
+    def throttler(self, direction, key):
+        """
+        Get a callable taking a number of bytes that paces transfers in
+        direction to host key.
+        @return: The callable or None if direction isn't limited.
+        """
+
+        if not [ x for x in self._rates[direction] if x ]:
+            return None
+
+        def throttle(size):
+            self.throttle(direction, key, size)
+        return throttle
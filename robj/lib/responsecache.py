@@ -0,0 +1,180 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Module for persisting GET responses between processes.
+"""
+
+import os
+import time
+import sqlite3
+from threading import Lock
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    uri TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    etag TEXT,
+    modified TEXT,
+    expires REAL,
+    stale REAL NOT NULL DEFAULT 0,
+    stored REAL NOT NULL
+)
+"""
+
+
+class CachedResponse(object):
+    """
+    A response loaded from the persistent cache.
+    """
+
+    __slots__ = ('uri', 'body', 'etag', 'modified', 'expires',
+        'staleWhileRevalidate', 'stored')
+
+    def __init__(self, uri, body, etag, modified, expires,
+        staleWhileRevalidate, stored):
+
+        self.uri = uri
+        self.body = body
+        self.etag = etag
+        self.modified = modified
+        self.expires = expires
+        self.staleWhileRevalidate = staleWhileRevalidate
+        self.stored = stored
+
+
+class ResponseCache(object):
+    """
+    Persistent cache of GET response bodies and their cache headers, keyed by
+    normalized URI. The cache is stored in a sqlite database so that it may be
+    shared by any number of threads and processes.
+    @param path: Path to the cache database, which is created if needed.
+    @type path: str
+    @param timeout: Number of seconds to wait for another process to release
+                    the database. (default: 30)
+    @type timeout: int
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+
+        self._db = None
+        self._pid = None
+        self._lock = Lock()
+
+    def _connect(self):
+        # Connections can not be carried across a fork.
+        if self._db is not None and self._pid == os.getpid():
+            return self._db
+
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        db = sqlite3.connect(self.path, timeout=self.timeout,
+            isolation_level=None, check_same_thread=False)
+
+        # Write ahead logging lets readers proceed while another process is
+        # writing, it isn't available on all platforms and filesystems.
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.DatabaseError:
+            pass
+        db.execute(_SCHEMA)
+
+        self._db = db
+        self._pid = os.getpid()
+        return db
+
+    def _execute(self, sql, args=()):
+        self._lock.acquire()
+        try:
+            return self._connect().execute(sql, args).fetchall()
+        finally:
+            self._lock.release()
+
+    def get(self, uri):
+        """
+        Look up the stored response for uri.
+        @return: The cached response or None.
+        @rtype: CachedResponse
+        """
+
+        rows = self._execute('SELECT uri, body, etag, modified, expires, '
+            'stale, stored FROM responses WHERE uri = ?', (uri, ))
+        if not rows:
+            return None
+
+        row = list(rows[0])
+        row[1] = str(row[1])
+        return CachedResponse(*row)
+
+    def put(self, uri, body, etag=None, modified=None, expires=None,
+        staleWhileRevalidate=0):
+        """
+        Store the response body for uri along with its cache validators and
+        expiration time, replacing any existing entry.
+        @param expires: Time, in seconds since the epoch, that the response
+                        expires or None if it doesn't.
+        @type expires: float
+        """
+
+        self._execute('INSERT OR REPLACE INTO responses (uri, body, etag, '
+            'modified, expires, stale, stored) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (uri, sqlite3.Binary(body), etag, modified, expires,
+             staleWhileRevalidate, time.time()))
+
+    def touch(self, uri, expires=None, staleWhileRevalidate=0):
+        """
+        Update the expiration time of an existing entry after it has been
+        revalidated.
+        """
+
+        self._execute('UPDATE responses SET expires = ?, stale = ?, '
+            'stored = ? WHERE uri = ?',
+            (expires, staleWhileRevalidate, time.time(), uri))
+
+    def delete(self, uri):
+        """
+        Remove the entry for uri, if there is one.
+        """
+
+        self._execute('DELETE FROM responses WHERE uri = ?', (uri, ))
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+
+        self._execute('DELETE FROM responses')
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return self._execute('SELECT COUNT(*) FROM responses')[0][0]
+
+    def __contains__(self, uri):
+        return bool(self._execute('SELECT 1 FROM responses WHERE uri = ?',
+            (uri, )))
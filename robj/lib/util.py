@@ -20,9 +20,12 @@ Module for miscellaneous utility functions.
 """
 
 import os
+import sys
 import time
+import errno
 import types
 import select
+import hashlib
 import tempfile
 
 # This function is copied from conary.lib.util and tested as part of the
@@ -104,6 +107,149 @@ def mktemp(suffix='', prefix='tmp', dir=None, unlink=True, mode='w+b'):
         os.unlink(fname)
     return fh
 
+def copyinto(source, fd, bufSize=1024*1024, digest=None):
+    """
+    Copy everything from source, which must implement readinto, to the file
+    descriptor fd through a single reusable buffer.
+    @param digest: Optional object with an update method, such as a hashlib
+                   digest, that is fed everything copied.
+    @return: Number of bytes copied.
+    @rtype: int
+    """
+
+    view = memoryview(bytearray(bufSize))
+
+    copied = 0
+    while True:
+        size = source.readinto(view)
+        if not size:
+            break
+
+        if digest:
+            digest.update(view[:size])
+
+        written = 0
+        while written < size:
+            written += os.write(fd, view[written:size])
+        copied += size
+
+    return copied
+
+class MultiDigest(object):
+    """
+    Computes several hashlib digests of the same data at once.
+    @param names: Algorithm names, such as md5, sha1 and sha256.
+    @type names: list
+    """
+
+    def __init__(self, names):
+        self._digests = dict((x.lower(), hashlib.new(x)) for x in names)
+
+    def __contains__(self, name):
+        return name in self._digests
+
+    def update(self, data):
+        for digest in self._digests.itervalues():
+            digest.update(data)
+
+    def digest(self, name):
+        return self._digests[name].digest()
+
+    def hexdigests(self):
+        """
+        @return: Mapping of algorithm name to hex digest.
+        @rtype: dict
+        """
+
+        return dict((x, y.hexdigest()) for x, y in self._digests.iteritems())
+
+def getLibc():
+    """
+    Load the C library with ctypes, for system calls that python 2 doesn't
+    provide. Only done on Linux.
+    @return: The library, or None if it isn't available.
+    """
+
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+        return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+            use_errno=True)
+    except (ImportError, OSError):
+        return None
+
+def _getFallocate():
+    """
+    Find a posix_fallocate(fd, offset, length) function, either from the os
+    module or from the C library.
+    """
+
+    if hasattr(os, 'posix_fallocate'):
+        return os.posix_fallocate
+
+    libc = getLibc()
+    func = getattr(libc, 'posix_fallocate64', None)
+    if func is None:
+        return None
+
+    import ctypes
+    func.argtypes = [ ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ]
+    func.restype = ctypes.c_int
+
+    def fallocate(fd, offset, length):
+        # The error is returned rather than set in errno.
+        err = func(fd, offset, length)
+        if err:
+            raise OSError(err, os.strerror(err))
+
+    return fallocate
+
+_fallocate = _getFallocate()
+
+def preallocate(fd, size):
+    """
+    Reserve size bytes of disk space for fd, where the platform supports it,
+    so that running out of space is found out before anything is written.
+    @raise OSError: If there isn't enough space.
+    """
+
+    if _fallocate is None or not size:
+        return
+    try:
+        _fallocate(fd, 0, size)
+    except OSError, e:
+        # File systems that can't preallocate are written to as before.
+        if e.errno == errno.ENOSPC:
+            raise
+
+def getUmask():
+    """
+    Get the file mode creation mask of the process. Linux reports it in /proc,
+    elsewhere the only way to read it is to set it, so the most restrictive
+    mask is set meanwhile in case another thread creates a file.
+    """
+
+    try:
+        for line in open('/proc/self/status'):
+            if line.startswith('Umask:'):
+                return int(line.split()[1], 8)
+    except (IOError, ValueError, IndexError):
+        pass
+
+    mask = os.umask(077)
+    os.umask(mask)
+    return mask
+
+def mkspool(maxSize, dir=None, mode='w+b'):
+    """
+    Create a temporary file that is kept in memory until more than maxSize
+    bytes are written to it, at which point it is moved to disk in dir.
+    """
+
+    return tempfile.SpooledTemporaryFile(max_size=maxSize, mode=mode, dir=dir)
+
 def isXML(content):
     """
     Figure out if content is XML.
@@ -128,6 +274,28 @@ def isXML(content):
 
     return False
 
+def isJSON(content):
+    """
+    Figure out if content is a JSON object.
+    @param content a string or file object (must be seekable)
+    @type content str, unicode, or file
+    @rtype boolean
+    """
+
+    # File case.
+    if hasattr(content, 'read') and hasattr(content, 'seek'):
+        start = content.read(64)
+        content.seek(0)
+
+    # String case.
+    elif isinstance(content, types.StringTypes):
+        start = content[:64]
+
+    else:
+        return False
+
+    return start.lstrip().startswith('{')
+
 def getContentType(content):
     """
     Figure out the content type of a given object.
@@ -19,6 +19,17 @@
 XObj utilities.
 """
 
+import os
+import json
+import shutil
+import tempfile
+from StringIO import StringIO
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
 from xobj import xobj
 
 def XObjify(d, tag):
@@ -35,3 +46,241 @@ def XObjify(d, tag):
         setattr(top, key, value)
 
     return top
+
+def toJSON(obj, tag):
+    """
+    Serialize an xobj object tree as a JSON document, mapped the same way
+    robj.lib.parsers.JSONParser reads them.
+    """
+
+    return json.dumps({tag: _toJSON(obj)})
+
+def _toJSON(obj):
+    if isinstance(obj, list):
+        return [ _toJSON(x) for x in obj ]
+
+    meta = getattr(obj, '_xobj', None)
+    if meta is None:
+        return obj
+
+    value = {}
+    for name in meta.attributes:
+        attr = getattr(obj, name, None)
+        if attr is not None:
+            value['@' + name] = attr
+
+    # Objects built with XObjify don't list their elements.
+    names = list(meta.elements)
+    names.extend(sorted([ x for x in getattr(obj, '__dict__', {})
+        if not x.startswith('_') and x not in meta.attributes and
+           x not in names ]))
+
+    for name in names:
+        elem = getattr(obj, name, None)
+        if elem is not None:
+            value[name] = _toJSON(elem)
+
+    if isinstance(obj, basestring):
+        if not value:
+            return obj
+        if obj:
+            value['#text'] = obj
+
+    return value
+
+# Rough per node overhead of an xobj instance and its metadata.
+NODE_SIZE = 256
+
+def sizeof(obj, _seen=None):
+    """
+    Approximate the number of bytes of memory used by an xobj tree.
+    """
+
+    if _seen is None:
+        _seen = set()
+
+    if obj is None or id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    # Bodies kept in a file don't take up memory until they are parsed.
+    if isinstance(obj, UnparsedDocument):
+        if obj.body is not None:
+            return len(obj.body) + NODE_SIZE
+        return NODE_SIZE
+
+    if isinstance(obj, basestring):
+        return len(obj) + 40
+
+    if isinstance(obj, list):
+        return sum([ sizeof(x, _seen) for x in obj ])
+
+    meta = getattr(obj, '_xobj', None)
+    if meta is None:
+        return 16
+
+    size = NODE_SIZE
+    for name in list(meta.elements) + meta.attributes.keys():
+        size += len(name) + sizeof(getattr(obj, name, None), _seen)
+    return size
+
+class UnparsedDocument(object):
+    """
+    XML document that is only parsed by xobj once its contents are needed.
+    The tag and attributes of the top level element, and whether it has any
+    child elements, are read from the start of the document up front.
+    @param body: The document, or None if it is kept in a file.
+    @type body: str
+    @param path: File the document is kept in, which is removed along with
+                 the unparsed document.
+    @type path: str
+    @param tag: Tag of the top level element.
+    @type tag: str
+    @param attributes: Attributes of the top level element.
+    @type attributes: dict
+    @param hasElements: The top level element has child elements.
+    @type hasElements: bool
+    @param parse: Callable that parses the document, given as a string or a
+                  file object, and returns its top level object.
+    @type parse: callable
+    """
+
+    __slots__ = ('body', 'path', 'tag', 'attributes', 'hasElements',
+        '_parse', '_childTags', )
+
+    def __init__(self, body, path, tag, attributes, hasElements, parse):
+        self.body = body
+        self.path = path
+        self.tag = tag
+        self.attributes = attributes
+        self.hasElements = hasElements
+        self._parse = parse
+        self._childTags = None
+
+    def __del__(self):
+        if self.path is not None and os is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    @classmethod
+    def scan(cls, body, parse, spoolDir=None):
+        """
+        Read the top level element of body without parsing the rest of it.
+        Documents given as a file are copied to a file of their own in
+        spoolDir, so that no file descriptor is held until they are parsed.
+        @return: The unparsed document, or None if the top level element
+                 can't be described without a full parse.
+        @rtype: UnparsedDocument
+        """
+
+        if isinstance(body, basestring):
+            f = StringIO(body)
+        else:
+            f = body
+
+        root = None
+        hasElements = False
+        try:
+            try:
+                for event, elem in ElementTree.iterparse(f,
+                    events=('start', 'end')):
+                    if root is None:
+                        root = elem
+                        continue
+                    hasElements = event == 'start'
+                    break
+            except SyntaxError:
+                return None
+        finally:
+            f.seek(0)
+
+        # Leave namespaced documents to xobj, which names things differently.
+        if root is None or [ x for x in [ root.tag, ] + root.keys()
+            if x.startswith('{') ]:
+            return None
+
+        path = None
+        if not isinstance(body, basestring):
+            fd, path = tempfile.mkstemp(dir=spoolDir, prefix='robj-')
+            out = os.fdopen(fd, 'wb')
+            try:
+                shutil.copyfileobj(body, out, 1024 * 1024)
+            finally:
+                out.close()
+                body.seek(0)
+            body = None
+
+        return cls(body, path, root.tag, dict(root.items()), hasElements,
+            parse)
+
+    def _open(self):
+        if self.body is not None:
+            return StringIO(self.body)
+        return open(self.path, 'rb')
+
+    def childTags(self):
+        """
+        Get the tags of the child elements of the top level element, without
+        building any objects for them.
+        @return: Set of tags, or None if the document is malformed.
+        @rtype: set
+        """
+
+        if self._childTags is None:
+            tags = set()
+            depth = 0
+            f = self._open()
+            try:
+                try:
+                    for event, elem in ElementTree.iterparse(f,
+                        events=('start', 'end')):
+                        if event == 'start':
+                            depth += 1
+                            if depth == 2:
+                                tags.add(elem.tag)
+                            elif depth == 1:
+                                root = elem
+                        else:
+                            depth -= 1
+                            # Drop each child once it is complete.
+                            if depth == 1:
+                                root.clear()
+                except SyntaxError:
+                    return None
+            finally:
+                f.close()
+            self._childTags = tags
+        return self._childTags
+
+    def parse(self):
+        if self.body is not None:
+            return self._parse(self.body)
+
+        f = self._open()
+        try:
+            return self._parse(f)
+        finally:
+            f.close()
+
+def getTag(root):
+    """
+    Get the tag of an xobj object or an unparsed document.
+    """
+
+    if isinstance(root, UnparsedDocument):
+        return root.tag
+    return root._xobj.tag
+
+def getAttribute(root, name, default=None):
+    """
+    Get an attribute of the top level element of an xobj object or an
+    unparsed document.
+    """
+
+    if isinstance(root, UnparsedDocument):
+        return root.attributes.get(name, default)
+    if name in root._xobj.attributes:
+        return getattr(root, name, default)
+    return default
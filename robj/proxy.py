@@ -28,6 +28,8 @@ from robj.errors import RemoteInstanceOverwriteError
 
 def require_collection(func):
     def wrapper(self, *args, **kwargs):
+        # Collections are only recognized once the document has been parsed.
+        self._load()
         if not self._isCollection:
             raise TypeError, 'A list type is required for this method.'
         return func(self, *args, **kwargs)
@@ -41,20 +43,22 @@ class rObjProxy(object):
     @type uri: str
     @param client: Instance of a glue client.
     @type client: robj.glue.HTTPClient
-    @param root: XObj object tree.
-    @type root: xobj.xobj.XObj
+    @param root: XObj object tree, or a document to parse on first use.
+    @type root: xobj.xobj.XObj or robj.lib.xutil.UnparsedDocument
     @param parent: Parent rObj instance (optional).
     @type parent: robj.proxy.rObjProxy
     """
 
     HTTPData = _HTTPData
 
-    __slots__ = ('_uri', '_client', '_root', '_parent', '_tag', '_isCollection',
-        '_dirty_flag', '_dl', '_childTag', '_local_cache')
+    __slots__ = ('_uri', '_client', '_rootNode', '_parent', '_tag',
+        '_isCollection', '_dirty_flag', '_dl', '_childTag', '_local_cache',
+        '_validators', '_expires')
 
     def __init__(self, uri, client, root, parent=None):
         self._uri = uri
         self._client = client
+        self._dl = RLock()
         self._root = root
 
         if parent is not None:
@@ -62,8 +66,11 @@ class rObjProxy(object):
         else:
             self._parent = None
 
-        self._dl = RLock()
-        self._tag = self._root._xobj.tag
+        self._tag = xutil.getTag(root)
+
+        # Cache validators (ETag, Last-Modified) from the last GET.
+        self._validators = None
+        self._expires = None
 
         if self._tag is None:
             raise RuntimeError, ('No XML tag found for this object, please '
@@ -75,10 +82,54 @@ class rObjProxy(object):
 
         self._reset()
 
+    def _get_root(self):
+        root = self._rootNode
+        if isinstance(root, xutil.UnparsedDocument):
+            parsed = False
+            self._dl.acquire()
+            try:
+                if self._rootNode is root:
+                    self._rootNode = root.parse()
+                    self._reset()
+                    parsed = True
+                root = self._rootNode
+            finally:
+                self._dl.release()
+
+            # The cache only knew the size of the unparsed document.
+            if parsed:
+                self._client.cache.resize(self._uri, self)
+        return root
+    def _set_root(self, root):
+        self._rootNode = root
+    _root = property(_get_root, _set_root)
+
+    def _load(self):
+        """
+        Parse the document, if that hasn't happened yet.
+        """
+
+        return self._root
+
+    def _peek(self, name, default=None):
+        """
+        Get an attribute without parsing the document. Only attributes of the
+        top level element are available until it has been parsed.
+        """
+
+        root = self._rootNode
+        if isinstance(root, xutil.UnparsedDocument):
+            return root.attributes.get(name, default)
+        return getattr(self, name, default)
+
     def _reset(self):
         self._local_cache = {}
         self._dirty_flag = False
 
+        # Collections are recognized once the document has been parsed.
+        if isinstance(self._rootNode, xutil.UnparsedDocument):
+            return
+
         # Infer from tag names if this is intended to be a collection. Yes, this
         # is a hack, find a better way.
 
@@ -158,6 +209,9 @@ class rObjProxy(object):
     __str__ = __repr__
 
     def __nonzero__(self):
+        root = self._rootNode
+        if isinstance(root, xutil.UnparsedDocument) and root.hasElements:
+            return True
         if self._root._xobj.elements:
             return True
         else:
@@ -219,6 +273,13 @@ class rObjProxy(object):
         return True
 
     def __getattr__(self, name):
+        # Attributes of the top level element, such as id, don't need the
+        # document to be parsed.
+        root = self._rootNode
+        if (isinstance(root, xutil.UnparsedDocument) and
+            name in root.attributes):
+            return root.attributes[name]
+
         try:
             val = getattr(self._root, name)
         except AttributeError:
@@ -313,6 +374,29 @@ class rObjProxy(object):
         self._dl.release()
         return l
 
+    def submit_getattr(self, name):
+        """
+        Resolve an attribute on the client pool without blocking the caller.
+        @param name: Name of the attribute to resolve.
+        @type name: str
+        @return: Future that resolves to the same value as getattr.
+        @rtype: robj.lib.futures.Future
+        """
+
+        return self._client.submit(getattr, self, name)
+
+    @require_collection
+    def submit_iter(self):
+        """
+        Resolve every member of a collection on the client pool without
+        blocking the caller.
+        @return: One future per member, in collection order.
+        @rtype: list of robj.lib.futures.Future
+        """
+
+        return [ self._client.submit(self.__getitem__, i)
+            for i in range(len(self)) ]
+
     def append(self, value, post=True, tag=None):
         """
         Append a value to a collection.
@@ -386,9 +470,13 @@ class rObjProxy(object):
         if not self._dirty or force:
             self._dl.acquire()
 
+            # Local modifications are being thrown away, so the server can't
+            # just confirm that the unmodified resource is still current.
+            revalidate = not self._dirty
+
             # Must mark instance as clean before PUTing contents, otherwise
             # instance cache will not inject the new model.
             self._dirty_flag = False
 
-            self._client.do_GET(self._uri, cache=False)
+            self._client.do_GET(self._uri, cache=False, revalidate=revalidate)
             self._dl.release()
@@ -0,0 +1,55 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+"""
+Helpers shared by the rObj benchmarks.
+"""
+
+import sys
+import time
+
+from robj_test import testserver
+
+
+def startServer():
+    """
+    Start the REST test server on a free port in a background thread.
+    """
+
+    return testserver.ThreadServer(port=0)
+
+
+def timeit(func, *args, **kwargs):
+    """
+    Call func and return the number of seconds it took along with the result.
+    """
+
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+def report(name, count, elapsed, unit='requests'):
+    """
+    Print one benchmark result line.
+    """
+
+    rate = elapsed and count / elapsed or 0
+    print '%-40s %8d %s in %8.3fs  %10.1f %s/s' % (name, count, unit, elapsed,
+        rate, unit)
+    sys.stdout.flush()
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+"""
+Measure requests per second through a single dispatcher worker.
+
+Compares the current worker against one that reproduces the fixed tenth of a
+second sleep that used to follow every request, and against a paced worker.
+
+usage: python -m robj_test.benchmarks.dispatchbench [count]
+"""
+
+import sys
+import time
+
+from robj.http import HTTPClient
+from robj.http.dispatcher import RequestWorker
+from robj.http.dispatcher import RequestDispatcher
+
+from robj_test.benchmarks import benchhelp
+
+
+class SleepingWorker(RequestWorker):
+    """
+    Worker that behaves like the dispatcher did before pacing was opt-in.
+    """
+
+    def handleRequest(self, req):
+        ret = RequestWorker.handleRequest(self, req)
+        time.sleep(0.1)
+        return ret
+
+
+class SleepingDispatcher(RequestDispatcher):
+    _workerClass = SleepingWorker
+
+
+def run(client, count):
+    for i in xrange(count):
+        req = client.do_GET('/')
+        req.wait()
+        req.response.content.close()
+    return count
+
+
+def main(args):
+    count = args and int(args[0]) or 50
+
+    server = benchhelp.startServer()
+    uri = server.geturi('/api')
+
+    for maxClients in (1, 2):
+        name = 'maxClients=%s' % maxClients
+
+        client = HTTPClient(uri, maxClients=maxClients)
+        client._dispatcher = SleepingDispatcher(maxClients=maxClients)
+        elapsed, n = benchhelp.timeit(run, client, count)
+        benchhelp.report('%s sleep after request' % name, n, elapsed)
+
+        client = HTTPClient(uri, maxClients=maxClients)
+        elapsed, n = benchhelp.timeit(run, client, count)
+        benchhelp.report('%s unpaced' % name, n, elapsed)
+
+        client = HTTPClient(uri, maxClients=maxClients, requestRate=20,
+            requestBurst=5)
+        elapsed, n = benchhelp.timeit(run, client, count)
+        benchhelp.report('%s paced 20/s burst 5' % name, n, elapsed)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
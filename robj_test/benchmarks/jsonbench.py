@@ -0,0 +1,71 @@
+#!/usr/bin/python
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+"""
+Compare the time it takes to parse the same document sent as XML and as
+JSON.
+
+The documents are the synthetic employee collections of parsebench, with 1,
+100 and 1000 members, converted to JSON the way the test server does. XML is
+parsed with every available backend.
+
+usage: python -m robj_test.benchmarks.jsonbench [count]
+"""
+
+import sys
+
+from robj.lib import parsers
+
+from robj_test.benchmarks import benchhelp
+from robj_test.benchmarks import parsebench
+from robj_test.testserver.controllers import toJSON
+
+
+def run(parser, doc, count):
+    for i in xrange(count):
+        parser.parse(doc)
+    return count
+
+
+def main(args):
+    count = args and int(args[0]) or 100
+
+    backends = [ parsers.getParser(x) for x in parsers.preferred
+        if parsers.parsers[x].available() ]
+
+    for members in (1, 100, 1000):
+        xml = parsebench.makeDocument(members)
+        doc = toJSON(xml)
+        print '%d members, %d bytes of XML, %d bytes of JSON' % (members,
+            len(xml), len(doc))
+
+        n = max(count / members, 10)
+        for parser in backends:
+            elapsed, n = benchhelp.timeit(run, parser, xml, n)
+            benchhelp.report('xml (%s)' % parser.name, n, elapsed,
+                unit='documents')
+            print '%-40s %8.3fms per document' % ('', elapsed * 1000 / n)
+
+        elapsed, n = benchhelp.timeit(run, parsers.JSONParser(), doc, n)
+        benchhelp.report('json', n, elapsed, unit='documents')
+        print '%-40s %8.3fms per document' % ('', elapsed * 1000 / n)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+"""
+Measure document parsing throughput of each available parser backend.
+
+Parses synthetic employee collections of 1k, 10k and 100k members, each
+member being a handful of elements with an id attribute, the way a large
+collection looks when it is served without paging.
+
+usage: python -m robj_test.benchmarks.parsebench [count]
+"""
+
+import sys
+
+from robj.lib import parsers
+
+from robj_test.benchmarks import benchhelp
+
+
+MEMBER = ('<employee id="http://localhost/api/employees/%(idx)d">'
+    '<name>Employee %(idx)d</name><address><street>%(idx)d 1st St.</street>'
+    '<city>Mars</city><state>ASD</state><zipcode>12345</zipcode></address>'
+    '<phone>555-123-4567</phone>'
+    '<products href="http://localhost/api/employees/%(idx)d/products"/>'
+    '</employee>')
+
+# Elements per member, including itself.
+MEMBER_ELEMENTS = 9
+
+
+def makeDocument(members):
+    doc = [ '<?xml version="1.0" encoding="UTF-8"?>\n<employees>', ]
+    doc.extend(MEMBER % {'idx': x} for x in xrange(members))
+    doc.append('</employees>')
+    return ''.join(doc)
+
+
+def run(parser, doc, count):
+    for i in xrange(count):
+        root = parser.parse(doc)
+        assert len(root.employee) > 0
+    return count
+
+
+def main(args):
+    count = args and int(args[0]) or 3
+
+    names = [ x for x in parsers.preferred if parsers.parsers[x].available() ]
+    for members in (1000, 10000, 100000):
+        doc = makeDocument(members)
+        print '%d members, %d elements, %d bytes' % (members,
+            members * MEMBER_ELEMENTS, len(doc))
+
+        for name in names:
+            parser = parsers.getParser(name)
+            elapsed, n = benchhelp.timeit(run, parser, doc, count)
+            benchhelp.report(name, n * members * MEMBER_ELEMENTS, elapsed,
+                unit='elements')
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,111 @@
+#!/usr/bin/python
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+
+"""
+Measure file upload throughput and CPU time against the test server's
+employee file endpoint.
+
+Compares the old 8KiB read and send loop, the large buffer readinto loop and,
+where the platform provides it, kernel sendfile. The test server runs in the
+same process, so CPU time includes the time it spends receiving.
+
+usage: python -m robj_test.benchmarks.uploadbench [MiB] [count]
+"""
+
+import os
+import sys
+import time
+
+from robj.http import HTTPClient
+from robj.lib import util
+from robj.lib import fixedhttplib
+from robj.lib.httputil import HTTPData
+
+from robj_test import resources
+from robj_test.benchmarks import benchhelp
+
+
+class CopyHTTPData(HTTPData):
+    """
+    HTTPData that always copies the body through copyfileobj.
+    """
+
+    __slots__ = ()
+
+    def _sendfile(self, connection):
+        return False
+
+
+def cpu():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def run(client, path, fobj, size, count, dataClass):
+    for i in xrange(count):
+        req = client.do_POST(path, dataClass(data=fobj, size=size))
+        req.wait()
+        assert req.response.status == 200
+    return count
+
+
+def main(args):
+    size = (args and int(args[0]) or 64) * 1024 * 1024
+    count = len(args) > 1 and int(args[1]) or 4
+
+    server = benchhelp.startServer()
+    model = server.data.employees.create(
+        open(resources.get_archive('employee1.xml')).read(), '/api/employees')
+    path = model.id[len('/api'):] + '/file'
+
+    fobj = util.mktemp()
+    block = os.urandom(1024 * 1024)
+    for i in xrange(size / len(block)):
+        fobj.write(block)
+    fobj.flush()
+
+    modes = [
+        ('8KiB read and send', CopyHTTPData, False),
+        ('readinto', HTTPData, False),
+    ]
+    if fixedhttplib._sendfile is not None:
+        modes.append(('sendfile', HTTPData, True))
+
+    useSendfile = fixedhttplib.HTTPConnection.useSendfile
+    try:
+        for name, dataClass, sendfile in modes:
+            fixedhttplib.HTTPConnection.useSendfile = sendfile
+            client = HTTPClient(server.geturi('/api'), maxClients=1)
+
+            start = cpu()
+            elapsed, n = benchhelp.timeit(run, client, path, fobj, size,
+                count, dataClass)
+            used = cpu() - start
+
+            mib = n * size / (1024 * 1024)
+            benchhelp.report(name, mib, elapsed, unit='MiB')
+            print '%-40s %8.3fs CPU, %.3fs per GiB' % ('', used,
+                used * 1024 / mib)
+            sys.stdout.flush()
+    finally:
+        fixedhttplib.HTTPConnection.useSendfile = useSendfile
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -16,10 +16,28 @@
 #
 
 
+import os
+import stat
+import time
+import shutil
+import socket
+import hashlib
+import select
+import tempfile
+from threading import Thread
+
 from xobj import xobj
 
 from robj import errors
+from robj.lib import futures
+from robj.lib import util
+from robj.lib import xutil
+from robj.lib import parsers
 from robj.glue import HTTPClient
+from robj.collections import PagedCollection
+from robj.collections import StreamingCollection
+from robj.lib.httputil import HTTPData
+from robj.lib.httputil import HTTPDataSegment
 from robj.http.request import Response
 from robj_test import robjhelp as testsuite
 
@@ -93,6 +111,29 @@ class ClientTest(testsuite.TestCase):
         self.failIfEqual(model.phone, employee.phone)
         self.failUnlessEqual(employee.phone, employee2.phone)
 
+    def testCompressedRequests(self):
+        client = HTTPClient(self.server.geturi('/api/'), compressThreshold=100)
+        doc = xobj.parse(self.getArchiveContents('employee1.xml'))
+
+        sent = []
+        do_POST = client._client.do_POST
+        def spy_POST(uri, content, headers=None):
+            sent.append(getattr(content, 'compress', False))
+            return do_POST(uri, content, headers=headers)
+        client._client.do_POST = spy_POST
+
+        employee = client.do_POST('/employees', doc)._root
+        self.failUnlessEqual(employee.name, doc.employee.name)
+        self.failUnlessEqual(sent, [ True, ])
+
+        # Servers that turn down compressed bodies get them as is from then
+        # on.
+        self.server.compressedRequests = False
+        employee = client.do_POST('/employees', doc)._root
+        self.failUnlessEqual(employee.name, doc.employee.name)
+        client.do_POST('/employees', doc)
+        self.failUnlessEqual(sent, [ True, True, False, False, ])
+
     def testDELETE(self):
         xml = self.getArchiveContents('employee1.xml')
         doc = xobj.parse(xml)
@@ -203,3 +244,723 @@ class ClientTest(testsuite.TestCase):
     def testSerialize(self):
         self.failUnlessRaises(errors.SerializationError,
             self._client._serialize_document, object())
+
+    def testSubmit(self):
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=4)
+
+        xml = self.getArchiveContents('employee1.xml')
+        employee = client.submit_POST('/employees', xobj.parse(xml)).result()
+
+        done = []
+        fs = [ client.submit_GET(x) for x in ('/', '/employees', '/products',
+            employee.id) ]
+        fs[0].add_done_callback(done.append)
+
+        # Every future resolves to the same instance a blocking GET returns.
+        for future in futures.as_completed(fs, timeout=30):
+            obj = future.result()
+            self.failUnless(obj is client.do_GET(obj._uri))
+
+        self.failUnlessEqual(done, [ fs[0], ])
+
+        # Errors are raised when the result is requested.
+        future = client.submit_GET('/foobar')
+        finished, pending = futures.wait([ future, ], timeout=30)
+        self.failUnlessEqual(finished, set([ future, ]))
+        self.failIf(pending)
+        self.failUnless(isinstance(future.exception(),
+            errors.HTTPNotFoundError))
+        self.failUnlessRaises(errors.HTTPNotFoundError, future.result)
+
+        response = client.submit_DELETE(employee.id).result()
+        self.failUnlessEqual(response.status, 200)
+
+    def testCompletionQueue(self):
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=4)
+        queue = futures.CompletionQueue()
+
+        pending = set(queue.add(client.submit_GET(x))
+            for x in ('/', '/employees', '/products'))
+
+        # Wait on the queue the way an event loop would.
+        while pending:
+            ready = select.select([ queue, ], [], [], 30)[0]
+            self.failUnless(ready)
+            for future in queue.get():
+                self.failUnless(future.result())
+                pending.remove(future)
+
+        self.failIf(queue.get())
+        queue.close()
+
+    def testCoalesceGET(self):
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=4)
+
+        # Slow down sending requests so that they overlap.
+        sent = []
+        do_GET = client._client.do_GET
+        def slow_GET(uri, **kwargs):
+            sent.append(uri)
+            time.sleep(0.2)
+            return do_GET(uri, **kwargs)
+        client._client.do_GET = slow_GET
+
+        results = []
+        def get():
+            results.append(client.do_GET('/employees'))
+
+        threads = [ Thread(target=get) for x in range(5) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Only one request should have made it to the server and everyone
+        # should get the same instance.
+        self.failUnlessEqual(sent, [ '/employees', ])
+        self.failUnlessEqual(len(results), 5)
+        for obj in results:
+            self.failUnless(obj is results[0])
+
+    def testCoalesceOnWorker(self):
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=2)
+
+        # Hold up the request of a caller that isn't on a worker until the
+        # workers are busy waiting for the same URI.
+        sent = []
+        do_GET = client._client.do_GET
+        def slow_GET(uri, **kwargs):
+            sent.append(uri)
+            if not client._client.inWorker():
+                time.sleep(0.5)
+            return do_GET(uri, **kwargs)
+        client._client.do_GET = slow_GET
+
+        results = []
+        def get():
+            results.append(client.do_GET('/employees'))
+
+        thread = Thread(target=get)
+        thread.start()
+        time.sleep(0.1)
+
+        # Tasks must not wait for a request that is queued behind them.
+        fs = [ client.submit(client.do_GET, '/employees') for x in range(2) ]
+        done, pending = futures.wait(fs, timeout=30)
+        self.failIf(pending)
+
+        thread.join(30)
+        self.failIf(thread.isAlive())
+        self.failUnlessEqual(len(results), 1)
+        self.failUnless(len(sent) > 1)
+        for future in fs:
+            self.failUnlessEqual(len(future.result()), len(results[0]))
+
+    def testBoundedCache(self):
+        client = HTTPClient(self.server.geturi('/api/'), maxCacheEntries=2)
+
+        api = client.do_GET('/')
+        self.failUnless(client.do_GET('/') is api)
+
+        # Modified instances are never evicted.
+        api.version = '2.0'
+        client.do_GET('/employees')
+        client.do_GET('/products')
+
+        self.failUnlessEqual(len(client.cache), 2)
+        self.failUnless(client.do_GET('/') is api)
+        self.failIf('/employees' in client.cache)
+
+        stats = client.cache.stats()
+        self.failUnlessEqual(stats['hits'], 2)
+        self.failUnlessEqual(stats['misses'], 3)
+        self.failUnlessEqual(stats['evictions'], 1)
+
+    def testCacheFreshness(self):
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=2)
+
+        sent = []
+        do_GET = client._client.do_GET
+        def record_GET(uri, **kwargs):
+            sent.append((uri, kwargs.get('headers')))
+            return do_GET(uri, **kwargs)
+        client._client.do_GET = record_GET
+
+        # Fresh instances are used without contacting the server.
+        self.server.conditional = True
+        self.server.cacheControl = 'max-age=60'
+        employees = client.do_GET('/employees')
+        self.failUnless(client.do_GET('/employees') is employees)
+        self.failUnlessEqual(len(sent), 1)
+
+        # Once stale, the instance is revalidated with a conditional GET.
+        employees._expires = (time.time() - 1, 0)
+        self.failUnless(client.do_GET('/employees') is employees)
+        self.failUnlessEqual(len(sent), 2)
+        self.failUnless(sent[-1][1]['If-None-Match'])
+        self.failUnless(employees._expires[0] > time.time())
+
+        # A 304 still returns the instance if it was evicted meanwhile.
+        employees._expires = (time.time() - 1, 0)
+        def evicting_GET(uri, **kwargs):
+            client.cache.clear(uri)
+            return record_GET(uri, **kwargs)
+        client._client.do_GET = evicting_GET
+        self.failUnless(client.do_GET('/employees') is employees)
+        self.failUnless(client.cache.get(sent[-1][0]) is employees)
+        client._client.do_GET = record_GET
+        sent.pop()
+
+        # Stale instances may be used while they are revalidated in the
+        # background.
+        self.server.cacheControl = 'max-age=0, stale-while-revalidate=60'
+        employees._expires = (time.time() - 1, 60)
+        self.failUnless(client.do_GET('/employees') is employees)
+        for i in range(50):
+            if len(sent) == 3 and not client._revalidating:
+                break
+            time.sleep(0.1)
+        self.failUnlessEqual(len(sent), 3)
+
+        # Revalidating doesn't hold up the caller on a client without
+        # workers.
+        default = HTTPClient(self.server.geturi('/api/'))
+        employees = default.do_GET('/employees')
+        products = default.do_GET('/products')
+        slowSent = []
+        slow_do_GET = default._client.do_GET
+        def slow_GET(uri, **kwargs):
+            slowSent.append((uri, kwargs.get('headers')))
+            time.sleep(0.5)
+            return slow_do_GET(uri, **kwargs)
+        default._client.do_GET = slow_GET
+
+        # Repeated hits on stale instances queue one revalidation each for a
+        # single thread.
+        employees._expires = (time.time() - 1, 60)
+        products._expires = (time.time() - 1, 60)
+        start = time.time()
+        for i in range(3):
+            self.failUnless(default.do_GET('/employees') is employees)
+            self.failUnless(default.do_GET('/products') is products)
+        self.failUnless(time.time() - start < 0.5)
+        thread = default._revalidateThread
+        for i in range(50):
+            if len(slowSent) == 2 and not default._revalidating:
+                break
+            time.sleep(0.1)
+        self.failUnlessEqual(sorted([ x[0] for x in slowSent ]),
+            [ '/employees', '/products', ])
+        self.failUnless(slowSent[0][1]['If-None-Match'])
+        self.failUnless(default._revalidateThread is thread)
+
+        # no-cache responses are revalidated every time.
+        self.server.cacheControl = 'no-cache'
+        client.do_GET('/employees', cache=False)
+        client.do_GET('/employees')
+        self.failUnlessEqual(len(sent), 5)
+
+        # no-store responses are never cached.
+        self.server.cacheControl = 'no-store'
+        client.do_GET('/products')
+        self.failIf('/products' in client.cache)
+
+    def testCacheTTL(self):
+        client = HTTPClient(self.server.geturi('/api/'), cacheTTL=60)
+        employees = client.do_GET('/employees')
+        self.failUnless(employees._expires[0] > time.time() + 50)
+
+        client = HTTPClient(self.server.geturi('/api/'))
+        employees = client.do_GET('/employees')
+        self.failUnlessEqual(employees._expires, None)
+
+    def testResponseCache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'responses.db')
+            self.server.conditional = True
+
+            client = HTTPClient(self.server.geturi('/api/'), responseCache=path)
+            doc = xobj.parse(self.getArchiveContents('employee1.xml'))
+            uri = client._normalize_uri(client.do_POST('/employees', doc).id)
+            employee = client.do_GET(uri, cache=False)
+            self.failUnless(client._response_key(uri) in client._responseCache)
+
+            # Clients with another base URI or other credentials sharing the
+            # database don't see the response.
+            base = self.server.geturi('/api/')
+            for other in (self.server.geturi('/api/employees/'),
+                base.replace('://', '://user:secret@', 1)):
+                client2 = HTTPClient(other, responseCache=path)
+                self.failIf(client2._response_key(uri) in
+                    client2._responseCache)
+                self.failUnlessEqual(client2._load_response(uri), None)
+
+            # A new client rebuilds the instance from disk and revalidates it,
+            # which the server answers with a 304.
+            client = HTTPClient(self.server.geturi('/api/'), responseCache=path)
+            sent = []
+            do_GET = client._client.do_GET
+            def record_GET(uri, **kwargs):
+                request = do_GET(uri, **kwargs)
+                request.wait()
+                sent.append((uri, request.response.status))
+                return request
+            client._client.do_GET = record_GET
+
+            cached = client.do_GET(uri)
+            self.failUnlessEqual(sent, [ (uri, 304), ])
+            self.failUnlessEqual(cached.name, employee.name)
+
+            # Fresh responses are used without contacting the server at all.
+            self.server.cacheControl = 'max-age=60'
+            cached.refresh()
+            client = HTTPClient(self.server.geturi('/api/'), responseCache=path)
+            client._client.do_GET = None
+            self.failUnlessEqual(client.do_GET(uri).name, employee.name)
+
+            # Deleting a resource removes it from the persistent cache.
+            client.do_DELETE(uri)
+            self.failIf(client._response_key(uri) in client._responseCache)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testStreamGET(self):
+        doc = xobj.parse(self.getArchiveContents('employee1.xml'))
+        uri = self._client._normalize_uri(
+            self._client.do_POST('/employees', doc).id)
+        data = '\x00\x01' * 100000
+        self._client.do_POST(uri + '/file', data)
+
+        stream = self._client.do_GET(uri + '/file', stream=True)
+        self.failIf(isinstance(stream, Response))
+        chunks = list(stream)
+        self.failUnless(len(chunks) > 1)
+        self.failUnlessEqual(''.join(chunks), data)
+        self.failUnless(stream.closed)
+
+        # Errors are raised as usual.
+        self.failUnlessRaises(errors.HTTPNotFoundError, self._client.do_GET,
+            uri + '/missing', stream=True)
+
+    def testParsers(self):
+        doc = xobj.parse(self.getArchiveContents('employee1.xml'))
+        uri = self._client.do_POST('/employees', doc).id
+
+        def load(client):
+            employee = client.do_GET(uri)
+            employees = client.do_GET('/employees')
+            return (employee.elements, employee.attributes, employee.id,
+                employee.name, employee.address.city, employee.phone,
+                len(employees), employees[0].id)
+
+        expected = load(HTTPClient(self.server.geturi('/api/'),
+            parser='xobj'))
+        for name in parsers.preferred:
+            if not parsers.parsers[name].available():
+                continue
+            client = HTTPClient(self.server.geturi('/api/'), parser=name)
+            self.failUnless(isinstance(client._parser, parsers.parsers[name]))
+            self.failUnlessEqual(load(client), expected)
+
+        self.failUnlessRaises(ValueError, HTTPClient,
+            self.server.geturi('/api/'), parser='sax')
+
+    def testSubmitParsed(self):
+        doc = xobj.parse(self.getArchiveContents('employee1.xml'))
+        uri = self._client.do_POST('/employees', doc).id
+
+        # Submitted requests hand back instances that have been parsed by the
+        # worker.
+        employee = self._client.submit_GET(uri, cache=False).result()
+        self.failIf(isinstance(employee._rootNode, xutil.UnparsedDocument))
+
+        client = HTTPClient(self.server.geturi('/api/'),
+            parseInBackground=False)
+        employee = client.submit_GET(uri).result()
+        self.failUnless(isinstance(employee._rootNode, xutil.UnparsedDocument))
+
+    def testParseProcesses(self):
+        for name in ('employee1.xml', 'employee2.xml', 'employee3.xml'):
+            doc = xobj.parse(self.getArchiveContents(name))
+            self._client.do_POST('/employees', doc)
+        employees = self._client.do_GET('/employees')
+
+        # The pool is forked before any of the client's threads start.
+        client = HTTPClient(self.server.geturi('/api/'), parseProcesses=1)
+        client.PARSE_PROCESS_SIZE = 0
+        self.failUnless(client._parsePool._pool is not None)
+        try:
+            items = client.do_GET('/employees')
+            self.failUnlessEqual([ (x.id, x.name, x.address.city)
+                    for x in items ],
+                [ (x.id, x.name, x.address.city) for x in employees ])
+        finally:
+            client._parsePool.close()
+
+        # Once closed, documents are parsed in process.
+        self.failUnless(client._parsePool._pool is None)
+        self.failUnless(client._parsePool.parse(
+            self.getArchiveContents('employee1.xml')) is not None)
+
+        self.failUnlessRaises(ValueError, HTTPClient,
+            self.server.geturi('/api/'), parser='xobj', parseProcesses=1)
+
+    def testJSON(self):
+        self.server.json = True
+        doc = xobj.parse(self.getArchiveContents('employee1.xml'))
+        uri = self._client.do_POST('/employees', doc).id
+        expected = self._client.do_GET(uri)
+
+        client = HTTPClient(self.server.geturi('/api/'), preferJSON=True)
+        sent = []
+        do_PUT = client._client.do_PUT
+        def spy_PUT(uri, content, headers=None):
+            sent.append((headers or {}).get('Content-Type'))
+            return do_PUT(uri, content, headers=headers)
+        client._client.do_PUT = spy_PUT
+
+        # JSON documents map to the same objects as XML ones.
+        employee = client.do_GET(uri)
+        self.failUnless(client._json)
+        self.failUnlessEqual(employee.elements, expected.elements)
+        self.failUnlessEqual(employee.attributes, expected.attributes)
+        self.failUnlessEqual(employee.id, uri)
+        self.failUnlessEqual(employee.name, expected.name)
+        self.failUnlessEqual(employee.address.city, expected.address.city)
+        self.failUnlessEqual(len(client.do_GET('/employees')), 1)
+
+        # Documents are sent back as JSON.
+        root = employee._root
+        root.phone = '12345'
+        self.failUnlessEqual(client.do_PUT(uri, root).phone, '12345')
+        self.failUnlessEqual(sent, [ 'application/json', ])
+        self.failUnlessEqual(self._client.do_GET(uri, cache=False).phone,
+            '12345')
+
+        created = client.do_POST('/employees', doc)
+        self.failUnlessEqual(created.name, doc.employee.name)
+        self.failIfEqual(created.id, uri)
+
+    def testLazyParse(self):
+        doc = xobj.parse(self.getArchiveContents('employee1.xml'))
+        uri = self._client.do_POST('/employees', doc).id
+
+        # The id attribute and truth value don't need the document parsed.
+        employee = self._client.do_GET(uri, cache=False)
+        self.failUnless(isinstance(employee._rootNode, xutil.UnparsedDocument))
+        self.failUnlessEqual(employee.id, uri)
+        self.failUnless(employee)
+        self.failUnless(isinstance(employee._rootNode, xutil.UnparsedDocument))
+
+        # Anything else parses it.
+        self.failUnlessEqual(employee.name, doc.employee.name)
+        self.failIf(isinstance(employee._rootNode, xutil.UnparsedDocument))
+
+        # Collections are recognized once parsed.
+        employees = self._client.do_GET('/employees')
+        self.failUnless(isinstance(employees._rootNode, xutil.UnparsedDocument))
+        self.failUnlessEqual(len(employees), 1)
+        self.failUnlessEqual(employees[0].name, doc.employee.name)
+
+        # Bodies spooled to disk are parsed from a file of their own, not
+        # read into memory or kept open.
+        tmpdir = tempfile.mkdtemp()
+        try:
+            client = HTTPClient(self.server.geturi('/api/'), spoolSize=16,
+                spoolDir=tmpdir, maxCacheBytes=10 ** 9)
+            employee = client.do_GET(uri)
+            root = employee._rootNode
+            self.failUnless(isinstance(root, xutil.UnparsedDocument))
+            self.failUnlessEqual(root.body, None)
+            self.failUnlessEqual(os.listdir(tmpdir),
+                [ os.path.basename(root.path), ])
+            self.failUnlessEqual(client.cache.stats()['bytes'],
+                xutil.NODE_SIZE)
+            self.failUnlessEqual(employee.id, uri)
+
+            # The cache counts the parsed tree once it has been built.
+            self.failUnlessEqual(employee.name, doc.employee.name)
+            self.failUnlessEqual(client.cache.stats()['bytes'],
+                xutil.sizeof(employee._rootNode))
+            self.failUnless(client.cache.stats()['bytes'] > xutil.NODE_SIZE)
+
+            # The file goes away with the unparsed document.
+            del root
+            self.failUnlessEqual(os.listdir(tmpdir), [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testLazyPagedCollection(self):
+        fields = ('<count>1</count><limit>1</limit><per_page>1</per_page>'
+            '<num_pages>1</num_pages><next_page/><previous_page/>'
+            '<start_index>0</start_index><end_index>0</end_index>')
+        uri = self._client._normalize_uri('/employees;start_index=0')
+        full = self._client._normalize_uri('/employees')
+
+        # Paging fields held in child elements are found without parsing
+        # documents that don't have them.
+        body = ('<employees>%s<full_collection>%s</full_collection>'
+            '<employee id="1"/></employees>' % (fields, full))
+        root = xutil.UnparsedDocument.scan(body,
+            self._client._parse_document)
+        self.failUnless(isinstance(self._client.cache(self._client, uri,
+            root), PagedCollection))
+
+        root = xutil.UnparsedDocument.scan('<employees>%s<employee id="1"/>'
+            '</employees>' % fields, self._client._parse_document)
+        employees = self._client.cache(self._client, '/employees2', root)
+        self.failIf(isinstance(employees, PagedCollection))
+        self.failUnless(isinstance(employees._rootNode,
+            xutil.UnparsedDocument))
+
+        # A malformed document doesn't leave the cache locked.
+        root = xutil.UnparsedDocument.scan('<employees><full_collection>'
+            '</employees>', self._client._parse_document)
+        self.failUnlessRaises(Exception, self._client.cache, self._client,
+            '/employees3', root)
+        thread = Thread(target=self._client.cache.clear)
+        thread.start()
+        thread.join(10)
+        self.failIf(thread.isAlive())
+
+    def testIterparseGET(self):
+        for name in ('employee1.xml', 'employee2.xml', 'employee3.xml'):
+            doc = xobj.parse(self.getArchiveContents(name))
+            self._client.do_POST('/employees', doc)
+
+        employees = self._client.do_GET('/employees', cache=False)
+        collection = self._client.do_GET('/employees', iterparse=True)
+        self.failUnless(isinstance(collection, StreamingCollection))
+
+        # Members are instances, cached like those of a regular collection.
+        items = list(collection)
+        self.failUnlessEqual(collection.tag, 'employees')
+        self.failUnlessEqual([ x.name for x in items ],
+            [ x.name for x in employees ])
+        self.failUnless(items[0] is self._client.do_GET(employees[0].id))
+
+        # The response is consumed while iterating.
+        self.failUnlessRaises(ValueError, list, collection)
+        stats = self._client._client.connectionStats().values()[0]
+        self.failUnlessEqual(stats['active'], 0)
+
+    def testIterparseReferences(self):
+        for name in ('employee1.xml', 'employee2.xml', 'employee3.xml'):
+            doc = xobj.parse(self.getArchiveContents(name))
+            self._client.do_POST('/employees', doc)
+        employees = self._client.do_GET('/employees', cache=False)
+
+        # Members that are only references are retrieved while the stream is
+        # open, which must not wait for the connection the stream holds.
+        collection = self._client.do_GET('/employeerefs', iterparse=True,
+            cache=False)
+        items = list(collection)
+        self.failUnlessEqual([ x.name for x in items ],
+            [ x.name for x in employees ])
+        stats = self._client._client.connectionStats().values()[0]
+        self.failUnlessEqual(stats['active'], 0)
+
+    def testDownload(self):
+        doc = xobj.parse(self.getArchiveContents('employee1.xml'))
+        uri = self._client._normalize_uri(
+            self._client.do_POST('/employees', doc).id)
+        data = '\x00\x01' * 100000
+        self._client.do_POST(uri + '/file', data)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # Downloads to a path replace the file once complete.
+            path = os.path.join(tmpdir, 'file')
+            open(path, 'w').write('old')
+            digest = util.MultiDigest(['md5', 'sha256'])
+            size = self._client.download(uri + '/file', path, bufferSize=4096,
+                digest=digest)
+            self.failUnlessEqual(size, len(data))
+            self.failUnlessEqual(digest.hexdigests()['sha256'],
+                hashlib.sha256(data).hexdigest())
+            self.failUnlessEqual(open(path).read(), data)
+            self.failUnlessEqual(os.listdir(tmpdir), [ 'file', ])
+            self.failUnlessEqual(stat.S_IMODE(os.stat(path).st_mode),
+                0666 & ~util.getUmask())
+
+            # Downloads to an open file write at the current position.
+            fobj = open(os.path.join(tmpdir, 'fobj'), 'w+')
+            fobj.write('head')
+            self._client.download(uri + '/file', fobj)
+            fobj.seek(0)
+            self.failUnlessEqual(fobj.read(), 'head' + data)
+            fobj.close()
+
+            # A failed download leaves the existing file alone.
+            self.failUnlessRaises(errors.HTTPNotFoundError,
+                self._client.download, uri + '/missing', path)
+            self.failUnlessEqual(open(path).read(), data)
+            self.failUnlessEqual(sorted(os.listdir(tmpdir)),
+                [ 'file', 'fobj', ])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testPreallocate(self):
+        if util._fallocate is None:
+            raise testsuite.SkipTestException('posix_fallocate is not '
+                'available')
+
+        fobj = util.mktemp()
+        util.preallocate(fobj.fileno(), 1024 * 1024)
+        st = os.fstat(fobj.fileno())
+        self.failUnlessEqual(st.st_size, 1024 * 1024)
+        self.failUnless(st.st_blocks * 512 >= 1024 * 1024)
+        fobj.close()
+
+    def testRangedDownload(self):
+        self.server.ranges = True
+        self.server.conditional = True
+
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=4)
+        doc = xobj.parse(self.getArchiveContents('employee1.xml'))
+        uri = client._normalize_uri(client.do_POST('/employees', doc).id)
+        data = ''.join(chr(x % 251) for x in range(300000))
+        client.do_POST(uri + '/file', data)
+
+        ranges = []
+        do_GET = client._client.do_GET
+        def record_GET(uri, headers=None, **kwargs):
+            ranges.append((headers or {}).get('Range'))
+            return do_GET(uri, headers=headers, **kwargs)
+        client._client.do_GET = record_GET
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'file')
+            self.failUnlessEqual(
+                client.download(uri + '/file', path, parts=4), len(data))
+            self.failUnlessEqual(open(path).read(), data)
+            self.failUnlessEqual(os.listdir(tmpdir), [ 'file', ])
+            self.failUnlessEqual(sorted(ranges), [ 'bytes=0-0',
+                'bytes=0-74999', 'bytes=150000-224999', 'bytes=225000-299999',
+                'bytes=75000-149999', ])
+            self.failUnlessEqual(stat.S_IMODE(os.stat(path).st_mode),
+                0666 & ~util.getUmask())
+
+            # An interrupted download picks up where it left off.
+            download_range = client._download_range
+            def fail_range(uri, partial, state, lock, start, *args, **kwargs):
+                if start:
+                    raise RuntimeError('interrupted')
+                return download_range(uri, partial, state, lock, start,
+                    *args, **kwargs)
+            client._download_range = fail_range
+
+            os.unlink(path)
+            self.failUnlessRaises(RuntimeError, client.download,
+                uri + '/file', path, parts=4)
+            self.failIf(os.path.exists(path))
+            self.failUnless(os.path.exists(path + '.part'))
+
+            # The whole file was reserved before any range was written.
+            if util._fallocate is not None:
+                st = os.stat(path + '.part')
+                self.failUnless(st.st_blocks * 512 >= len(data))
+
+            del client._download_range
+            del ranges[:]
+            client.download(uri + '/file', path, parts=4)
+            self.failUnlessEqual(open(path).read(), data)
+            self.failUnlessEqual(sorted(ranges), [ 'bytes=0-0',
+                'bytes=150000-224999', 'bytes=225000-299999',
+                'bytes=75000-149999', ])
+
+            # Ranges other than the one asked for are rejected before anything
+            # is written.
+            def shifted_GET(uri, headers=None, **kwargs):
+                if headers and headers.get('Range') == 'bytes=75000-149999':
+                    headers = dict(headers, Range='bytes=75001-150000')
+                return do_GET(uri, headers=headers, **kwargs)
+            client._client.do_GET = shifted_GET
+            os.unlink(path)
+            self.failUnlessRaises(errors.HTTPRangeError, client.download,
+                uri + '/file', path, parts=4)
+            self.failIf(os.path.exists(path))
+            fh = open(path + '.part')
+            fh.seek(75000)
+            self.failUnlessEqual(fh.read(75000), '\x00' * 75000)
+            fh.close()
+            self.failIf('75000 149999' in open(path + '.part.ranges').read())
+            client._client.do_GET = record_GET
+
+            # Servers that don't support ranges send the whole file.
+            self.server.ranges = False
+            del ranges[:]
+            client.download(uri + '/file', path, parts=4)
+            self.failUnlessEqual(open(path).read(), data)
+            self.failUnlessEqual(ranges, [ 'bytes=0-0', ])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testResumableUpload(self):
+        doc = xobj.parse(self.getArchiveContents('employee1.xml'))
+        uri = self._client._normalize_uri(
+            self._client.do_POST('/employees', doc).id)
+
+        data = ''.join(chr(x % 251) for x in range(100000))
+        fobj = util.mktemp()
+        fobj.write(data)
+        fobj.flush()
+
+        progress = []
+        digest = hashlib.md5()
+        upload = HTTPData(data=fobj, resumable=True, segmentSize=30000,
+            callback=lambda total, rate: progress.append(total), digest=digest)
+        self.failUnlessEqual(upload.size, len(data))
+
+        # Drop the connection while sending the second segment.
+        sent = []
+        do_POST = self._client._client.do_POST
+        def flaky_POST(uri, content, headers=None):
+            if isinstance(content, HTTPDataSegment):
+                sent.append(content.start)
+                if len(sent) == 2:
+                    raise socket.error(104, 'Connection reset by peer')
+            return do_POST(uri, content, headers=headers)
+        self._client._client.do_POST = flaky_POST
+
+        response = self._client.do_POST(uri + '/file', upload)
+        self.failUnlessEqual(response.status, 200)
+        self.failUnlessEqual(sent, [ 0, 30000, 30000, 60000, 90000, ])
+        self.failUnlessEqual(upload.offset, len(data))
+        self.failUnlessEqual(progress[-1], len(data))
+        self.failUnlessEqual(self._client.do_GET(uri + '/file').read(), data)
+
+        # Resent segments are only hashed once.
+        self.failUnlessEqual(digest.hexdigest(), hashlib.md5(data).hexdigest())
+
+        # The tail is sent again if the server is still missing some of the
+        # upload once the last segment has been sent.
+        sent = []
+        def lossy_POST(uri, content, headers=None):
+            if isinstance(content, HTTPDataSegment):
+                sent.append(content.start)
+                if content.start == 90000 and sent.count(90000) == 1:
+                    return do_POST(uri, '', headers={
+                        'Content-Range': 'bytes */%s' % len(data),
+                        'Content-Length': '0',
+                    })
+            return do_POST(uri, content, headers=headers)
+        self._client._client.do_POST = lossy_POST
+
+        upload = HTTPData(data=fobj, resumable=True, segmentSize=30000)
+        response = self._client.do_POST(uri + '/file', upload)
+        self.failUnlessEqual(response.status, 200)
+        self.failUnlessEqual(sent, [ 0, 30000, 60000, 90000, 90000, ])
+        self.failUnlessEqual(upload.offset, len(data))
+        self.failUnlessEqual(self._client.do_GET(uri + '/file').read(), data)
+
+        # Failures are reported once the retries run out.
+        def failing_POST(uri, content, headers=None):
+            raise socket.error(104, 'Connection reset by peer')
+        self._client._client.do_POST = failing_POST
+
+        upload = HTTPData(data=fobj, resumable=True, segmentSize=30000)
+        self.failUnlessRaises(socket.error, self._client.do_POST,
+            uri + '/file', upload)
@@ -16,7 +16,25 @@
 #
 
 
+import time
+import shutil
+import threading
+import hashlib
+import tempfile
+
+from robj.lib import util
+from robj.lib import futures
+from robj.lib import fixedhttplib
+from robj.lib import httputil
+from robj.lib.httputil import HTTPData
+from robj.lib.ratelimit import TokenBucket
+from robj.lib.ratelimit import BandwidthScheduler
+from robj.errors import HTTPChecksumError
+from robj.errors import HTTPResponseTimeout
+from robj.errors import HTTPPoolTimeoutError
 from robj.http import HTTPClient
+from robj.http.pool import ConnectionPool
+from robj.http.request import Request
 from robj_test import robjhelp as testsuite
 
 
@@ -108,3 +126,336 @@ class HTTPClientTest(testsuite.TestCase):
         req.wait()
 
         self.failUnlessEqual(req.response.status, 501)
+
+    def testWaitTimeout(self):
+        # A request that is never dispatched must time out rather than block.
+        req = Request('GET', '/api', 'http', self.server.geturi()[7:])
+        self.failUnlessRaises(HTTPResponseTimeout, req.wait, timeout=0.05)
+        self.failIf(req.completed)
+
+    def testRequestPacing(self):
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=1,
+            requestRate=20, requestBurst=1)
+
+        start = time.time()
+        for i in range(4):
+            req = client.do_GET('/')
+            req.wait()
+            self.failUnlessEqual(req.response.status, 200)
+
+        # The first request uses the burst, the other three are paced at
+        # twenty requests per second.
+        self.failUnless(time.time() - start >= 0.14)
+
+    def testSubmitGET(self):
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=4)
+        fs = [ client.submit_GET('/') for x in range(8) ]
+
+        done, pending = futures.wait(fs, timeout=30)
+        self.failIf(pending)
+
+        xml = self.getXML('/api')
+        for future in done:
+            self.failUnlessEqual(future.result().content.read(), xml)
+
+    def testConnectionPool(self):
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=4,
+            maxConnections=2)
+        fs = [ client.submit_GET('/') for x in range(8) ]
+
+        done, pending = futures.wait(fs, timeout=30)
+        self.failIf(pending)
+
+        # All workers share no more than two connections to the server.
+        stats = client.connectionStats()
+        self.failUnlessEqual(len(stats), 1)
+        stats = stats.values()[0]
+        self.failUnless(stats['created'] <= 2)
+        self.failUnlessEqual(stats['created'] + stats['reused'], 8)
+        self.failUnlessEqual(stats['active'], 0)
+        self.failUnlessEqual(stats['idle'], stats['created'])
+
+    def testConnectionPoolLimit(self):
+        pool = ConnectionPool(1, timeout=0.1)
+        key = ('http', 'localhost')
+
+        # A thread that holds a connection may go over the limit.
+        conn1 = pool.checkout(key)
+        conn2 = pool.checkout(key)
+        self.failIf(conn1 is conn2)
+        self.failUnlessEqual(pool.stats()[key]['active'], 2)
+
+        # Other threads wait for a connection and give up eventually.
+        errors = []
+        def checkout():
+            try:
+                pool.checkout(key)
+            except HTTPPoolTimeoutError, e:
+                errors.append(e)
+        t = threading.Thread(target=checkout)
+        t.start()
+        t.join(30)
+        self.failUnlessEqual(len(errors), 1)
+
+        # The extra connection is closed when it is returned.
+        pool.checkin(conn2)
+        pool.checkin(conn1)
+        stats = pool.stats()[key]
+        self.failUnlessEqual(stats['active'], 0)
+        self.failUnlessEqual(stats['idle'], 1)
+
+        # Threads that don't hold a connection get the idle one.
+        t = threading.Thread(target=checkout)
+        t.start()
+        t.join(30)
+        self.failUnlessEqual(len(errors), 1)
+
+    def testResponseSpool(self):
+        xml = self.getXML('/api')
+
+        # Small responses are kept in memory.
+        req = self.client.do_GET('/')
+        req.wait()
+        self.failIf(req.response.content.f._rolled)
+        self.failUnlessEqual(req.response.content.read(), xml)
+
+        # Larger ones are written to the spool directory.
+        tmpdir = tempfile.mkdtemp()
+        try:
+            client = HTTPClient(self.server.geturi('/api/'), maxClients=1,
+                spoolSize=len(xml) / 2, spoolDir=tmpdir)
+            req = client.do_GET('/')
+            req.wait()
+            self.failUnless(req.response.content.f._rolled)
+            self.failUnlessEqual(req.response.content.read(), xml)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testStreamGET(self):
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=1,
+            maxConnections=1)
+        xml = self.getXML('/api')
+
+        # The connection is returned to the pool once the body has been read.
+        req = client.do_GET('/', stream=True)
+        req.wait()
+        stats = client.connectionStats().values()[0]
+        self.failUnlessEqual(stats['active'], 1)
+        self.failUnlessEqual(''.join(req.response.content), xml)
+        stats = client.connectionStats().values()[0]
+        self.failUnlessEqual(stats['active'], 0)
+        self.failUnlessEqual(stats['idle'], 1)
+
+        # Closing the stream early drops the connection.
+        req = client.do_GET('/', stream=True)
+        req.wait()
+        req.response.content.read(5)
+        req.response.content.close()
+        stats = client.connectionStats().values()[0]
+        self.failUnlessEqual(stats['active'], 0)
+        self.failUnlessEqual(stats['discarded'], 1)
+
+        # Regular requests still work with the one connection.
+        req = client.do_GET('/')
+        req.wait()
+        self.failUnlessEqual(req.response.content.read(), xml)
+
+        # Requests made while reading a stream don't wait on its connection.
+        stream = client.do_GET('/', stream=True)
+        stream.wait()
+        req = client.do_GET('/')
+        req.wait()
+        self.failUnlessEqual(req.response.content.read(), xml)
+        self.failUnlessEqual(''.join(stream.response.content), xml)
+
+    def testChecksums(self):
+        xml = self.getXML('/api')
+        md5 = hashlib.md5(xml).hexdigest()
+        sha1 = hashlib.sha1(xml).hexdigest()
+
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=1,
+            digests=['md5', 'sha1'])
+        req = client.do_GET('/')
+        req.wait()
+        self.failUnlessEqual(req.response.checksums,
+            {'md5': md5, 'sha1': sha1})
+
+        # Streamed responses have checksums once the body has been read.
+        req = client.do_GET('/', stream=True)
+        req.wait()
+        self.failUnlessEqual(req.response.checksums, None)
+        self.failUnlessEqual(req.response.content.read(), xml)
+        self.failUnlessEqual(req.response.checksums['sha1'], sha1)
+
+        # Bodies are checked against the checksums sent by the server.
+        self.server.digests = True
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=1,
+            verifyDigests=True)
+        req = client.do_GET('/')
+        req.wait()
+        self.failUnlessEqual(req.response.checksums['md5'], md5)
+        self.failUnlessEqual(req.response.checksums['sha256'],
+            hashlib.sha256(xml).hexdigest())
+
+        self.server.digests = 'corrupted'
+        req = client.do_GET('/')
+        self.failUnlessRaises(HTTPChecksumError, req.wait)
+
+        req = client.do_GET('/', stream=True)
+        req.wait()
+        self.failUnlessRaises(HTTPChecksumError, req.response.content.read)
+
+    def testCompressedResponse(self):
+        xml = self.getXML('/api')
+
+        for encoding in ('gzip', 'deflate'):
+            self.server.compress = encoding
+
+            req = self.client.do_GET('/')
+            req.wait()
+            self.failUnlessEqual(req.response.getheader('content-encoding'),
+                encoding)
+            self.failUnlessEqual(req.response.content.read(), xml)
+
+            req = self.client.do_GET('/', stream=True)
+            req.wait()
+            self.failUnlessEqual(''.join(req.response.content), xml)
+
+        # Checksums sent by the server are of the compressed body, the ones
+        # asked for are of the decoded body.
+        self.server.digests = True
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=1,
+            digests=['sha1'], verifyDigests=True)
+        req = client.do_GET('/')
+        req.wait()
+        self.failUnlessEqual(req.response.checksums,
+            {'sha1': hashlib.sha1(xml).hexdigest()})
+
+        # Compression can be turned off.
+        client = HTTPClient(self.server.geturi('/api/'), maxClients=1,
+            acceptEncoding='identity')
+        req = client.do_GET('/')
+        req.wait()
+        self.failUnlessEqual(req.response.getheader('content-encoding', None),
+            None)
+        self.failUnlessEqual(req.response.content.read(), xml)
+
+    def testFileUpload(self):
+        model = self.server.data.employees.create(
+            self.getArchiveContents('employee1.xml'), '/api/employees')
+        path = model.id[len('/api'):] + '/file'
+
+        data = ''.join(chr(x % 251) for x in range(3 * 1024 * 1024))
+        fobj = util.mktemp()
+        fobj.write(data)
+
+        # Regular files are sent in large spans by the connection.
+        progress = []
+        digest = hashlib.md5()
+        req = self.client.do_POST(path, HTTPData(data=fobj, size=len(data),
+            callback=lambda total, rate: progress.append(total),
+            digest=digest))
+        req.wait()
+        self.failUnlessEqual(req.response.status, 200)
+        self.failUnlessEqual(self._getFile(path), data)
+        self.failUnless(len(progress) < 10)
+        self.failUnlessEqual(progress[-1], len(data))
+        self.failUnlessEqual(digest.hexdigest(), hashlib.md5(data).hexdigest())
+
+        # Files passed directly are sent the same way.
+        fobj.seek(0)
+        req = self.client.do_POST(path, fobj)
+        req.wait()
+        self.failUnlessEqual(self._getFile(path), data)
+
+    def testSendfile(self):
+        if not fixedhttplib.HTTPConnection.useSendfile:
+            raise testsuite.SkipTestException, 'sendfile is not available'
+
+        model = self.server.data.employees.create(
+            self.getArchiveContents('employee1.xml'), '/api/employees')
+        path = model.id[len('/api'):] + '/file'
+
+        data = ''.join(chr(x % 251) for x in range(3 * 1024 * 1024))
+        fobj = util.mktemp()
+        fobj.write(data)
+        fobj.seek(0)
+
+        # Regular files without a digest to update go through the kernel.
+        calls = []
+        sendfile = fixedhttplib._sendfile
+        def countingSendfile(*args):
+            calls.append(args)
+            return sendfile(*args)
+        fixedhttplib._sendfile = countingSendfile
+        try:
+            req = self.client.do_POST(path, HTTPData(data=fobj,
+                size=len(data)))
+            req.wait()
+        finally:
+            fixedhttplib._sendfile = sendfile
+
+        self.failUnlessEqual(req.response.status, 200)
+        self.failUnless(calls)
+        self.failUnlessEqual(self._getFile(path), data)
+
+    def _getFile(self, path):
+        req = self.client.do_GET(path)
+        req.wait()
+        return req.response.content.read()
+
+    def testTokenBucketClock(self):
+        bucket = TokenBucket(10, burst=1)
+
+        # The wall clock going back doesn't drain the bucket.
+        bucket._refill(bucket._last - 3600)
+        self.failUnlessEqual(bucket._tokens, 1)
+        self.failUnlessEqual(bucket.reserve(), 0)
+
+    def testBandwidthScheduler(self):
+        scheduler = BandwidthScheduler(downloadRate=1000, hostDownloadRate=500)
+        up, down = BandwidthScheduler.UPLOAD, BandwidthScheduler.DOWNLOAD
+
+        # Uploads are not limited.
+        self.failUnlessEqual(scheduler.throttler(up, 'a'), None)
+        self.failUnlessEqual(scheduler.reserve(up, 'a', 10 ** 6), 0)
+
+        # Each host gets half of the overall budget, hosts share the rest.
+        self.failUnlessEqual(scheduler.reserve(down, 'a', 50), 0)
+        self.failUnless(scheduler.reserve(down, 'a', 500) > 0.9)
+        self.failUnless(scheduler.reserve(down, 'b', 500) > 0.9)
+
+    def testBandwidthLimit(self):
+        xml = self.getXML('/api')
+        rate = len(xml) * 4
+
+        # Two clients share one budget, so eight responses take about two
+        # seconds.
+        scheduler = BandwidthScheduler(downloadRate=rate)
+        clients = [ HTTPClient(self.server.geturi('/api/'), maxClients=2,
+            bandwidth=scheduler) for x in range(2) ]
+
+        start = time.time()
+        fs = [ x.submit_GET('/') for x in clients for y in range(4) ]
+        done, pending = futures.wait(fs, timeout=30)
+        self.failIf(pending)
+        self.failUnless(time.time() - start > 1.5)
+
+        for future in done:
+            self.failUnlessEqual(future.result().content.read(), xml)
+
+    def testRangeValidator(self):
+        class Headers(dict):
+            def getheader(self, name, default=None):
+                return self.get(name, default)
+
+        modified = 'Tue, 15 Nov 1994 12:45:26 GMT'
+        self.failUnlessEqual(httputil.getRangeValidator(
+            Headers(etag='"abc"', **{'last-modified': modified})), '"abc"')
+
+        # Weak ETags can't be used in If-Range.
+        self.failUnlessEqual(httputil.getRangeValidator(
+            Headers(etag='W/"abc"', **{'last-modified': modified})), modified)
+        self.failUnlessEqual(httputil.getRangeValidator(
+            Headers(etag='W/"abc"')), None)
+        self.failUnlessEqual(httputil.getRangeValidator(Headers()), None)
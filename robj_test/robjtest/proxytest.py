@@ -161,6 +161,33 @@ class rObjProxyTest(testsuite.TestCase):
         employee.refresh()
         self.failUnless(address is employee.address)
 
+    def testConditionalRefresh(self):
+        self.server.conditional = True
+        employee = self.POST('employee2.xml', '/api/employees')
+
+        # The first refresh picks up the validators.
+        employee.refresh()
+        self.failUnless(employee._validators[0])
+
+        # Nothing has changed, so the server answers with a 304 and the
+        # existing object tree is kept.
+        root = employee._root
+        employee.refresh()
+        self.failUnless(root is employee._root)
+
+        # Once the resource changes on the server it is fetched again.
+        self.getModel(employee.id).name = 'Changed'
+        employee.refresh()
+        self.failIf(root is employee._root)
+        self.failUnlessEqual(employee.name, 'Changed')
+
+        # Forcing a refresh of a modified instance always fetches it.
+        root = employee._root
+        employee.name = 'George'
+        employee.refresh(force=True)
+        self.failIf(root is employee._root)
+        self.failUnlessEqual(employee.name, 'Changed')
+
     def testFileInteractions(self):
         # Start with an employee that we can then attach a file to.
         employee = self.POST('employee2.xml', '/api/employees')
@@ -342,6 +369,21 @@ class CollectionTest(testsuite.TestCase):
 
         self.failUnlessEqual(len(empl), 3)
 
+    def testSubmitIter(self):
+        client = HTTPClient(self.server.geturi('/api'), maxClients=4)
+        api = client.do_GET('/')
+
+        employees = api.submit_getattr('employees').result()
+        self.failUnless(employees is api.employees)
+
+        employees.append(self.getArchiveModel('employee1.xml'))
+        employees.append(self.getArchiveModel('employee2.xml'))
+
+        fs = employees.submit_iter()
+        self.failUnlessEqual(len(fs), 2)
+        self.failUnlessEqual([ x.result().employeeid for x in fs ],
+            [ x.employeeid for x in employees ])
+
     def testSingleItemList(self):
         employees = self.api.employees
         employees.append(self.getArchiveModel('employee1.xml'))
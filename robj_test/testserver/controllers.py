@@ -15,13 +15,68 @@
 #
 
 
+import json
+import zlib
 from SimpleHTTPServer import SimpleHTTPRequestHandler
+from xml.etree import ElementTree
 
 from xobj import xobj
 
 from robj_test.testserver import models
 from robj_test.testserver.datastore import AttrDict
 
+def _tojson(elem):
+    children = list(elem)
+    if not children and not elem.attrib:
+        return elem.text or ''
+
+    value = dict(('@%s' % x, y) for x, y in elem.attrib.items())
+    for child in children:
+        item = _tojson(child)
+        if child.tag not in value:
+            value[child.tag] = item
+        elif isinstance(value[child.tag], list):
+            value[child.tag].append(item)
+        else:
+            value[child.tag] = [ value[child.tag], item ]
+
+    if elem.text and elem.text.strip():
+        value['#text'] = elem.text
+    return value
+
+def toJSON(message):
+    """
+    Convert an XML document to JSON.
+    """
+
+    root = ElementTree.fromstring(message)
+    return json.dumps({root.tag: _tojson(root)})
+
+def _toxml(elem, value):
+    if isinstance(value, dict):
+        for key, item in value.iteritems():
+            if key == '#text':
+                elem.text = item
+            elif key.startswith('@'):
+                elem.set(key[1:], unicode(item))
+            else:
+                for x in isinstance(item, list) and item or [ item, ]:
+                    _toxml(ElementTree.SubElement(elem, key), x)
+    elif value is not None:
+        elem.text = unicode(value)
+
+def fromJSON(body):
+    """
+    Convert a JSON document to XML.
+    """
+
+    (tag, value), = json.loads(body).items()
+    root = ElementTree.Element(tag)
+    _toxml(root, value)
+    return ("<?xml version='1.0' encoding='UTF-8'?>\n" +
+        ElementTree.tostring(root))
+
+
 class Response(object):
     def __init__(self, doc=None, code=200, model=None, tag=None, headers=None):
         if not headers:
@@ -124,6 +179,18 @@ class AbstractController(object):
     def do_DELETE(self): return Response(code=501)
 
     def _getinput(self):
+        input = self._getbody()
+
+        encoding = self.handler.headers.getheader('content-encoding', None)
+        if encoding and encoding.lower() == 'gzip':
+            input = zlib.decompress(input, 16 + zlib.MAX_WBITS)
+
+        contentType = self.handler.headers.getheader('content-type', None)
+        if contentType == 'application/json':
+            input = fromJSON(input)
+        return input
+
+    def _getbody(self):
         te = self.handler.headers.getheader('transfer-encoding', None)
         if not te or te.lower() != 'chunked':
             length = int(self.handler.headers.getheader('content-length'))
@@ -234,12 +301,43 @@ class EmployeeFile(AbstractController):
         idx = self.pathVars.idx
         if idx not in self.data.employees:
             return Response(code=404)
-        else:
-            self.data.employees.files[idx] = self._getinput()
-            return Response(code=200)
+
+        contentRange = self.handler.headers.getheader('content-range', None)
+        if contentRange:
+            return self._putRange(idx, contentRange)
+
+        self.data.employees.files[idx] = self._getinput()
+        return Response(code=200)
 
     do_PUT = do_POST
 
+    def _putRange(self, idx, contentRange):
+        """
+        Handle one segment of a resumable upload. Incomplete uploads are
+        acknowledged with a 202 and a Range header, since BaseHTTPServer
+        doesn't know about 308.
+        """
+
+        uploads = self.data.employees.uploads
+        span, total = contentRange[len('bytes '):].split('/')
+        received = uploads.get(idx, '')
+
+        if span != '*':
+            start, end = [ int(x) for x in span.split('-') ]
+            data = self._getinput()
+            if start > len(received):
+                return Response(code=416)
+            received = uploads[idx] = received[:start] + data
+
+        if len(received) < int(total):
+            headers = {}
+            if received:
+                headers['Range'] = 'bytes=0-%s' % (len(received) - 1)
+            return Response(code=202, headers=headers)
+
+        self.data.employees.files[idx] = uploads.pop(idx)
+        return Response(code=200)
+
     def do_DELETE(self):
         idx = self.pathVars.idx
         if (idx not in self.data.employees or
@@ -300,6 +398,17 @@ class Employees(AbstractCollectionController):
 controllers.register(Employees)
 
 
+class EmployeeRefs(AbstractController):
+    __uri__ = '/api/employeerefs'
+
+    def do_GET(self):
+        refs = ''.join([ '<employee href="%s"/>' % x.id
+            for x in sorted(self.data.employees.itervalues()) ])
+        return Response(code=200, doc="<?xml version='1.0' encoding='UTF-8'?>"
+            "\n<employees>%s</employees>" % refs)
+controllers.register(EmployeeRefs)
+
+
 class ProductEmployees(Employees):
     __uri__ = '/api/products/{idx}/employees'
 
@@ -57,6 +57,7 @@ class Employees(AbstractModelCollection):
     def __init__(self):
         AbstractModelCollection.__init__(self)
         self.files = AttrDict()
+        self.uploads = AttrDict()
         self.productRefs = AttrDict()
 
     def parse(self, xml):
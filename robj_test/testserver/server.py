@@ -16,13 +16,19 @@
 
 
 import os
+import gzip
+import zlib
+import base64
+import hashlib
 import logging
+from StringIO import StringIO
 from threading import Thread
 from BaseHTTPServer import HTTPServer
 from BaseHTTPServer import BaseHTTPRequestHandler
 
 from robj_test.testserver import models
 from .datastore import DataStore
+from .controllers import toJSON
 from .controllers import controllers
 
 log = logging.getLogger('robj.test.testserver')
@@ -39,6 +45,29 @@ class RESTServer(HTTPServer):
         self.data = DataStore()
         self.controllers = controllers
 
+        # Send ETags with GET responses and honor If-None-Match.
+        self.conditional = False
+
+        # Value of the Cache-Control header to send with GET responses.
+        self.cacheControl = None
+
+        # Serve byte ranges of GET responses.
+        self.ranges = False
+
+        # Send Content-MD5 and Digest headers with GET responses. If this is
+        # a string the checksums are computed from it instead of the body.
+        self.digests = False
+
+        # Content coding, gzip or deflate, to compress GET responses with
+        # when the client accepts it.
+        self.compress = None
+
+        # Accept gzip compressed request bodies, otherwise answer 415.
+        self.compressedRequests = True
+
+        # Send documents as JSON to clients that accept it.
+        self.json = False
+
     @property
     def port(self):
         return self.server_address[1]
@@ -67,6 +96,48 @@ class RESTRequestHandler(BaseHTTPRequestHandler):
         if self.debug:
             log.error(format, *args)
 
+    def _get_range(self, message):
+        """
+        Find the byte range of message requested with a Range header.
+        @return: (status, content range, body) or None to send the whole
+                 message.
+        """
+
+        header = self.headers.getheader('range')
+        if not header or not header.startswith('bytes=') or ',' in header:
+            return None
+
+        # Only honor the range if the resource hasn't changed.
+        ifRange = self.headers.getheader('if-range')
+        if ifRange and ifRange != '"%s"' % hashlib.md5(message).hexdigest():
+            return None
+
+        length = len(message)
+        start, end = header[len('bytes='):].split('-', 1)
+        try:
+            if not start:
+                start, end = max(length - int(end), 0), length - 1
+            else:
+                start, end = int(start), min(int(end or length - 1), length - 1)
+        except ValueError:
+            return None
+
+        if start >= length or start > end:
+            return 416, 'bytes */%s' % length, ''
+
+        return (206, 'bytes %s-%s/%s' % (start, end, length),
+            message[start:end + 1])
+
+    def _compress(self, message, encoding):
+        if encoding == 'deflate':
+            return zlib.compress(message)
+
+        buf = StringIO()
+        fobj = gzip.GzipFile(fileobj=buf, mode='wb')
+        fobj.write(message)
+        fobj.close()
+        return buf.getvalue()
+
     def _handle_request(self):
         """
         Handle all types of supported methods.
@@ -81,6 +152,13 @@ class RESTRequestHandler(BaseHTTPRequestHandler):
             controller = ControllerClass(self.server.data, self,
                 pathVars=pathVars)
 
+            if (self.headers.getheader('content-encoding') and
+                not self.server.compressedRequests):
+                controller._getbody()
+                self.send_error(415)
+                self.wfile.close()
+                return
+
             method = getattr(controller, 'do_%s' % self.command)
             response = method()
 
@@ -89,9 +167,62 @@ class RESTRequestHandler(BaseHTTPRequestHandler):
                 self.wfile.close()
                 return
 
-            self.send_response(response.code)
-            self.send_header('Content-type', 'text/xml')
-            self.send_header('Content-length', len(response.message))
+            message = response.message
+
+            contentType = 'text/xml'
+            if (self.server.json and message.startswith('<?xml') and
+                'application/json' in (self.headers.getheader('accept') or '')):
+                contentType = 'application/json'
+                message = toJSON(message)
+
+            etag = None
+            if self.server.conditional and self.command == 'GET':
+                etag = '"%s"' % hashlib.md5(message).hexdigest()
+                if self.headers.getheader('if-none-match') == etag:
+                    self.send_response(304)
+                    self.send_header('ETag', etag)
+                    if self.server.cacheControl:
+                        self.send_header('Cache-Control',
+                            self.server.cacheControl)
+                    self.end_headers()
+                    self.wfile.close()
+                    return
+
+            code = response.code
+            contentRange = None
+            if self.server.ranges and self.command == 'GET' and code == 200:
+                selected = self._get_range(message)
+                if selected:
+                    code, contentRange, message = selected
+
+            encoding = None
+            if (self.server.compress and self.command == 'GET' and
+                not contentRange and self.server.compress in
+                (self.headers.getheader('accept-encoding') or '')):
+                encoding = self.server.compress
+                message = self._compress(message, encoding)
+
+            self.send_response(code)
+            self.send_header('Content-type', contentType)
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.send_header('Content-length', len(message))
+            if etag:
+                self.send_header('ETag', etag)
+            if self.server.ranges and self.command == 'GET':
+                self.send_header('Accept-Ranges', 'bytes')
+            if contentRange:
+                self.send_header('Content-Range', contentRange)
+            if self.server.cacheControl and self.command == 'GET':
+                self.send_header('Cache-Control', self.server.cacheControl)
+            if self.server.digests and self.command == 'GET':
+                digested = message
+                if isinstance(self.server.digests, str):
+                    digested = self.server.digests
+                self.send_header('Content-MD5',
+                    base64.b64encode(hashlib.md5(digested).digest()))
+                self.send_header('Digest', 'SHA-256=%s' %
+                    base64.b64encode(hashlib.sha256(digested).digest()))
 
             # write any headers specified by the response
             for key, val in response.iterheaders():
@@ -99,7 +230,7 @@ class RESTRequestHandler(BaseHTTPRequestHandler):
 
             self.end_headers()
 
-            self.wfile.write(response.message)
+            self.wfile.write(message)
             self.wfile.close()
 
         except Exception, e: